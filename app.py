@@ -6,9 +6,18 @@ from rapidfuzz import fuzz, process
 import io
 import re
 import zipfile
+from itertools import chain
 from datetime import datetime
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+# Движок чтения Excel: python-calamine (Rust) в разы быстрее openpyxl,
+# но это необязательная зависимость - без нее pandas выбирает движок сам (openpyxl для .xlsx)
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_READ_ENGINE = "calamine"
+except ImportError:
+    EXCEL_READ_ENGINE = None
 
 # Security utilities
 from security_utils import (
@@ -24,6 +33,7 @@ from security_utils import (
     cleanup_session_state,
     check_session_state_limits,
     handle_production_error,
+    get_file_hash,
     MAX_FILE_SIZE,
     MAX_FILES_COUNT,
     ALLOWED_FILE_EXTENSIONS
@@ -32,7 +42,7 @@ from requests.exceptions import RequestException, Timeout, HTTPError
 
 # Safe file operations
 from safe_file_utils import (
-    safe_open_image,
+    safe_read_image_bytes,
     safe_read_csv,
     safe_read_file
 )
@@ -42,6 +52,7 @@ from modules.matching import (
     normalize_city_name,
     extract_city_and_region,
     get_candidates_by_word,
+    build_name_ngram_index,
     PREFERRED_MATCHES,
     EXCLUDED_EXACT_MATCHES
 )
@@ -60,8 +71,19 @@ from modules.data_processing import (
 # Utility functions module
 from modules.utils import (
     get_russian_cities,
+    get_russian_city_index,
+    get_hh_lookup,
+    get_status_masks,
+    category_isin,
+    group_manual_selections,
+    prepare_editable_rows,
     remove_header_row_if_needed,
-    check_if_changed
+    check_if_changed,
+    build_export_frame,
+    drop_duplicate_cities,
+    select_export_rows,
+    normalize_city_names,
+    apply_unified_mapping
 )
 
 # City matcher module
@@ -77,9 +99,16 @@ from modules.export_utils import (
     create_publisher_excel,
     create_full_report_excel,
     create_zip_archive,
-    create_result_excel
+    create_excel_zip_archive,
+    create_result_excel,
+    make_unique_filenames,
+    write_excel_rows
 )
 
+# Сколько строк списка городов показывать в превью: st.dataframe передает в браузер
+# всю таблицу, полный список остается в файлах выгрузки
+CITY_PREVIEW_ROWS = 500
+
 # ============================================
 # PERFORMANCE OPTIMIZATION: Cached Functions
 # ============================================
@@ -101,13 +130,248 @@ def get_russian_cities_cached(_hh_areas: Dict) -> List[str]:
     return get_russian_cities(_hh_areas)
 
 
+@st.cache_resource(show_spinner=False)
+def get_russian_city_index_cached(_hh_areas: Dict) -> Tuple[List[str], List[str]]:
+    """
+    Кэшированный индекс российских городов: названия и нормализованные названия.
+
+    ОПТИМИЗАЦИЯ: справочник (~18,000 записей) фильтруется и нормализуется один раз
+    на процесс, а не при каждом сопоставлении и поиске кандидатов.
+    cache_resource отдает один и тот же объект без копирования - списки НЕ изменять.
+
+    Args:
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+
+    Returns:
+        Tuple[List[str], List[str]]: (названия городов России, нормализованные названия)
+    """
+    return get_russian_city_index(_hh_areas)
+
+
+@st.cache_resource(show_spinner=False)
+def get_hh_lookup_cached(_hh_areas: Dict) -> pd.DataFrame:
+    """
+    Кэшированная таблица справочника HH: название -> ID HH и Регион.
+
+    ОПТИМИЗАЦИЯ: таблица и хэш-таблица ее индекса строятся один раз на процесс;
+    ручные изменения подставляют ID и регион одним get_indexer вместо обращения
+    к словарю для каждого значения.
+    cache_resource отдает один и тот же объект без копирования - таблицу НЕ изменять.
+
+    Args:
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+
+    Returns:
+        pd.DataFrame: Столбцы 'ID HH' и 'Регион', индекс - названия из справочника
+    """
+    return get_hh_lookup(_hh_areas)
+
+
+@st.cache_resource(show_spinner=False)
+def get_russian_city_ngram_index_cached(_hh_areas: Dict) -> Dict[str, List[int]]:
+    """
+    Кэшированный индекс триграмм нормализованных названий городов России.
+
+    ОПТИМИЗАЦИЯ: строится один раз на процесс; поиск кандидатов по слову
+    проверяет подстроку только у названий, содержащих все триграммы слова,
+    вместо перебора всего справочника для каждого города.
+    cache_resource отдает один и тот же объект без копирования - индекс НЕ изменять.
+
+    Args:
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+
+    Returns:
+        Dict[str, List[int]]: {триграмма: позиции в get_russian_city_index_cached}
+    """
+    return build_name_ngram_index(get_russian_city_index_cached(_hh_areas)[1])
+
+
+@st.cache_resource(show_spinner=False)
+def get_sorted_russian_cities_cached(_hh_areas: Dict) -> Tuple[str, ...]:
+    """
+    Кэшированный отсортированный список городов России для selectbox/multiselect.
+
+    ОПТИМИЗАЦИЯ: фильтрация и сортировка справочника выполняются один раз на процесс,
+    а не при каждом rerun в каждом селекторе "Добавить город". Кортеж неизменяемый,
+    поэтому один объект безопасно переиспользуется всеми виджетами.
+
+    Args:
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+
+    Returns:
+        Tuple[str, ...]: Отсортированные названия городов России
+    """
+    return tuple(sorted(get_russian_city_index_cached(_hh_areas)[0]))
+
+
+@st.cache_resource(show_spinner=False, ttl=3600)
+def get_all_cities_cached(_hh_areas: Dict) -> pd.DataFrame:
+    """
+    Кэшированная таблица всех городов России (get_all_cities).
+
+    ОПТИМИЗАЦИЯ: блок выбора регионов запрашивает таблицу при каждом rerun.
+    cache_resource отдает один и тот же DataFrame без сборки, удаления дубликатов
+    и pickle-копии; ttl совпадает со временем жизни справочника HH.ru.
+    Результат только читается - не изменять (фильтры создают новые DataFrame).
+
+    Args:
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+
+    Returns:
+        pd.DataFrame: Таблица городов (Город, ID HH, Регион, UTC, ...)
+    """
+    # Город и UTC категориальные: выбор городов/часовых поясов сравнивает целые коды (category_isin)
+    return get_all_cities(_hh_areas).astype({'Город': 'category', 'UTC': 'category'})
+
+
+@st.cache_resource(show_spinner=False, ttl=3600)
+def get_city_options_cached(_hh_areas: Dict) -> Tuple[str, ...]:
+    """
+    Кэшированный отсортированный список городов для фильтра "Выбрать город".
+
+    ОПТИМИЗАЦИЯ: сортировка нескольких тысяч названий выполняется один раз
+    на таблицу городов (get_all_cities_cached), а не при каждом rerun.
+    Кортеж неизменяемый, поэтому один объект переиспользуется всеми сессиями.
+
+    Args:
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+
+    Returns:
+        Tuple[str, ...]: Отсортированные названия городов
+    """
+    # Категории столбца - уникальные непустые названия
+    return tuple(sorted(get_all_cities_cached(_hh_areas)['Город'].cat.categories))
+
+
+@st.cache_resource(show_spinner=False)
+def get_district_options_cached() -> Tuple[Tuple[str, ...], Dict[str, str]]:
+    """
+    Кэшированные опции фильтра федеральных округов.
+
+    ОПТИМИЗАЦИЯ: FEDERAL_DISTRICTS не меняется, поэтому подписи строятся один раз
+    на процесс, а не при каждом rerun. Результат только читается - не изменять.
+
+    Returns:
+        Tuple: (options, mapping)
+            - options: подписи "Округ (N рег.)" для multiselect
+            - mapping: {подпись: название округа}
+    """
+    mapping = {f"{district} ({len(regions)} рег.)": district for district, regions in FEDERAL_DISTRICTS.items()}
+    return tuple(mapping), mapping
+
+
+@st.cache_resource(show_spinner=False)
+def get_region_options_cached(selected_districts: Tuple[str, ...]) -> Tuple[Tuple[str, ...], Dict[str, str]]:
+    """
+    Кэшированные опции фильтра регионов для выбранных федеральных округов.
+
+    ОПТИМИЗАЦИЯ: сортировка регионов и поиск округа для каждого из них выполняются
+    один раз на набор выбранных округов, а не при каждом rerun.
+    Результат только читается - не изменять.
+
+    Args:
+        selected_districts: Выбранные федеральные округа (пустой кортеж - все округа)
+
+    Returns:
+        Tuple: (options, mapping)
+            - options: подписи "Регион (ФО)" для multiselect
+            - mapping: {подпись: название региона}
+    """
+    # Формируем список доступных регионов на основе выбранных округов
+    districts = selected_districts or FEDERAL_DISTRICTS
+    available_regions = chain.from_iterable(FEDERAL_DISTRICTS[district] for district in districts)
+
+    # Форматируем регионы с указанием федерального округа
+    mapping = {}
+    for region in sorted(available_regions):
+        fed_district = get_federal_district_by_region(region)
+        if fed_district != "Не определен":
+            # Сокращаем название округа для компактности
+            district_short = fed_district.replace("Федеральный округ", "ФО").replace("федеральный округ", "ФО")
+            formatted = f"{region} ({district_short})"
+        else:
+            formatted = region
+        mapping[formatted] = region
+    return tuple(mapping), mapping
+
+
+@st.cache_resource(show_spinner=False)
+def get_timezone_options_cached(utc_values: Tuple[str, ...]) -> Tuple[Tuple[str, ...], Dict[str, str]]:
+    """
+    Кэшированные опции фильтра часовых поясов с разницей от МСК.
+
+    ОПТИМИЗАЦИЯ: смещения разбираются одним str.extract по всем значениям
+    (без try/except на каждое) и только при изменении набора часовых поясов,
+    а не при каждом rerun. Результат только читается - не изменять.
+
+    Args:
+        utc_values: Значения UTC из таблицы городов (например, "+03:00")
+
+    Returns:
+        Tuple: (options, mapping)
+            - options: подписи "+05:00 (+2ч от МСК)" для multiselect
+            - mapping: {подпись: значение UTC}
+    """
+    unique_timezones = pd.Series(
+        sorted({tz for tz in utc_values if tz and str(tz) != 'nan'}), dtype=object
+    )
+
+    # Знак и часы смещения; строки другого формата не разбираются (NaN)
+    parsed = unique_timezones.str.extract(r'^([+-])(\d{2})')
+    is_parsed = parsed[1].notna().to_numpy()
+    signs = np.where(parsed[0] == '+', 1, -1)
+    hours = pd.to_numeric(parsed[1]).fillna(0).to_numpy(dtype=int)
+    diffs_msk = signs * hours - 3  # Москва = UTC+3
+
+    mapping = {}
+    for tz, tz_parsed, diff_msk in zip(unique_timezones, is_parsed, diffs_msk.tolist()):
+        if not tz_parsed:
+            # Если не удалось распарсить, добавляем как есть
+            logger.warning(f"Не удалось распарсить timezone '{tz}'")
+            formatted = tz
+        elif diff_msk == 0:
+            formatted = f"{tz} (МСК)"
+        elif diff_msk > 0:
+            formatted = f"{tz} (+{diff_msk}ч от МСК)"
+        else:
+            formatted = f"{tz} ({diff_msk}ч от МСК)"
+        mapping[formatted] = tz
+    return tuple(mapping), mapping
+
+
 @st.cache_data(show_spinner=False)
+def get_candidates_cached(normalized_city: str, _hh_areas: Dict, limit: int = 20) -> List[Tuple[str, int]]:
+    """
+    Кэшированный поиск кандидатов для ручного выбора города.
+
+    ОПТИМИЗАЦИЯ: smart_match_city не считает кандидатов для PREFERRED_MATCHES,
+    поэтому они вычисляются здесь по требованию — только когда город реально
+    показывается в блоке редактирования, и один раз на нормализованное название.
+
+    Args:
+        normalized_city: Нормализованное название города клиента (ключ кэша)
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+        limit: Максимальное количество кандидатов
+
+    Returns:
+        List[Tuple[str, int]]: Список кандидатов (название, score)
+    """
+    hh_city_names, hh_city_names_norm = get_russian_city_index_cached(_hh_areas)
+    return get_candidates_by_word(
+        normalized_city, hh_city_names, limit=limit, hh_city_names_norm=hh_city_names_norm,
+        hh_name_ngrams=get_russian_city_ngram_index_cached(_hh_areas)
+    )
+
+
+@st.cache_resource(show_spinner=False)
 def prepare_city_options(candidates: tuple, current_value: str, current_match: float, city_name: str) -> tuple:
     """
     Кэшированная подготовка options для selectbox.
 
     ОПТИМИЗАЦИЯ: избегаем пересоздания списков и сортировки на каждом rerun.
     Используется tuple для candidates чтобы можно было кэшировать.
+    cache_resource (а не cache_data): на каждом rerun selectbox получает тот же
+    объект options без pickle-копии. Результат только читается - не изменять.
 
     Args:
         candidates: Кортеж кандидатов (city_name, match_percent)
@@ -116,9 +380,11 @@ def prepare_city_options(candidates: tuple, current_value: str, current_match: f
         city_name: Исходное название города
 
     Returns:
-        tuple: (options, candidates_dict)
+        tuple: (options, candidates_dict, option_cities)
             - options: список для selectbox
             - candidates_dict: {city_name: index} для O(1) поиска
+            - option_cities: {option: city_name} - название города по выбранной строке
+              без разбора текста "Город (90.0%)"
     """
     candidates_list = list(candidates)
 
@@ -131,16 +397,18 @@ def prepare_city_options(candidates: tuple, current_value: str, current_match: f
     # Сортируем по убыванию процента
     candidates_list.sort(key=lambda x: x[1], reverse=True)
 
-    # Формируем options
-    if candidates_list:
-        options = ["❌ Нет совпадения"] + [f"{c[0]} ({c[1]:.1f}%)" for c in candidates_list[:20]]
-    else:
-        options = ["❌ Нет совпадения"]
+    # Формируем options и обратное соответствие option -> город за один проход
+    options = ["❌ Нет совпадения"]
+    option_cities = {"❌ Нет совпадения": "❌ Нет совпадения"}
+    for candidate_name, candidate_score in candidates_list[:20]:
+        option = f"{candidate_name} ({candidate_score:.1f}%)"
+        options.append(option)
+        option_cities[option] = candidate_name
 
     # Создаём словарь для O(1) поиска индекса по названию города
     candidates_dict = {c[0]: i + 1 for i, c in enumerate(candidates_list[:20])}
 
-    return tuple(options), candidates_dict
+    return tuple(options), candidates_dict, option_cities
 
 
 @st.cache_data(show_spinner="Загрузка справочника HH.ru...", ttl=3600)
@@ -167,6 +435,82 @@ def get_hh_areas_cached() -> Optional[Dict]:
     return get_hh_areas()
 
 
+@st.cache_data(show_spinner=False)
+def read_uploaded_sheets_cached(file_bytes: bytes, file_name: str) -> Dict[str, pd.DataFrame]:
+    """
+    Кэшированное чтение загруженного файла (CSV или все вкладки Excel).
+
+    ОПТИМИЗАЦИЯ: Streamlit хэширует байты файла, поэтому пока файл не изменился,
+    разбор Excel не повторяется на каждом rerun (движение слайдера, клик и т.п.).
+
+    Args:
+        file_bytes: содержимое файла (uploaded_file.getvalue())
+        file_name: имя файла (по расширению выбирается способ чтения)
+
+    Returns:
+        Словарь {название вкладки: DataFrame без заголовков}; для CSV - одна вкладка "Sheet1".
+        Пустые вкладки Excel пропускаются
+    """
+    if file_name.endswith('.csv'):
+        return {'Sheet1': pd.read_csv(io.BytesIO(file_bytes), header=None)}
+
+    # Все вкладки читаются одним вызовом (sheet_name=None)
+    all_sheets = pd.read_excel(
+        io.BytesIO(file_bytes), sheet_name=None, header=None, engine=EXCEL_READ_ENGINE
+    )
+    # Только непустые вкладки
+    return {sheet_name: df_sheet for sheet_name, df_sheet in all_sheets.items() if len(df_sheet) > 0}
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def match_all_sheets_cached(files_key: str, threshold: int, _sheets_data: Dict, _hh_areas: Dict) -> Tuple[Dict, Dict]:
+    """
+    Кэшированное сопоставление всех вкладок загруженных файлов.
+
+    ОПТИМИЗАЦИЯ: повторное нажатие "Начать сопоставление" для тех же файлов и того же
+    порога возвращает готовый результат без повторного сопоставления.
+    Ключ кэша - хэши файлов (files_key) и threshold; сами данные не хэшируются.
+    На диск не сохраняется (persist) - это данные пользователя.
+
+    Args:
+        files_key: ключ загруженных файлов (имена + SHA256 содержимого)
+        threshold: порог совпадения
+        _sheets_data: st.session_state.sheets_data (префикс _ для bypass hashing)
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+
+    Returns:
+        Tuple[Dict, Dict]: (результаты по вкладкам, кэш кандидатов {(вкладка, row_id): кандидаты})
+    """
+    # Функция без побочных эффектов: кандидаты собираются в локальный словарь и
+    # возвращаются, а прогресс-бар не рисуется (cache_data воспроизводил бы его
+    # при каждом попадании в кэш) - вызывающий код показывает st.spinner
+    candidates_cache = {}
+
+    # Общий кэш сопоставлений: город, встречающийся в нескольких вкладках,
+    # сопоставляется один раз
+    shared_match_cache = {}
+    city_index = get_russian_city_index_cached(_hh_areas)
+
+    sheets_results = {}
+    for sheet_name, sheet_data in _sheets_data.items():
+        result_df, dup_original, dup_hh, total_dup = match_cities(
+            sheet_data['df'], _hh_areas, threshold, sheet_name=sheet_name,
+            match_cache=shared_match_cache, city_index=city_index,
+            name_ngrams=get_russian_city_ngram_index_cached(_hh_areas),
+            candidates_cache=candidates_cache, show_progress=False
+        )
+
+        sheets_results[sheet_name] = {
+            'result_df': result_df,
+            'dup_original': dup_original,
+            'dup_hh': dup_hh,
+            'total_dup': total_dup,
+            'has_vacancy_column': sheet_data['has_vacancy_column']
+        }
+
+    return sheets_results, candidates_cache
+
+
 @st.cache_data(show_spinner=False)
 def apply_manual_selections_cached(_result_df, manual_selections: dict, _hh_areas: dict, cache_key: str = "default") -> pd.DataFrame:
     """
@@ -195,44 +539,57 @@ def apply_manual_selections_cached(_result_df, manual_selections: dict, _hh_area
     if not manual_selections:
         return _result_df
 
-    final_df = _result_df.copy()
+    row_ids = _result_df['row_id']
+    selected_mask = row_ids.isin(list(manual_selections))
 
-    # Применяем ручные изменения
-    for row_id, new_value in manual_selections.items():
-        mask = final_df['row_id'] == row_id
-
-        # FIX: Проверяем что row_id существует в DataFrame
-        if mask.sum() == 0:
-            continue  # Пропускаем если строка не найдена
-
-        if new_value == "❌ Нет совпадения":
-            final_df.loc[mask, 'Итоговое гео'] = None
-            final_df.loc[mask, 'ID HH'] = None
-            final_df.loc[mask, 'Регион'] = None
-            final_df.loc[mask, 'Совпадение %'] = 0
-            final_df.loc[mask, 'Изменение'] = 'Нет'
-            final_df.loc[mask, 'Статус'] = '❌ Не найдено'
-        else:
-            final_df.loc[mask, 'Итоговое гео'] = new_value
+    # FIX: row_id, которых нет в DataFrame, пропускаются
+    if not selected_mask.any():
+        return _result_df
 
-            if new_value in _hh_areas:
-                final_df.loc[mask, 'ID HH'] = _hh_areas[new_value]['id']
-                final_df.loc[mask, 'Регион'] = _hh_areas[new_value]['parent']
+    final_df = _result_df.copy()
 
-            original = final_df.loc[mask, 'Исходное название'].values[0]
-            final_df.loc[mask, 'Изменение'] = 'Да' if check_if_changed(original, new_value) else 'Нет'
+    # ОПТИМИЗАЦИЯ: row_id → новое значение одним map по словарю (хэш-поиск)
+    # вместо отдельной маски по всему столбцу на каждое изменение
+    new_values = row_ids[selected_mask].map(manual_selections)
+    is_no_match = (new_values == "❌ Нет совпадения").to_numpy()
+
+    no_match_idx = new_values.index[is_no_match]
+    if len(no_match_idx) > 0:
+        # Одно присваивание на все столбцы: индекс строк разрешается один раз
+        final_df.loc[no_match_idx, ['Итоговое гео', 'ID HH', 'Регион', 'Совпадение %', 'Изменение', 'Статус']] = [
+            None, None, None, 0, 'Нет', '❌ Не найдено'
+        ]
+
+    matched_values = new_values[~is_no_match]
+    if len(matched_values) > 0:
+        final_df.loc[matched_values.index, 'Итоговое гео'] = matched_values
+
+        # ID и регион - только для городов из справочника (поиск по индексу таблицы HH)
+        hh_lookup = get_hh_lookup_cached(_hh_areas)
+        positions = hh_lookup.index.get_indexer(matched_values)
+        in_hh = positions >= 0
+        if in_hh.any():
+            final_df.loc[matched_values.index[in_hh], ['ID HH', 'Регион']] = hh_lookup.to_numpy()[positions[in_hh]]
+
+        originals = final_df.loc[matched_values.index, 'Исходное название']
+        final_df.loc[matched_values.index, 'Изменение'] = [
+            'Да' if check_if_changed(original, new_value) else 'Нет'
+            for original, new_value in zip(originals, matched_values)
+        ]
 
     return final_df
 
 # Version: 3.3.2 - Fixed: corrected all indentation in single mode block
 
-@st.cache_data(show_spinner=False)
+@st.cache_resource(show_spinner=False)
 def get_cached_icon_base64(filename: str) -> Optional[str]:
     """
     Кэшированная загрузка иконки и конвертация в base64.
 
     ОПТИМИЗАЦИЯ: иконки загружаются 1 раз при старте вместо каждого rerun.
     Экономия: ~10-20ms на каждую иконку при каждом rerun.
+    cache_resource (а не cache_data): строка неизменяемая, поэтому на rerun
+    возвращается тот же объект без pickle-копии ~200 KB.
 
     Args:
         filename: имя файла иконки
@@ -240,15 +597,15 @@ def get_cached_icon_base64(filename: str) -> Optional[str]:
     Returns:
         base64 строка или None
     """
-    from io import BytesIO
     import base64
-
-    icon_image = safe_open_image(filename)
-    if icon_image:
-        buffered = BytesIO()
-        icon_image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        return f"data:image/png;base64,{img_base64}"
+    import mimetypes
+
+    # Байты файла кодируются в base64 как есть: без декодирования PIL и пересохранения в PNG
+    icon_bytes = safe_read_image_bytes(filename)
+    if icon_bytes:
+        mime_type = mimetypes.guess_type(filename)[0] or "image/png"
+        img_base64 = base64.b64encode(icon_bytes).decode()
+        return f"data:{mime_type};base64,{img_base64}"
     return None
 
 
@@ -261,15 +618,91 @@ def create_excel_bytes_cached(df: pd.DataFrame, sheet_name: str) -> bytes:
     - Избегает пересоздания Excel файла при каждом rerun, если данные не изменились.
     - Решает проблему "подвисания" при переключении вкладок и выборе городов.
     """
-    # Санитизация данных перед экспортом (защита от CSV Injection)
-    safe_df = sanitize_csv_content(df)
+    # Санитизация данных перед экспортом (защита от CSV Injection) - на копии,
+    # чтобы не менять DataFrame вызывающего кода (иначе результат зависел бы от состояния кэша)
+    safe_df = sanitize_csv_content(df.copy())
     
+    # ОПТИМИЗАЦИЯ: потоковая запись (openpyxl write_only) без дерева ячеек в памяти
     buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        safe_df.to_excel(writer, index=False, header=True, sheet_name='Результат')
+    write_excel_rows(buffer, safe_df, 'Результат')
     return buffer.getvalue()
 
 
+@st.cache_data(show_spinner=False, ttl=900, max_entries=32)
+def create_city_reports_cached(df: pd.DataFrame) -> Tuple[bytes, bytes]:
+    """
+    Кэшированная генерация обеих выгрузок списка городов: для публикатора и полного отчета.
+
+    ОПТИМИЗАЦИЯ: кнопки скачивания создаются при каждом rerun, а книги
+    формируются только при изменении DataFrame - остальные rerun берут байты из кэша.
+    Обе книги строятся в одном вызове: DataFrame хэшируется и санитизируется один раз.
+    max_entries и ttl ограничивают память под байты выгрузок.
+
+    Args:
+        df: DataFrame городов со столбцом 'Город' (не изменяется)
+
+    Returns:
+        Tuple[bytes, bytes]: (xlsx для публикатора - только города без заголовка на листе 'Гео',
+                              полный xlsx на листе 'Города')
+    """
+    # Санитизация данных перед экспортом (защита от CSV Injection) - на копии,
+    # чтобы не менять DataFrame вызывающего кода
+    safe_df = sanitize_csv_content(df.copy())
+
+    publisher_buffer = io.BytesIO()
+    write_excel_rows(publisher_buffer, safe_df[['Город']], 'Гео', include_header=False)
+
+    full_buffer = io.BytesIO()
+    write_excel_rows(full_buffer, safe_df, 'Города')
+    return publisher_buffer.getvalue(), full_buffer.getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def create_excel_archive_cached(frames: Dict[str, pd.DataFrame]) -> bytes:
+    """
+    Кэшированная генерация ZIP архива с Excel файлом для каждой вакансии/вкладки.
+
+    ОПТИМИЗАЦИЯ: книги пишутся сразу в элементы архива (один BytesIO на весь архив),
+    без отдельного Excel-буфера и копии его байтов на каждый файл.
+
+    Args:
+        frames: Словарь {имя_файла: DataFrame} (DataFrame не изменяются)
+
+    Returns:
+        bytes: Содержимое ZIP архива
+    """
+    # Санитизация данных перед экспортом (защита от CSV Injection) - на копиях
+    safe_frames = {name: sanitize_csv_content(df.copy()) for name, df in frames.items()}
+    return create_excel_zip_archive(safe_frames, sheet_name='Результат').getvalue()
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def get_editable_rows_cached(results_key: str, sheet_name: str, _result_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Кэшированный отбор строк вкладки для блока ручного редактирования.
+
+    ОПТИМИЗАЦИЯ: фильтр (совпадение ≤ 95%, без дубликатов), нормализация, удаление
+    повторов и сортировка выполняются один раз на вкладку, а не на каждом rerun.
+    Результат сопоставления вкладки однозначно задается results_key (файлы + порог)
+    и названием вкладки, поэтому сам DataFrame не хэшируется.
+
+    Args:
+        results_key: Ключ результата сопоставления (st.session_state.results_key)
+        sheet_name: Название вкладки
+        _result_df: Результат сопоставления вкладки (НЕ хэшируется)
+
+    Returns:
+        pd.DataFrame: Строки для редактирования в порядке отображения
+    """
+    editable_rows = _result_df[
+        (_result_df['Совпадение %'] <= 95).to_numpy() &
+        ~get_status_masks(_result_df['Статус'])['duplicate']
+    ]
+    # Убираем дубликаты по исходному названию и сортируем:
+    # сначала "Нет совпадения", затем по возрастанию процента
+    return prepare_editable_rows(editable_rows)
+
+
 @st.cache_data(show_spinner=False)
 def prepare_final_sheet_output_cached(result_df: pd.DataFrame, original_df: pd.DataFrame, sheet_name: str) -> pd.DataFrame:
     """
@@ -279,65 +712,23 @@ def prepare_final_sheet_output_cached(result_df: pd.DataFrame, original_df: pd.D
     - Выполняет фильтрацию, merge и очистку данных только один раз.
     - Предотвращает повторные тяжелые вычисления при перерисовке интерфейса.
     """
-    # 1. Фильтрация валидных строк
-    output_df = result_df[
-        (result_df['Итоговое гео'].notna()) &
-        (~result_df['Статус'].str.contains('❌ Не найдено', na=False)) &
-        (~result_df['Статус'].str.contains('Пустое значение', na=False))
-    ].copy()
-
-    # 2. Исключение дубликатов городов с "❌ Не найдено"
-    excluded_cities = result_df[
-        result_df['Статус'].str.contains('❌ Не найдено', na=False)
-    ]['Исходное название'].unique()
-
-    if len(excluded_cities) > 0:
-        excluded_normalized = set()
-        for city in excluded_cities:
-            if pd.notna(city):
-                normalized = str(city).replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                normalized = ' '.join(normalized.split())
-                excluded_normalized.add(normalized)
-
-        output_df['_temp_normalized'] = (
-            output_df['Исходное название']
-            .fillna('').astype(str)
-            .str.replace('ё', 'е').str.replace('Ё', 'Е')
-            .str.lower().str.strip()
-            .str.replace(r'\s+', ' ', regex=True)
-        )
-        output_df = output_df[~output_df['_temp_normalized'].isin(excluded_normalized)].copy()
-        output_df = output_df.drop(columns=['_temp_normalized'])
+    # 1-2. Валидные строки без повторов городов с "❌ Не найдено" - одной маской.
+    #      Без .copy(): дальше строки только читаются
+    output_df = select_export_rows(result_df)
 
     if len(output_df) == 0:
         return pd.DataFrame()
 
-    # 3. Объединение с исходными данными
+    # 3. Объединение с исходными данными: row_id - позиция строки в original_df,
+    #    поэтому все столбцы берутся одним take вместо merge на каждый столбец.
+    #    take уже возвращает новый DataFrame - индекс заменяется без reset_index (лишней копии)
     original_cols = original_df.columns.tolist()
-    final_output = pd.DataFrame()
-    final_output[original_cols[0]] = output_df['Итоговое гео']
-
-    for col in original_cols[1:]:
-        if col in original_df.columns:
-            temp_df = original_df.reset_index()
-            temp_df['row_id'] = temp_df.index
-            merged = output_df[['row_id']].merge(
-                temp_df[['row_id', col]],
-                on='row_id',
-                how='left'
-            )
-            final_output[col] = merged[col].values
-    
-    # 4. Удаление дубликатов
-    final_output['_normalized'] = (
-        final_output[original_cols[0]]
-        .fillna('').astype(str)
-        .str.replace('ё', 'е').str.replace('Ё', 'Е')
-        .str.lower().str.strip()
-        .str.replace(r'\s+', ' ', regex=True)
-    )
-    final_output = final_output.drop_duplicates(subset=['_normalized'], keep='first')
-    final_output = final_output.drop(columns=['_normalized'])
+    final_output = original_df.take(output_df['row_id'].to_numpy())
+    final_output.index = output_df.index
+    final_output[original_cols[0]] = output_df['Итоговое гео'].to_numpy()
+
+    # 4. Удаление дубликатов (по нормализованному названию, без служебного столбца)
+    final_output = drop_duplicate_cities(final_output, original_cols[0])
 
     # 5. Удаление заголовка если нужно
     final_output = remove_header_row_if_needed(final_output, original_cols[0])
@@ -345,6 +736,141 @@ def prepare_final_sheet_output_cached(result_df: pd.DataFrame, original_df: pd.D
     return final_output
 
 
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_vacancy_output_cached(
+    results_key: str,
+    vacancy,
+    vacancy_selections: dict,
+    added_cities: tuple,
+    original_cols: tuple,
+    vacancy_col,
+    _vacancy_df: pd.DataFrame,
+    _hh_areas: Dict
+) -> Tuple[pd.DataFrame, bytes]:
+    """
+    Кэшированная сборка итогового файла вакансии (режим столбца "Вакансия").
+
+    ОПТИМИЗАЦИЯ: применение ручных изменений, исключение не найденных, добавление
+    городов, удаление повторов и запись xlsx выполняются только при изменении
+    правок или добавленных городов этой вакансии, а не на каждом rerun.
+    Строки вакансии однозначно задаются results_key и vacancy, поэтому
+    сам DataFrame не хэшируется.
+
+    Args:
+        results_key: Ключ результата сопоставления (st.session_state.results_key)
+        vacancy: Значение столбца "Вакансия"
+        vacancy_selections: Ручные изменения вакансии {row_id: значение} (ХЭШИРУЕТСЯ)
+        added_cities: Добавленные вручную города вакансии
+        original_cols: Столбцы исходного файла
+        vacancy_col: Столбец "Вакансия"
+        _vacancy_df: Строки результата для вакансии (НЕ хэшируется)
+        _hh_areas: Справочник HH.ru (НЕ хэшируется)
+
+    Returns:
+        Tuple[pd.DataFrame, bytes]: (итоговый DataFrame для превью без санитизации,
+                                     содержимое xlsx с санитизацией)
+    """
+    # Без изменений вызывать кэш не нужно: cache_data вернул бы pickle-копию строк вакансии
+    if vacancy_selections:
+        vacancy_final_df = apply_manual_selections_cached(
+            _vacancy_df,
+            vacancy_selections,
+            _hh_areas,
+            cache_key=f"vacancy_{vacancy}"
+        )
+    else:
+        vacancy_final_df = _vacancy_df
+
+    # КРИТИЧНЫЙ FIX: Применяем изменения ко ВСЕМ дубликатам
+    # Проблема: если в файле 2 строки "Москва", показывается только 1 в редактировании
+    # При изменении на "Питер", только 1 строка меняется, вторая остается "Москва"
+    # Решение: найти все строки с таким же исходным названием и применить то же изменение
+    # ОПТИМИЗАЦИЯ: словарь {нормализованное название: новое значение} строится один раз
+    # (при повторе названия побеждает последнее изменение, как при последовательном
+    # применении), затем все дубликаты обновляются векторно
+    if vacancy_selections:
+        row_ids = vacancy_final_df['row_id']
+        selected_mask = row_ids.isin(list(vacancy_selections)).to_numpy()
+        normalized = normalize_city_names(vacancy_final_df['Исходное название'][selected_mask].astype(str))
+        normalized_by_row_id = dict(zip(row_ids[selected_mask], normalized))
+
+        duplicates_mapping = {}
+        for row_id_changed, new_value in vacancy_selections.items():
+            if row_id_changed in normalized_by_row_id:
+                duplicates_mapping[normalized_by_row_id[row_id_changed]] = new_value
+
+        # Результат cache_data - собственная копия, поэтому изменяется на месте
+        apply_unified_mapping(
+            vacancy_final_df,
+            duplicates_mapping,
+            _hh_areas,
+            update_status=False,
+            hh_lookup=get_hh_lookup_cached(_hh_areas)
+        )
+
+    # FIX: Исключаем не найденные (❌ Не найдено) для публикатора
+    # КРИТИЧНО: Также исключаем ВСЕ дубликаты городов с "❌ Не найдено"
+    vacancy_final_df = select_export_rows(vacancy_final_df, exclude_empty=False)
+
+    # Формируем DataFrame для выгрузки
+    output_vacancy_df = build_export_frame(vacancy_final_df, original_cols, skip_cols=(vacancy_col,))
+
+    # Добавляем дополнительные города для этой вакансии
+    if added_cities:
+        # Получаем последнюю строку для значений других столбцов
+        if len(output_vacancy_df) > 0:
+            last_row_values = output_vacancy_df.iloc[-1].tolist()
+
+            # Строки собираются списком и добавляются одним concat,
+            # а не .loc[len(df)] на каждый город (копия DataFrame на каждое добавление)
+            added_rows = [[add_city] + last_row_values[1:] for add_city in added_cities]
+            added_df = pd.DataFrame(added_rows, columns=output_vacancy_df.columns)
+            output_vacancy_df = pd.concat([output_vacancy_df, added_df], ignore_index=True)
+
+    # Удаляем дубликаты по городу (нормализованное название, без служебного столбца)
+    output_vacancy_df = drop_duplicate_cities(output_vacancy_df, original_cols[0])
+
+    # Удаляем первую строку, если она является заголовком
+    output_vacancy_df = remove_header_row_if_needed(output_vacancy_df, original_cols[0])
+
+    if len(output_vacancy_df) == 0:
+        return output_vacancy_df, b''
+
+    # Для превью возвращается DataFrame без санитизации: защита от CSV Injection
+    # применяется к копии внутри create_excel_bytes_cached только при записи xlsx
+    return output_vacancy_df, create_excel_bytes_cached(output_vacancy_df, 'Результат')
+
+
+# ============================================
+# CALLBACK ВЫБОРА ГОРОДА
+# ============================================
+
+def on_city_select(
+    selection_key,
+    widget_key: str,
+    option_cities: Dict[str, str],
+    store: str = 'manual_selections'
+) -> None:
+    """
+    Callback selectbox выбора города - единственное место записи ручных изменений.
+
+    Вызывается Streamlit только при изменении значения виджета (on_change), поэтому
+    словарь изменений не перезаписывается на каждом rerun. Значение виджета -
+    строка вида "Город (90.0%)" или "❌ Нет совпадения"; название города берется
+    из option_cities (prepare_city_options), без разбора строки.
+
+    Args:
+        selection_key: Ключ изменения (row_id, (вкладка, row_id), (вакансия, row_id) или
+                       нормализованное название в режиме единой сверки)
+        widget_key: Ключ selectbox в st.session_state
+        option_cities: {option: город} для options этого selectbox
+        store: Словарь изменений в st.session_state ('manual_selections' или 'unified_selections')
+    """
+    selected = st.session_state.get(widget_key)
+    if selected in option_cities:
+        st.session_state[store][selection_key] = option_cities[selected]
+
+
 # ============================================
 # КОНФИГУРАЦИЯ: API КЛЮЧИ
 # ============================================
@@ -435,16 +961,10 @@ if hh_areas:
     st.markdown('<div id="проверка-гео"></div>', unsafe_allow_html=True)
     st.header("🔍 Проверка гео и выгрузка базы")
 
-    # Получаем только города России
-    russia_cities = []
-    for city_name, city_info in hh_areas.items():
-        if city_info.get('root_parent_id') == '113':
-            russia_cities.append(city_name)
-
-    # Мультиселект для выбора городов
+    # Мультиселект для выбора городов (только города России, кэшированный отсортированный список)
     selected_cities = st.multiselect(
         "Выберите город(а) для проверки и выгрузки:",
-        options=sorted(russia_cities),
+        options=get_sorted_russian_cities_cached(hh_areas),
         key="geo_checker",
         help="Выберите один или несколько городов"
     )
@@ -468,18 +988,12 @@ if hh_areas:
 
         # Кнопка выгрузки выбранных городов
         col1, col2 = st.columns(2)
+        publisher_bytes, full_bytes = create_city_reports_cached(selected_cities_df)
         with col1:
             # Для публикатора (только названия городов)
-            publisher_df = pd.DataFrame({'Город': selected_cities_df['Город']})
-            # Санитизация данных перед экспортом (защита от CSV Injection)
-            publisher_df = sanitize_csv_content(publisher_df)
-            output_pub = io.BytesIO()
-            with pd.ExcelWriter(output_pub, engine='openpyxl') as writer:
-                publisher_df.to_excel(writer, index=False, header=False, sheet_name='Гео')
-            output_pub.seek(0)
             st.download_button(
                 label=f"📤 Для публикатора ({len(selected_cities)} городов)",
-                data=output_pub,
+                data=publisher_bytes,
                 file_name="selected_cities_publisher.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True,
@@ -488,15 +1002,9 @@ if hh_areas:
             )
         with col2:
             # Полный отчет с ID и регионами
-            # Санитизация данных перед экспортом (защита от CSV Injection)
-            safe_cities_df = sanitize_csv_content(selected_cities_df.copy())
-            output_full = io.BytesIO()
-            with pd.ExcelWriter(output_full, engine='openpyxl') as writer:
-                safe_cities_df.to_excel(writer, index=False, sheet_name='Города')
-            output_full.seek(0)
             st.download_button(
                 label=f"📥 Полный отчет ({len(selected_cities)} городов)",
-                data=output_full,
+                data=full_bytes,
                 file_name="selected_cities.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True,
@@ -508,23 +1016,19 @@ if hh_areas:
     st.markdown("")
     if st.button("🌍 Выгрузить ВСЕ города из справочника", type="secondary", use_container_width=False, key="export_all_cities_btn"):
         with st.spinner("Формирую полный список..."):
-            all_cities_df = get_all_cities(hh_areas)
+            all_cities_df = get_all_cities_cached(hh_areas)
             if not all_cities_df.empty:
                 st.success(f"✅ Найдено **{len(all_cities_df)}** городов в справочнике HH.ru")
-                st.dataframe(all_cities_df, use_container_width=True, height=400)
+                st.dataframe(all_cities_df.head(CITY_PREVIEW_ROWS), use_container_width=True, height=400)
+                if len(all_cities_df) > CITY_PREVIEW_ROWS:
+                    st.caption(f"Показаны первые {CITY_PREVIEW_ROWS} из {len(all_cities_df)} городов, полный список - в файлах выгрузки")
 
                 col1, col2 = st.columns(2)
+                publisher_bytes, full_bytes = create_city_reports_cached(all_cities_df)
                 with col1:
-                    publisher_df = pd.DataFrame({'Город': all_cities_df['Город']})
-                    # Санитизация данных перед экспортом (защита от CSV Injection)
-                    publisher_df = sanitize_csv_content(publisher_df)
-                    output_pub = io.BytesIO()
-                    with pd.ExcelWriter(output_pub, engine='openpyxl') as writer:
-                        publisher_df.to_excel(writer, index=False, header=False, sheet_name='Гео')
-                    output_pub.seek(0)
                     st.download_button(
                         label=f"📤 Для публикатора ({len(all_cities_df)} городов)",
-                        data=output_pub,
+                        data=publisher_bytes,
                         file_name="all_cities_publisher.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         use_container_width=True,
@@ -532,15 +1036,9 @@ if hh_areas:
                         key="download_all_publisher"
                     )
                 with col2:
-                    # Санитизация данных перед экспортом (защита от CSV Injection)
-                    safe_all_cities_df = sanitize_csv_content(all_cities_df.copy())
-                    output_full = io.BytesIO()
-                    with pd.ExcelWriter(output_full, engine='openpyxl') as writer:
-                        safe_all_cities_df.to_excel(writer, index=False, sheet_name='Города')
-                    output_full.seek(0)
                     st.download_button(
                         label=f"📥 Скачать полный отчет ({len(all_cities_df)} городов)",
-                        data=output_full,
+                        data=full_bytes,
                         file_name="all_cities.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                         use_container_width=True,
@@ -556,44 +1054,28 @@ st.markdown("---")
 st.markdown('<div id="синхронизатор-городов"></div>', unsafe_allow_html=True)
 st.markdown("## **📤 Синхронизатор городов**")
 
-with st.sidebar:
-    # OPTIMIZED: use cached logo loading
-    try:
-        logo_base64 = get_cached_icon_base64("min-hh-red.png")
-
-        if logo_base64:
-            # Вставляем через HTML с прямыми стилями для максимального качества
-            st.markdown(
-                f'''<img src="{logo_base64}"
-                style="width: 200px;
-                       height: auto;
-                       image-rendering: auto;
-                       -ms-interpolation-mode: bicubic;
-                       display: block;
-                       margin-bottom: 10px;
-                       object-fit: contain;" />''',
-                unsafe_allow_html=True
-            )
-        else:
-            logger.warning("Не удалось загрузить min-hh-red.png")
-            st.markdown(f'<div class="title-container"><span>{SYNC_ICON}</span></div>', unsafe_allow_html=True)
-    except Exception as e:
-        # Fallback если PNG еще не создан
-        st.markdown(
-            f'<div class="title-container">'
-            f'<span class="rotating-earth">{SYNC_ICON}</span>'
-            f'</div>',
-            unsafe_allow_html=True
-        )
-    st.markdown("---")
-
-    # Инициализация состояния для отображения инструкций
-    if 'show_instruction' not in st.session_state:
-        st.session_state.show_instruction = None
+# ============================================
+# БОКОВАЯ ПАНЕЛЬ: НАВИГАЦИЯ И ИНСТРУКЦИИ
+# ============================================
+# ОПТИМИЗАЦИЯ: тексты боковой панели собираются один раз при импорте модуля,
+# а навигация отправляется в браузер одним st.markdown вместо вызова на каждую ссылку
+
+# Якорная навигация (стили в static/styles.css)
+SIDEBAR_NAV_ITEMS = [
+    ("Проверка гео и выгрузка базы", "проверка-гео"),
+    ("Синхронизатор городов", "синхронизатор-городов"),
+    ("Выбор регионов и городов", "выбор-регионов-и-городов"),
+    ("Объединитель файлов", "объединитель-файлов"),
+    ("Сверки с клиентами", "сверки-с-клиентами")
+]
+
+_SIDEBAR_NAV_HTML = "### 🧭 Навигация\n\n" + "\n".join(
+    f'<a class="nav-link" href="#{anchor}">{name}</a>' for name, anchor in SIDEBAR_NAV_ITEMS
+)
 
-    # Словарь с инструкциями для каждого раздела
-    instructions = {
-        "проверка-гео": """
+# Инструкции для каждого раздела (ключ - якорь раздела)
+SIDEBAR_INSTRUCTIONS = {
+    "проверка-гео": """
 ### Проверка гео и выгрузка базы
 
 <p><span class="step-number">1</span> <strong>Быстрая проверка города</strong></p>
@@ -607,9 +1089,9 @@ with st.sidebar:
 - Нажмите кнопку "Выгрузить ВСЕ города"
 - Получите Excel-файл со всеми городами России из справочника HH.ru
 - Файл содержит: название города, ID, регион, тип населенного пункта
-        """,
+    """,
 
-        "синхронизатор-городов": """
+    "синхронизатор-городов": """
 ### Синхронизатор городов
 
 <p><span class="step-number">1</span> <strong>Обычный режим</strong></p>
@@ -639,9 +1121,9 @@ with st.sidebar:
 
 **Порядок работы:**
 1. Загрузите файл → 2. Нажмите "Начать сопоставление" → 3. Выберите режим (если есть вакансии/вкладки) → 4. Отредактируйте города <90% → 5. Скачайте результат
-        """,
+    """,
 
-        "выбор-регионов-и-городов": """
+    "выбор-регионов-и-городов": """
 ### Выбор регионов и городов
 
 <p><span class="step-number">1</span> <strong>Поиск по регионам</strong></p>
@@ -661,9 +1143,9 @@ with st.sidebar:
 - Укажите минимальное и максимальное население
 - Система найдет все города в указанном диапазоне
 - Данные о населении из актуального справочника
-        """,
+    """,
 
-        "объединитель-файлов": """
+    "объединитель-файлов": """
 ### Объединитель файлов
 
 <p><span class="step-number">1</span> <strong>Загрузите файлы</strong></p>
@@ -682,9 +1164,9 @@ with st.sidebar:
 
 - Нажмите кнопку "Скачать объединенный файл"
 - Файл содержит статистику: общее количество, дубликаты, уникальные записи
-        """,
+    """,
 
-        "сверки-с-клиентами": """
+    "сверки-с-клиентами": """
 ### Сверки с клиентами
 
 <p><span class="step-number">1</span> <strong>Сверка Я.Еда</strong></p>
@@ -707,42 +1189,55 @@ with st.sidebar:
 - "Leads_" (лиды из ЛК Я.Еды)
 
 ⏱️ Время выполнения: 30-40 минут
-        """
-    }
+    """
+}
 
-    st.markdown("### 🧭 Навигация")
 
-    # Якорная навигация (стили в static/styles.css)
-    nav_items = [
-        ("Проверка гео и выгрузка базы", "проверка-гео"),
-        ("Синхронизатор городов", "синхронизатор-городов"),
-        ("Выбор регионов и городов", "выбор-регионов-и-городов"),
-        ("Объединитель файлов", "объединитель-файлов"),
-        ("Сверки с клиентами", "сверки-с-клиентами")
-    ]
+with st.sidebar:
+    # OPTIMIZED: use cached logo loading
+    try:
+        logo_base64 = get_cached_icon_base64("min-hh-red.png")
+
+        if logo_base64:
+            # Вставляем через HTML с прямыми стилями для максимального качества
+            st.markdown(
+                f'''<img src="{logo_base64}"
+                style="width: 200px;
+                       height: auto;
+                       image-rendering: auto;
+                       -ms-interpolation-mode: bicubic;
+                       display: block;
+                       margin-bottom: 10px;
+                       object-fit: contain;" />''',
+                unsafe_allow_html=True
+            )
+        else:
+            logger.warning("Не удалось загрузить min-hh-red.png")
+            st.markdown(f'<div class="title-container"><span>{SYNC_ICON}</span></div>', unsafe_allow_html=True)
+    except Exception as e:
+        # Fallback если PNG еще не создан
+        st.markdown(
+            f'<div class="title-container">'
+            f'<span class="rotating-earth">{SYNC_ICON}</span>'
+            f'</div>',
+            unsafe_allow_html=True
+        )
+    st.markdown("---")
+
+    # Инициализация состояния для отображения инструкций
+    if 'show_instruction' not in st.session_state:
+        st.session_state.show_instruction = None
 
-    for name, anchor in nav_items:
-        st.markdown(f'<a class="nav-link" href="#{anchor}">{name}</a>', unsafe_allow_html=True)
+    st.markdown(_SIDEBAR_NAV_HTML, unsafe_allow_html=True)
 
     st.markdown("---")
 
     # Инструкции в раскрывающихся блоках
     st.markdown("### 📖 Инструкции")
 
-    with st.expander("Проверка гео и выгрузка базы"):
-        st.markdown(instructions["проверка-гео"], unsafe_allow_html=True)
-
-    with st.expander("Синхронизатор городов"):
-        st.markdown(instructions["синхронизатор-городов"], unsafe_allow_html=True)
-
-    with st.expander("Выбор регионов и городов"):
-        st.markdown(instructions["выбор-регионов-и-городов"], unsafe_allow_html=True)
-
-    with st.expander("Объединитель файлов"):
-        st.markdown(instructions["объединитель-файлов"], unsafe_allow_html=True)
-
-    with st.expander("Сверки с клиентами"):
-        st.markdown(instructions["сверки-с-клиентами"], unsafe_allow_html=True)
+    for name, anchor in SIDEBAR_NAV_ITEMS:
+        with st.expander(name):
+            st.markdown(SIDEBAR_INSTRUCTIONS[anchor], unsafe_allow_html=True)
 
     st.markdown("---")
 
@@ -792,22 +1287,12 @@ if uploaded_files and hh_areas is not None:
         file_counter = 1
 
         for uploaded_file in uploaded_files:
-            # Определяем тип файла и читаем все вкладки
-            if uploaded_file.name.endswith('.csv'):
-                # CSV - одна вкладка
-                df = pd.read_csv(uploaded_file, header=None)
-                # Если несколько файлов, добавляем префикс к имени
-                sheet_key = f"Файл{file_counter}_Sheet1" if len(uploaded_files) > 1 else "Sheet1"
-                sheets_data[sheet_key] = df
-            else:
-                # Excel - читаем все вкладки
-                excel_file = pd.ExcelFile(uploaded_file)
-                for sheet_name in excel_file.sheet_names:
-                    df_sheet = pd.read_excel(excel_file, sheet_name=sheet_name, header=None)
-                    if len(df_sheet) > 0:  # Только непустые вкладки
-                        # Если несколько файлов, добавляем префикс к имени вкладки
-                        sheet_key = f"Файл{file_counter}_{sheet_name}" if len(uploaded_files) > 1 else sheet_name
-                        sheets_data[sheet_key] = df_sheet
+            # Читаем все вкладки (CSV - одна вкладка); разбор кэшируется по байтам файла
+            file_sheets = read_uploaded_sheets_cached(uploaded_file.getvalue(), uploaded_file.name)
+            for sheet_name, df_sheet in file_sheets.items():
+                # Если несколько файлов, добавляем префикс к имени вкладки
+                sheet_key = f"Файл{file_counter}_{sheet_name}" if len(uploaded_files) > 1 else sheet_name
+                sheets_data[sheet_key] = df_sheet
             file_counter += 1
         
         # Анализируем структуру файла
@@ -821,27 +1306,31 @@ if uploaded_files and hh_areas is not None:
             has_vacancy_column = False
             vacancy_col_idx = None
             
-            # Проверяем первую строку на наличие заголовков
+            # Проверяем первую строку на наличие заголовков (VECTORIZED)
             if len(df) > 0:
                 first_row = df.iloc[0]
+                first_row_lower = first_row.astype(str).str.lower().where(first_row.notna(), '')
                 # Проверяем первую ячейку на "Город"
-                if pd.notna(first_row[0]) and 'город' in str(first_row[0]).lower():
+                if 'город' in first_row_lower.iat[0]:
                     has_header = True
-                    # Ищем столбец "Вакансия"
-                    for idx, val in enumerate(first_row):
-                        if pd.notna(val) and 'вакансия' in str(val).lower():
-                            has_vacancy_column = True
-                            vacancy_col_idx = idx
-                            break
+                    # Ищем столбец "Вакансия" (первый по порядку)
+                    vacancy_mask = first_row_lower.str.contains('вакансия', regex=False).to_numpy()
+                    if vacancy_mask.any():
+                        has_vacancy_column = True
+                        vacancy_col_idx = int(vacancy_mask.argmax())
             
-            # Если есть заголовок, делаем его названиями столбцов
+            # Если есть заголовок, делаем его названиями столбцов.
+            # Срез + новый RangeIndex вместо reset_index: строка отбрасывается без копии данных
             if has_header:
-                df.columns = df.iloc[0]
-                df = df.iloc[1:].reset_index(drop=True)
-            
-            # Сохраняем данные вкладки
+                header = df.iloc[0].values
+                df = df.iloc[1:]
+                df.columns = header
+                df.index = pd.RangeIndex(len(df))
+
+            # Сохраняем данные вкладки (df - свежая копия из read_uploaded_sheets_cached,
+            # поэтому повторный .copy() не нужен)
             st.session_state.sheets_data[sheet_name] = {
-                'df': df.copy(),
+                'df': df,
                 'has_vacancy_column': has_vacancy_column,
                 'vacancy_col_idx': vacancy_col_idx
             }
@@ -879,6 +1368,12 @@ if uploaded_files and hh_areas is not None:
         # Для обратной совместимости - сохраняем первую вкладку как основной DF
         first_sheet_name = list(sheets_data.keys())[0]
         st.session_state.original_df = st.session_state.sheets_data[first_sheet_name]['df'].copy()
+        # ОПТИМИЗАЦИЯ: столбец "Вакансия" определяем один раз при загрузке,
+        # дальше блоки экспорта и редактирования берут его из session_state
+        st.session_state.vacancy_col = next(
+            (col for col in st.session_state.original_df.columns if 'вакансия' in str(col).lower()),
+            None
+        )
         st.session_state.has_vacancy_mode = st.session_state.sheet_mode in ['columns', 'tabs', 'both']
 
         # Показываем превью файла с информацией о размерах
@@ -896,24 +1391,30 @@ if uploaded_files and hh_areas is not None:
           
         if st.button("🚀 Начать сопоставление", type="primary", use_container_width=True):  
             with st.spinner("Обрабатываю..."):  
-                # Обрабатываем каждую вкладку
-                st.session_state.sheets_results = {}
-                
-                for sheet_name, sheet_data in st.session_state.sheets_data.items():
-                    df_sheet = sheet_data['df']
-                    result_df, dup_original, dup_hh, total_dup = match_cities(df_sheet, hh_areas, threshold, sheet_name=sheet_name)  
-                    
-                    st.session_state.sheets_results[sheet_name] = {
-                        'result_df': result_df,
-                        'dup_original': dup_original,
-                        'dup_hh': dup_hh,
-                        'total_dup': total_dup,
-                        'has_vacancy_column': sheet_data['has_vacancy_column']
-                    }
-                
+                # Обрабатываем каждую вкладку (результат кэшируется по содержимому файлов и порогу)
+                files_key = "|".join(
+                    f"{uploaded_file.name}:{get_file_hash(uploaded_file.getvalue())}"
+                    for uploaded_file in uploaded_files
+                )
+                sheets_results, candidates_cache = match_all_sheets_cached(
+                    files_key, threshold, st.session_state.sheets_data, hh_areas
+                )
+                st.session_state.sheets_results = sheets_results
+                # Ключ результата - для кэшей, которые не хэшируют сами DataFrame
+                st.session_state.results_key = f"{files_key}|{threshold}"
+                # Кандидаты smart_match_city по ключу (вкладка, row_id)
+                st.session_state.candidates_cache = candidates_cache
+
                 # Для обратной совместимости - сохраняем первую вкладку
                 first_sheet = list(st.session_state.sheets_results.keys())[0]
                 st.session_state.result_df = st.session_state.sheets_results[first_sheet]['result_df']
+
+                # Столбец "Вакансия" - категориальный: список вакансий и выборка строк
+                # вакансии (==) на каждом rerun считаются по кодам, а не сравнением строк
+                vacancy_col = st.session_state.get('vacancy_col')
+                if vacancy_col is not None and vacancy_col in st.session_state.result_df.columns:
+                    st.session_state.result_df[vacancy_col] = st.session_state.result_df[vacancy_col].astype('category')
+
                 st.session_state.dup_original = st.session_state.sheets_results[first_sheet]['dup_original']
                 st.session_state.dup_hh = st.session_state.sheets_results[first_sheet]['dup_hh']
                 st.session_state.total_dup = st.session_state.sheets_results[first_sheet]['total_dup']
@@ -922,7 +1423,6 @@ if uploaded_files and hh_areas is not None:
                 st.session_state.manual_selections = {}
                 st.session_state.search_query = ""
                 st.session_state.added_cities = []
-                st.session_state.candidates_cache = {}
 
                 # Очищаем кэши функций
                 apply_manual_selections_cached.clear()
@@ -948,16 +1448,19 @@ if uploaded_files and hh_areas is not None:
                   
                 col1, col2, col3, col4, col5, col6 = st.columns(6)  
                   
-                total = len(result_df)  
-                exact = len(result_df[result_df['Статус'] == '✅ Точное'])  
-                similar = len(result_df[result_df['Статус'] == '⚠️ Похожее'])  
-                duplicates = len(result_df[result_df['Статус'].str.contains('Дубликат', na=False)])  
-                not_found = len(result_df[result_df['Статус'] == '❌ Не найдено'])  
-                  
-                to_export = len(result_df[  
-                    (~result_df['Статус'].str.contains('Дубликат', na=False)) &   
-                    (result_df['Итоговое гео'].notna())  
-                ])  
+                # Маски считаются один раз и переиспользуются для всех метрик
+                # (без промежуточных DataFrame на каждую метрику)
+                status_values = result_df['Статус']
+                is_dup = get_status_masks(status_values)['duplicate']
+                has_geo = result_df['Итоговое гео'].notna().to_numpy()
+
+                total = len(result_df)
+                exact = int((status_values == '✅ Точное').sum())
+                similar = int((status_values == '⚠️ Похожее').sum())
+                duplicates = int(is_dup.sum())
+                not_found = int((status_values == '❌ Не найдено').sum())
+
+                to_export = int((~is_dup & has_geo).sum())
                   
                 col1.metric("Всего", total)  
                 col2.metric("✅ Точных", exact)  
@@ -1043,31 +1546,50 @@ if uploaded_files and hh_areas is not None:
                             label_visibility="visible"
                         )
 
-                    # VECTORIZED: sort priority (0=no match, 1=changed, 2=unchanged)
-                    result_df['sort_priority'] = np.where(
-                        result_df['Совпадение %'] == 0, 0,
-                        np.where(result_df['Изменение'] == 'Да', 1, 2)
-                    )
+                    # Отсортированная таблица пересчитывается только при смене result_df,
+                    # а не на каждом rerun (ввод в поиск, выбор фильтра и т.п.)
+                    sorted_cache = st.session_state.get('result_df_sorted_cache')
+                    if sorted_cache is not None and sorted_cache[0] is result_df:
+                        result_df_sorted, search_haystack = sorted_cache[1], sorted_cache[2]
+                    else:
+                        # VECTORIZED: sort priority (0=no match, 1=changed, 2=unchanged)
+                        # int8: сортировка двигает в 8 раз меньше памяти, чем int64
+                        sort_priority = np.select(
+                            [result_df['Совпадение %'].eq(0), result_df['Изменение'].eq('Да')],
+                            [0, 1],
+                            default=2
+                        ).astype(np.int8)
+
+                        result_df_sorted = result_df.assign(sort_priority=sort_priority).sort_values(
+                            by=['sort_priority', 'Совпадение %'],
+                            ascending=[True, True]
+                        ).reset_index(drop=True)
 
-                    result_df_sorted = result_df.sort_values(
-                        by=['sort_priority', 'Совпадение %'],
-                        ascending=[True, True]
-                    ).reset_index(drop=True)
+                        # Строка для поиска: 4 колонки в нижнем регистре через перевод строки
+                        # (в text_input его не ввести, поэтому совпадение не "склеит" колонки).
+                        # Arrow-строки: str.contains выполняется в C++ ядре pyarrow, а приведение
+                        # к str и lower() делаются один раз, а не на каждый ввод в поиск
+                        search_haystack = result_df_sorted['Исходное название'].astype(str)
+                        for search_col in ('Итоговое гео', 'Регион', 'Статус'):
+                            search_haystack = search_haystack + '\n' + result_df_sorted[search_col].astype(str)
+                        search_haystack = search_haystack.astype('string[pyarrow]').str.lower()
+
+                        st.session_state.result_df_sorted_cache = (result_df, result_df_sorted, search_haystack)
 
                     # Применяем фильтр по статусам
                     if status_filter:
-                        result_df_sorted = result_df_sorted[result_df_sorted['Статус'].isin(status_filter)]
+                        status_mask = result_df_sorted['Статус'].isin(status_filter).to_numpy()
+                        result_df_sorted = result_df_sorted[status_mask]
+                        search_haystack = search_haystack[status_mask]
 
                     if st.session_state.search_query and st.session_state.search_query.strip():
                         # Sanitization пользовательского ввода для защиты от инъекций
                         sanitized_query = sanitize_user_input(st.session_state.search_query, max_length=200)
                         search_lower = sanitized_query.lower().strip()
-                        # VECTORIZED: search mask across multiple columns
-                        mask = (
-                            result_df_sorted['Исходное название'].astype(str).str.lower().str.contains(search_lower, na=False) |
-                            result_df_sorted['Итоговое гео'].astype(str).str.lower().str.contains(search_lower, na=False) |
-                            result_df_sorted['Регион'].astype(str).str.lower().str.contains(search_lower, na=False) |
-                            result_df_sorted['Статус'].astype(str).str.lower().str.contains(search_lower, na=False)
+                        # VECTORIZED: одна проверка по склеенным колонкам поиска
+                        # regex=False: поиск подстроки без компиляции regex (и без ошибок на "(", "+" и т.п.)
+                        mask = search_haystack.str.contains(search_lower, regex=False).to_numpy(
+                            dtype=bool, na_value=False
                         )
                         result_df_filtered = result_df_sorted[mask]
 
@@ -1078,25 +1600,32 @@ if uploaded_files and hh_areas is not None:
                     else:
                         result_df_filtered = result_df_sorted  
               
-                    display_df = result_df_filtered.copy()
-                    display_df = display_df.drop(['row_id', 'sort_priority'], axis=1, errors='ignore')
-
-                    # Сбрасываем индекс чтобы избежать дублирования
-                    display_df = display_df.reset_index(drop=True)
-
-                    st.dataframe(display_df, use_container_width=True, height=400, hide_index=True)  
+                    # Служебные колонки скрываем через column_order вместо drop + copy + reset_index:
+                    # таблица не копируется на каждом rerun, индекс скрыт hide_index
+                    display_columns = [
+                        col for col in result_df_filtered.columns
+                        if col not in ('row_id', 'sort_priority')
+                    ]
+
+                    st.dataframe(
+                        result_df_filtered,
+                        column_order=display_columns,
+                        use_container_width=True,
+                        height=400,
+                        hide_index=True
+                    )
               
                     # ИЗМЕНЕНО: Исключаем дубликаты из редактирования, порог 95%
                     editable_rows = result_df_sorted[
-                        (result_df_sorted['Совпадение %'] <= 95) &
-                        (~result_df_sorted['Статус'].str.contains('Дубликат', na=False))
+                        (result_df_sorted['Совпадение %'] <= 95).to_numpy() &
+                        ~get_status_masks(result_df_sorted['Статус'])['duplicate']
                     ].copy()
 
                     # Сортируем: сначала "Нет совпадения", затем по возрастанию процента
                     if len(editable_rows) > 0:
                         # Создаем приоритет: 0 для "Нет совпадения", 1 для остальных
                         # VECTORIZED: sort priority (0 for not found, 1 for others)
-                        editable_rows['_sort_priority'] = (~editable_rows['Статус'].str.contains('❌ Не найдено', na=False)).astype(int)
+                        editable_rows['_sort_priority'] = (~get_status_masks(editable_rows['Статус'])['not_found']).astype(np.int8)
                         editable_rows = editable_rows.sort_values(
                             ['_sort_priority', 'Совпадение %'],
                             ascending=[True, True]
@@ -1107,55 +1636,28 @@ if uploaded_files and hh_areas is not None:
                         st.markdown("---")
                         st.subheader("✏️ Редактирование городов с совпадением ≤ 95%")
 
-                        # FIX: Force black border for Scenario 1 editing selectboxes using targeted CSS
-                        st.markdown("""
-                            <style>
-                                .scenario1-edit-section div[data-baseweb="select"] > div,
-                                .scenario1-edit-section .stSelectbox > div > div {
-                                    border: 2px solid #1a1a1a !important;
-                                    border-color: #1a1a1a !important;
-                                    outline: none !important;
-                                    box-shadow: none !important;
-                                }
-                                .scenario1-edit-section div[data-baseweb="select"] > div:hover,
-                                .scenario1-edit-section .stSelectbox:hover > div > div {
-                                    border-color: #1a1a1a !important;
-                                    box-shadow: 0 4px 16px rgba(0, 0, 0, 0.15) !important;
-                                }
-                                .scenario1-edit-section div[data-baseweb="select"] > div:focus-within,
-                                .scenario1-edit-section .stSelectbox > div > div:focus-within {
-                                    border-color: #1a1a1a !important;
-                                    box-shadow: 0 0 0 3px rgba(0, 0, 0, 0.1) !important;
-                                }
-                            </style>
-                            <div class="scenario1-edit-section">
-                        """, unsafe_allow_html=True)
-
-                        # Callback для сохранения выбора ТОЛЬКО при изменении
-                        def on_city_select_scenario1(row_id, widget_key):
-                            """Callback для сценария 1 - вызывается только при изменении"""
-                            selected = st.session_state.get(widget_key)
-                            if selected == "❌ Нет совпадения":
-                                st.session_state.manual_selections[row_id] = "❌ Нет совпадения"
-                            elif selected:
-                                # Извлекаем название без процента
-                                city_match = selected.rsplit(' (', 1)[0]
-                                st.session_state.manual_selections[row_id] = city_match
-
-                        for idx, row in editable_rows.iterrows():
+                        # FIX: Force black border for Scenario 1 editing selectboxes (CSS в static/styles.css)
+                        st.markdown('<div class="scenario1-edit-section">', unsafe_allow_html=True)
+
+                        # result_df - первая вкладка; кандидаты в кэше хранятся по ключу (вкладка, row_id)
+                        result_sheet_name = next(iter(st.session_state.sheets_results))
+
+                        # Значения берем из столбцов целиком: iterrows создает pd.Series на каждую строку
+                        for row_id, city_name, current_value, current_match in zip(
+                            editable_rows['row_id'].tolist(),
+                            editable_rows['Исходное название'].tolist(),
+                            editable_rows['Итоговое гео'].tolist(),
+                            editable_rows['Совпадение %'].tolist()
+                        ):
                             with st.container():
-                                row_id = row['row_id']
-                                city_name = row['Исходное название']
-                                current_value = row['Итоговое гео']
-                                current_match = row['Совпадение %']
 
                                 # Получаем кандидатов из кэша или вычисляем
-                                candidates = st.session_state.candidates_cache.get(row_id, [])
+                                candidates = st.session_state.candidates_cache.get((result_sheet_name, row_id), [])
                                 if not candidates:
-                                    candidates = get_candidates_by_word(city_name, get_russian_cities_cached(hh_areas), limit=20)
+                                    candidates = get_candidates_cached(normalize_city_name(city_name), hh_areas, limit=20)
 
                                 # Кэшированная подготовка options (избегаем повторных вычислений)
-                                options, candidates_dict = prepare_city_options(
+                                options, candidates_dict, option_cities = prepare_city_options(
                                     tuple(candidates),  # tuple для кэширования
                                     current_value,
                                     current_match,
@@ -1171,8 +1673,8 @@ if uploaded_files and hh_areas is not None:
                                     # Берем из options (уже отсортированного списка) первый элемент после "❌ Нет совпадения"
                                     if len(options) > 1:
                                         # options[1] - это первый город с максимальным процентом
-                                        # Убираем процент в скобках из строки
-                                        selected_value = options[1].rsplit(' (', 1)[0]
+                                        # Название города без процента - из option_cities
+                                        selected_value = option_cities[options[1]]
                                     else:
                                         selected_value = current_value
 
@@ -1185,7 +1687,7 @@ if uploaded_files and hh_areas is not None:
                                 col1, col2, col3 = st.columns([2, 3, 1])
 
                                 with col1:
-                                    st.markdown(f"**{row['Исходное название']}**")
+                                    st.markdown(f"**{city_name}**")
 
                                 with col2:
                                     st.selectbox(
@@ -1194,12 +1696,12 @@ if uploaded_files and hh_areas is not None:
                                         index=default_idx,
                                         key=widget_key,
                                         label_visibility="collapsed",
-                                        on_change=on_city_select_scenario1,
-                                        args=(row_id, widget_key)
+                                        on_change=on_city_select,
+                                        args=(row_id, widget_key, option_cities)
                                     )
 
                                 with col3:
-                                    st.text(f"{row['Совпадение %']}%")
+                                    st.text(f"{current_match}%")
 
                                 st.markdown("<hr style='margin-top: 5px; margin-bottom: 5px;'>", unsafe_allow_html=True)
 
@@ -1215,12 +1717,9 @@ if uploaded_files and hh_areas is not None:
                         # Селектор на половину ширины экрана
                         col_selector = st.columns([1, 1])
                         with col_selector[0]:
-                            # Используем кэшированную версию вместо цикла
-                            russia_cities = get_russian_cities_cached(hh_areas)
-
                             selected_city = st.selectbox(
                                 "Выберите город:",
-                                options=sorted(russia_cities),
+                                options=get_sorted_russian_cities_cached(hh_areas),
                                 key="city_selector",
                                 help="Выберите город из справочника HH.ru"
                             )
@@ -1266,19 +1765,25 @@ if uploaded_files and hh_areas is not None:
                         # КЭШИРОВАННОЕ применение ручных изменений
                         # Выполняется ТОЛЬКО при изменении manual_selections, а не при каждом rerun!
                         # Было: ~1000ms при каждом клике → Стало: ~5ms (берется из кэша)
-                        final_result_df = apply_manual_selections_cached(
-                            result_df,
-                            st.session_state.manual_selections,
-                            hh_areas,
-                            cache_key="scenario1"
-                        )
+                        # Без изменений кэш не нужен: cache_data вернул бы pickle-копию всего результата
+                        if st.session_state.manual_selections:
+                            final_result_df = apply_manual_selections_cached(
+                                result_df,
+                                st.session_state.manual_selections,
+                                hh_areas,
+                                cache_key="scenario1"
+                            )
+                        else:
+                            final_result_df = result_df
 
                         # Добавляем города из added_cities
                         if st.session_state.added_cities:
+                            # Строки собираются списком и добавляются одним concat
+                            added_rows = []
                             for city in st.session_state.added_cities:
                                 if city in hh_areas:
-                                    final_result_df = pd.concat([final_result_df, pd.DataFrame([{
-                                        'row_id': len(final_result_df),
+                                    added_rows.append({
+                                        'row_id': len(final_result_df) + len(added_rows),
                                         'Исходное название': city,
                                         'Итоговое гео': city,
                                         'ID HH': hh_areas[city]['id'],
@@ -1286,7 +1791,11 @@ if uploaded_files and hh_areas is not None:
                                         'Совпадение %': 100.0,
                                         'Статус': '✅ Добавлено',
                                         'Изменение': 'Нет'
-                                    }])], ignore_index=True)  
+                                    })
+
+                            if added_rows:
+                                added_df = pd.DataFrame(added_rows)
+                                final_result_df = pd.concat([final_result_df, added_df], ignore_index=True)
             
             # ПРОВЕРЯЕМ РЕЖИМ РАБОТЫ
             # Если есть вакансии - показываем блок редактирования по вакансиям/вкладкам
@@ -1306,12 +1815,7 @@ if uploaded_files and hh_areas is not None:
                         num_items = len(st.session_state.sheets_results.keys())
                     elif st.session_state.sheet_mode == 'columns':
                         # Подсчитываем уникальные вакансии
-                        original_cols = st.session_state.original_df.columns.tolist()
-                        vacancy_col = None
-                        for col in original_cols:
-                            if 'вакансия' in str(col).lower():
-                                vacancy_col = col
-                                break
+                        vacancy_col = st.session_state.get('vacancy_col')
                         if vacancy_col:
                             num_items = len(result_df[vacancy_col].dropna().unique())
                         else:
@@ -1400,29 +1904,13 @@ if uploaded_files and hh_areas is not None:
 
                             result_df_sheet = sheet_result['result_df']
 
-                            # Применяем изменения из unified_mapping
-                            for row_idx, row in result_df_sheet.iterrows():
-                                original = str(row['Исходное название']).strip()
-                                normalized = original.replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                                normalized = ' '.join(normalized.split())
-
-                                if normalized in unified_mapping:
-                                    new_value = unified_mapping[normalized]
-
-                                    if new_value == "❌ Нет совпадения":
-                                        result_df_sheet.at[row_idx, 'Итоговое гео'] = None
-                                        result_df_sheet.at[row_idx, 'ID HH'] = None
-                                        result_df_sheet.at[row_idx, 'Регион'] = None
-                                        result_df_sheet.at[row_idx, 'Совпадение %'] = 0
-                                        result_df_sheet.at[row_idx, 'Изменение'] = 'Нет'
-                                        result_df_sheet.at[row_idx, 'Статус'] = '❌ Не найдено'
-                                    else:
-                                        result_df_sheet.at[row_idx, 'Итоговое гео'] = new_value
-                                        if new_value in hh_areas:
-                                            result_df_sheet.at[row_idx, 'ID HH'] = hh_areas[new_value]['id']
-                                            result_df_sheet.at[row_idx, 'Регион'] = hh_areas[new_value]['parent']
-                                        result_df_sheet.at[row_idx, 'Изменение'] = 'Да' if check_if_changed(original, new_value) else 'Нет'
-                                        result_df_sheet.at[row_idx, 'Статус'] = '✅ Точное' if result_df_sheet.at[row_idx, 'Совпадение %'] >= 95 else '⚠️ Похожее'
+                            # Применяем изменения из unified_mapping (векторно, на месте)
+                            apply_unified_mapping(
+                                result_df_sheet,
+                                unified_mapping,
+                                hh_areas,
+                                hh_lookup=get_hh_lookup_cached(hh_areas)
+                            )
 
                             # Обновляем данные в session_state
                             st.session_state.sheets_results[sheet_name]['result_df'] = result_df_sheet
@@ -1432,33 +1920,23 @@ if uploaded_files and hh_areas is not None:
                         status_text.text("Применение изменений...")
                         progress_bar.progress(0.5)
 
-                        # Применяем изменения к result_df
-                        for row_idx, row in result_df.iterrows():
-                            original = str(row['Исходное название']).strip()
-                            normalized = original.replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                            normalized = ' '.join(normalized.split())
-
-                            if normalized in unified_mapping:
-                                new_value = unified_mapping[normalized]
-
-                                if new_value == "❌ Нет совпадения":
-                                    result_df.at[row_idx, 'Итоговое гео'] = None
-                                    result_df.at[row_idx, 'ID HH'] = None
-                                    result_df.at[row_idx, 'Регион'] = None
-                                    result_df.at[row_idx, 'Совпадение %'] = 0
-                                    result_df.at[row_idx, 'Изменение'] = 'Нет'
-                                    result_df.at[row_idx, 'Статус'] = '❌ Не найдено'
-                                else:
-                                    result_df.at[row_idx, 'Итоговое гео'] = new_value
-                                    if new_value in hh_areas:
-                                        result_df.at[row_idx, 'ID HH'] = hh_areas[new_value]['id']
-                                        result_df.at[row_idx, 'Регион'] = hh_areas[new_value]['parent']
-                                    result_df.at[row_idx, 'Изменение'] = 'Да' if check_if_changed(original, new_value) else 'Нет'
+                        # Применяем изменения к result_df (векторно, на месте)
+                        apply_unified_mapping(
+                            result_df,
+                            unified_mapping,
+                            hh_areas,
+                            update_status=False,
+                            hh_lookup=get_hh_lookup_cached(hh_areas)
+                        )
 
                         # Обновляем данные в session_state
                         st.session_state.result_df = result_df
                         progress_bar.progress(1.0)
 
+                    # Результаты сопоставления изменены на месте - меняем ключ для кэшей,
+                    # которые не хэшируют DataFrame (get_editable_rows_cached и др.)
+                    st.session_state.results_key += f"|unified:{hash(frozenset(unified_mapping.items()))}"
+
                     status_text.text("✅ Изменения применены!")
                     progress_bar.empty()
                     status_text.empty()
@@ -1506,6 +1984,7 @@ if uploaded_files and hh_areas is not None:
                     elif st.session_state.sheet_mode == 'columns':
                         # Режим столбца "Вакансия"
                         # Собираем уникальные города из result_df
+                        vacancy_col = st.session_state.get('vacancy_col')
                         for idx, row in result_df.iterrows():
                             original = str(row['Исходное название']).strip()
                             normalized = original.replace('ё', 'е').replace('Ё', 'Е').lower().strip()
@@ -1513,13 +1992,6 @@ if uploaded_files and hh_areas is not None:
 
                             if normalized not in all_unique_cities:
                                 # Определяем к каким вакансиям относится этот город
-                                original_cols = st.session_state.original_df.columns.tolist()
-                                vacancy_col = None
-                                for col in original_cols:
-                                    if 'вакансия' in str(col).lower():
-                                        vacancy_col = col
-                                        break
-
                                 vacancy_value = row[vacancy_col] if vacancy_col and vacancy_col in row else None
 
                                 all_unique_cities[normalized] = {
@@ -1548,40 +2020,12 @@ if uploaded_files and hh_areas is not None:
                         if 'unified_selections' not in st.session_state:
                             st.session_state.unified_selections = {}
 
-                        # CSS для selectbox
-                        st.markdown("""
-                            <style>
-                                .unified-edit-section div[data-baseweb="select"] > div,
-                                .unified-edit-section .stSelectbox > div > div {
-                                    border: 2px solid #1a1a1a !important;
-                                    border-color: #1a1a1a !important;
-                                    outline: none !important;
-                                    box-shadow: none !important;
-                                }
-                                .unified-edit-section div[data-baseweb="select"] > div:hover,
-                                .unified-edit-section .stSelectbox:hover > div > div {
-                                    border-color: #1a1a1a !important;
-                                    box-shadow: 0 4px 16px rgba(0, 0, 0, 0.15) !important;
-                                }
-                                .unified-edit-section div[data-baseweb="select"] > div:focus-within,
-                                .unified-edit-section .stSelectbox > div > div:focus-within {
-                                    border-color: #1a1a1a !important;
-                                    box-shadow: 0 0 0 3px rgba(0, 0, 0, 0.1) !important;
-                                }
-                            </style>
-                            <div class="unified-edit-section">
-                        """, unsafe_allow_html=True)
+                        # Черная окантовка selectbox (CSS в static/styles.css)
+                        st.markdown('<div class="unified-edit-section">', unsafe_allow_html=True)
 
                         # Callback для сохранения выбора
-                        def on_city_select_unified(normalized_key, widget_key):
-                            selected = st.session_state.get(widget_key)
-                            if selected == "❌ Нет совпадения":
-                                st.session_state.unified_selections[normalized_key] = "❌ Нет совпадения"
-                            elif selected:
-                                # Извлекаем название без процента
-                                city_match = selected.rsplit(' (', 1)[0]
-                                st.session_state.unified_selections[normalized_key] = city_match
-
+                        def on_city_select_unified(normalized_key, widget_key, option_cities):
+                            on_city_select(normalized_key, widget_key, option_cities, store='unified_selections')
                             # Помечаем что есть неприменённые изменения
                             st.session_state.unified_changes_applied = False
 
@@ -1610,11 +2054,11 @@ if uploaded_files and hh_areas is not None:
                                 cache_key = ('unified', normalized)
                                 candidates = st.session_state.candidates_cache.get(cache_key, [])
                                 if not candidates:
-                                    candidates = get_candidates_by_word(city_name, get_russian_cities_cached(hh_areas), limit=20)
+                                    candidates = tuple(get_candidates_cached(normalize_city_name(city_name), hh_areas, limit=20))
                                     st.session_state.candidates_cache[cache_key] = candidates
 
                                 # Формируем options
-                                options, candidates_dict = prepare_city_options(
+                                options, candidates_dict, option_cities = prepare_city_options(
                                     tuple(candidates),
                                     current_value,
                                     current_match,
@@ -1629,7 +2073,7 @@ if uploaded_files and hh_areas is not None:
                                     # Выбираем город с МАКСИМАЛЬНЫМ процентом
                                     # Берем из options (уже отсортированного списка) первый элемент после "❌ Нет совпадения"
                                     if len(options) > 1:
-                                        selected_value = options[1].rsplit(' (', 1)[0]
+                                        selected_value = option_cities[options[1]]
                                     else:
                                         selected_value = current_value
 
@@ -1646,7 +2090,7 @@ if uploaded_files and hh_areas is not None:
                                     key=widget_key,
                                     label_visibility="collapsed",
                                     on_change=on_city_select_unified,
-                                    args=(normalized, widget_key)
+                                    args=(normalized, widget_key, option_cities)
                                 )
 
                             with col3:
@@ -1670,11 +2114,9 @@ if uploaded_files and hh_areas is not None:
 
                     col_selector = st.columns([1, 1])
                     with col_selector[0]:
-                        russia_cities = get_russian_cities_cached(hh_areas)
-
                         selected_city_unified = st.selectbox(
                             "Выберите город:",
-                            options=sorted(russia_cities),
+                            options=get_sorted_russian_cities_cached(hh_areas),
                             key="unified_city_selector",
                             help="Выберите город из справочника HH.ru"
                         )
@@ -1714,13 +2156,12 @@ if uploaded_files and hh_areas is not None:
 
                     # Применяем изменения из unified_selections ко всем вакансиям/вкладкам
                     # Создаем mapping: normalized_city -> new_value
-                    unified_mapping = {}
-                    for normalized, new_value in st.session_state.unified_selections.items():
-                        unified_mapping[normalized] = new_value
+                    unified_mapping = dict(st.session_state.unified_selections)
 
-                    # Формируем файлы для каждой вакансии/вкладки с учетом изменений
-                    if 'vacancy_files' not in st.session_state:
-                        st.session_state.vacancy_files = {}
+                    # Формируем файлы для каждой вакансии/вкладки с учетом изменений.
+                    # Список пересобирается на каждом rerun, поэтому хранится локально
+                    # (DataFrame, а не байты Excel) - книги пишутся сразу в архив
+                    unified_files = {}
 
                     # Также собираем все уникальные города для публикатора
                     all_cities_for_publisher = set()
@@ -1728,32 +2169,19 @@ if uploaded_files and hh_areas is not None:
                     if st.session_state.sheet_mode == 'tabs':
                         # Режим вкладок
                         for sheet_name, sheet_result in st.session_state.sheets_results.items():
-                            result_df_sheet = sheet_result['result_df'].copy()
+                            result_df_sheet = sheet_result['result_df']
                             original_df_sheet = st.session_state.sheets_data[sheet_name]['df']
 
-                            # Применяем изменения из unified_mapping
-                            for idx, row in result_df_sheet.iterrows():
-                                original = str(row['Исходное название']).strip()
-                                normalized = original.replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                                normalized = ' '.join(normalized.split())
-
-                                if normalized in unified_mapping:
-                                    new_value = unified_mapping[normalized]
-
-                                    if new_value == "❌ Нет совпадения":
-                                        result_df_sheet.at[idx, 'Итоговое гео'] = None
-                                        result_df_sheet.at[idx, 'ID HH'] = None
-                                        result_df_sheet.at[idx, 'Регион'] = None
-                                        result_df_sheet.at[idx, 'Совпадение %'] = 0
-                                        result_df_sheet.at[idx, 'Изменение'] = 'Нет'
-                                        result_df_sheet.at[idx, 'Статус'] = '❌ Не найдено'
-                                    else:
-                                        result_df_sheet.at[idx, 'Итоговое гео'] = new_value
-                                        if new_value in hh_areas:
-                                            result_df_sheet.at[idx, 'ID HH'] = hh_areas[new_value]['id']
-                                            result_df_sheet.at[idx, 'Регион'] = hh_areas[new_value]['parent']
-                                        result_df_sheet.at[idx, 'Изменение'] = 'Да' if check_if_changed(original, new_value) else 'Нет'
-                                        result_df_sheet.at[idx, 'Статус'] = '✅ Точное' if result_df_sheet.at[idx, 'Совпадение %'] >= 95 else '⚠️ Похожее'
+                            # Применяем изменения из unified_mapping.
+                            # Без изменений вкладка используется как есть - без копии и обхода строк
+                            if unified_mapping:
+                                result_df_sheet = result_df_sheet.copy()
+                                apply_unified_mapping(
+                                    result_df_sheet,
+                                    unified_mapping,
+                                    hh_areas,
+                                    hh_lookup=get_hh_lookup_cached(hh_areas)
+                                )
 
                             # Подготовка итогового вывода
                             final_output = prepare_final_sheet_output_cached(
@@ -1784,10 +2212,9 @@ if uploaded_files and hh_areas is not None:
 
                                 # Сохраняем файл
                                 safe_sheet_name = str(sheet_name).replace('/', '_').replace('\\', '_')[:50]
-                                excel_bytes = create_excel_bytes_cached(final_output, sheet_name)
 
-                                st.session_state.vacancy_files[sheet_name] = {
-                                    'data': excel_bytes,
+                                unified_files[sheet_name] = {
+                                    'df': final_output,
                                     'name': f"{safe_sheet_name}.xlsx",
                                     'count': len(final_output)
                                 }
@@ -1796,58 +2223,35 @@ if uploaded_files and hh_areas is not None:
                         # Режим столбца "Вакансия"
                         # Находим столбец "Вакансия"
                         original_cols = st.session_state.original_df.columns.tolist()
-                        vacancy_col = None
-                        for col in original_cols:
-                            if 'вакансия' in str(col).lower():
-                                vacancy_col = col
-                                break
+                        vacancy_col = st.session_state.get('vacancy_col')
 
                         if vacancy_col:
                             # Применяем изменения к result_df
                             result_df_modified = result_df.copy()
-
-                            for idx, row in result_df_modified.iterrows():
-                                original = str(row['Исходное название']).strip()
-                                normalized = original.replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                                normalized = ' '.join(normalized.split())
-
-                                if normalized in unified_mapping:
-                                    new_value = unified_mapping[normalized]
-
-                                    if new_value == "❌ Нет совпадения":
-                                        result_df_modified.at[idx, 'Итоговое гео'] = None
-                                        result_df_modified.at[idx, 'ID HH'] = None
-                                        result_df_modified.at[idx, 'Регион'] = None
-                                        result_df_modified.at[idx, 'Совпадение %'] = 0
-                                        result_df_modified.at[idx, 'Изменение'] = 'Нет'
-                                        result_df_modified.at[idx, 'Статус'] = '❌ Не найдено'
-                                    else:
-                                        result_df_modified.at[idx, 'Итоговое гео'] = new_value
-                                        if new_value in hh_areas:
-                                            result_df_modified.at[idx, 'ID HH'] = hh_areas[new_value]['id']
-                                            result_df_modified.at[idx, 'Регион'] = hh_areas[new_value]['parent']
-                                        result_df_modified.at[idx, 'Изменение'] = 'Да' if check_if_changed(original, new_value) else 'Нет'
+                            apply_unified_mapping(
+                                result_df_modified,
+                                unified_mapping,
+                                hh_areas,
+                                update_status=False,
+                                hh_lookup=get_hh_lookup_cached(hh_areas)
+                            )
 
                             # Получаем уникальные вакансии
+                            status_masks = get_status_masks(result_df_modified['Статус'])
                             export_df = result_df_modified[
-                                (result_df_modified['Итоговое гео'].notna()) &
-                                (~result_df_modified['Статус'].str.contains('❌ Не найдено', na=False)) &
-                                (~result_df_modified['Статус'].str.contains('Пустое значение', na=False))
-                            ].copy()
+                                result_df_modified['Итоговое гео'].notna().to_numpy() &
+                                ~status_masks['not_found'] &
+                                ~status_masks['empty']
+                            ]
 
                             unique_vacancies = sorted(export_df[vacancy_col].dropna().unique())
 
                             # Создаем файл для каждой вакансии
                             for vacancy in unique_vacancies:
-                                vacancy_df = export_df[export_df[vacancy_col] == vacancy].copy()
+                                vacancy_df = export_df[export_df[vacancy_col] == vacancy]
 
                                 # Формируем итоговый DataFrame
-                                final_output = pd.DataFrame()
-                                final_output[original_cols[0]] = vacancy_df['Итоговое гео']
-
-                                for col in original_cols[1:]:
-                                    if col in vacancy_df.columns:
-                                        final_output[col] = vacancy_df[col].values
+                                final_output = build_export_frame(vacancy_df, original_cols)
 
                                 # Удаляем дубликаты
                                 final_output = final_output.drop_duplicates(subset=[original_cols[0]], keep='first')
@@ -1873,18 +2277,17 @@ if uploaded_files and hh_areas is not None:
 
                                     # Сохраняем файл
                                     safe_vacancy_name = str(vacancy).replace('/', '_').replace('\\', '_')[:50]
-                                    excel_bytes = create_excel_bytes_cached(final_output, vacancy)
 
-                                    st.session_state.vacancy_files[vacancy] = {
-                                        'data': excel_bytes,
+                                    unified_files[vacancy] = {
+                                        'df': final_output,
                                         'name': f"{safe_vacancy_name}.xlsx",
                                         'count': len(final_output)
                                     }
 
                     # Показываем кнопки для скачивания
-                    if st.session_state.vacancy_files:
-                        total_files = len(st.session_state.vacancy_files)
-                        total_cities_in_files = sum(f['count'] for f in st.session_state.vacancy_files.values())
+                    if unified_files:
+                        total_files = len(unified_files)
+                        total_cities_in_files = sum(f['count'] for f in unified_files.values())
 
                         # Кнопка для скачивания архива со всеми файлами
                         col_download1, col_download2 = st.columns(2)
@@ -1892,16 +2295,17 @@ if uploaded_files and hh_areas is not None:
                         with col_download1:
                             st.markdown("#### 📦 Скачать все вакансии архивом")
 
-                            zip_buffer = io.BytesIO()
-                            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                for item_name, file_info in st.session_state.vacancy_files.items():
-                                    zip_file.writestr(file_info['name'], file_info['data'])
-
-                            zip_buffer.seek(0)
+                            # OPTIMIZED: книги пишутся сразу в архив, результат кэшируется.
+                            # Сокращенные имена разных вакансий могут совпасть - делаем их
+                            # уникальными, чтобы ни один файл не затерся в архиве
+                            archive_names = make_unique_filenames([f['name'] for f in unified_files.values()])
+                            zip_bytes = create_excel_archive_cached(
+                                dict(zip(archive_names, (f['df'] for f in unified_files.values())))
+                            )
 
                             st.download_button(
                                 label=f"📥 Скачать архив ({total_files} файлов)",
-                                data=zip_buffer,
+                                data=zip_bytes,
                                 file_name=f"all_vacancies_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
                                 mime="application/zip",
                                 use_container_width=True,
@@ -1981,133 +2385,102 @@ if uploaded_files and hh_areas is not None:
                     original_df_sheet = st.session_state.sheets_data[sheet_name]['df']
 
                     # Блок редактирования городов с совпадением ≤ 95%
-                    editable_rows = result_df_sheet[
-                        (result_df_sheet['Совпадение %'] <= 95) &
-                        (~result_df_sheet['Статус'].str.contains('Дубликат', na=False))
-                    ].copy()
-                    
-                    if len(editable_rows) > 0:
-                        # Убираем дубликаты по исходному названию (VECTORIZED)
-                        editable_rows['_normalized_original'] = (
-                            editable_rows['Исходное название']
-                            .fillna('').astype(str)
-                            .str.replace('ё', 'е').str.replace('Ё', 'Е')
-                            .str.lower().str.strip()
-                            .str.replace(r'\s+', ' ', regex=True)
-                        )
-                        editable_rows = editable_rows.drop_duplicates(subset=['_normalized_original'], keep='first')
-
-                        # Сортируем: сначала "Нет совпадения", затем по возрастанию процента
-                        # VECTORIZED: sort priority (0 for not found, 1 for others)
-                        editable_rows['_sort_priority'] = (~editable_rows['Статус'].str.contains('❌ Не найдено', na=False)).astype(int)
-                        editable_rows = editable_rows.sort_values(
-                            ['_sort_priority', 'Совпадение %'],
-                            ascending=[True, True]
-                        )
-                        editable_rows = editable_rows.drop(columns=['_sort_priority'])
+                    # (отбор, удаление повторов и сортировка кэшируются на вкладку)
+                    editable_rows = get_editable_rows_cached(
+                        st.session_state.results_key, sheet_name, result_df_sheet
+                    )
 
+                    if len(editable_rows) > 0:
                         st.markdown("#### ✏️ Редактирование городов с совпадением ≤ 95%")
 
-                        # FIX: Force black border for Scenario 2 (tabs) editing selectboxes
-                        st.markdown("""
-                            <style>
-                                .scenario2-edit-section div[data-baseweb="select"] > div,
-                                .scenario2-edit-section .stSelectbox > div > div {
-                                    border: 2px solid #1a1a1a !important;
-                                    border-color: #1a1a1a !important;
-                                    outline: none !important;
-                                    box-shadow: none !important;
-                                }
-                                .scenario2-edit-section div[data-baseweb="select"] > div:hover,
-                                .scenario2-edit-section .stSelectbox:hover > div > div {
-                                    border-color: #1a1a1a !important;
-                                    box-shadow: 0 4px 16px rgba(0, 0, 0, 0.15) !important;
-                                }
-                                .scenario2-edit-section div[data-baseweb="select"] > div:focus-within,
-                                .scenario2-edit-section .stSelectbox > div > div:focus-within {
-                                    border-color: #1a1a1a !important;
-                                    box-shadow: 0 0 0 3px rgba(0, 0, 0, 0.1) !important;
-                                }
-                            </style>
-                            <div class="scenario2-edit-section">
-                        """, unsafe_allow_html=True)
+                        # FIX: Force black border for Scenario 2 (tabs) editing selectboxes (CSS в static/styles.css)
+                        st.markdown('<div class="scenario2-edit-section">', unsafe_allow_html=True)
 
                         # ============================================
-                        # CALLBACK для предотвращения полного rerun
+                        # ФОРМА: выбор города в selectbox не вызывает rerun,
+                        # все изменения вкладки применяются одним rerun по кнопке
                         # ============================================
-                        def on_city_select_tab(selection_key, widget_key):
-                            """Callback для режима split - вызывается только при изменении"""
-                            selected = st.session_state.get(widget_key)
-                            if selected == "❌ Нет совпадения":
-                                st.session_state.manual_selections[selection_key] = "❌ Нет совпадения"
-                            elif selected:
-                                # Извлекаем название без процента
-                                city_match = selected.rsplit(' (', 1)[0]
-                                st.session_state.manual_selections[selection_key] = city_match
+                        def on_tab_form_submit(form_widgets):
+                            """Callback кнопки формы - сохраняет выборы, отличающиеся от показанных"""
+                            for selection_key, widget_key, shown_option, option_cities in form_widgets:
+                                if st.session_state.get(widget_key) != shown_option:
+                                    on_city_select(selection_key, widget_key, option_cities)
 
-                        # ============================================
-                        # Для каждого города показываем выбор
-                        for idx, row in editable_rows.iterrows():
-                            row_id = row['row_id']
-                            city_name = row['Исходное название']
-                            current_value = row['Итоговое гео']
-                            current_match = row['Совпадение %']
-
-                            # Используем кэш кандидатов из smart_match_city
-                            cache_key = (sheet_name, row_id)
-                            candidates = st.session_state.candidates_cache.get(cache_key, [])
-                            if not candidates:
-                                candidates = get_candidates_by_word(city_name, get_russian_cities_cached(hh_areas), limit=20)
-
-                            # Кэшированная подготовка options (избегаем повторных вычислений)
-                            options, candidates_dict = prepare_city_options(
-                                tuple(candidates),
-                                current_value,
-                                current_match,
-                                city_name
-                            )
+                        # (selection_key, widget_key, показанный вариант, option_cities) для callback формы
+                        form_widgets = []
 
-                            # Определяем текущий выбор
-                            unique_key = f"select_{sheet_name}_{row_id}_{tab_idx}"
-                            selection_key = (sheet_name, row_id)
+                        with st.form(key=f"edit_form_{sheet_name}_{tab_idx}", border=False):
+                            # ============================================
+                            # Для каждого города показываем выбор
+                            for row_id, city_name, current_value, current_match in zip(
+                                editable_rows['row_id'].tolist(),
+                                editable_rows['Исходное название'].tolist(),
+                                editable_rows['Итоговое гео'].tolist(),
+                                editable_rows['Совпадение %'].tolist()
+                            ):
+
+                                # Используем кэш кандидатов из smart_match_city
+                                cache_key = (sheet_name, row_id)
+                                candidates = st.session_state.candidates_cache.get(cache_key, [])
+                                if not candidates:
+                                    candidates = get_candidates_cached(normalize_city_name(city_name), hh_areas, limit=20)
 
-                            if selection_key in st.session_state.manual_selections:
-                                selected_value = st.session_state.manual_selections[selection_key]
-                            else:
-                                # Выбираем город с МАКСИМАЛЬНЫМ процентом
-                                # Берем из options (уже отсортированного списка) первый элемент после "❌ Нет совпадения"
-                                if len(options) > 1:
-                                    selected_value = options[1].rsplit(' (', 1)[0]
+                                # Кэшированная подготовка options (избегаем повторных вычислений)
+                                options, candidates_dict, option_cities = prepare_city_options(
+                                    tuple(candidates),
+                                    current_value,
+                                    current_match,
+                                    city_name
+                                )
+
+                                # Определяем текущий выбор
+                                unique_key = f"select_{sheet_name}_{row_id}_{tab_idx}"
+                                selection_key = (sheet_name, row_id)
+
+                                if selection_key in st.session_state.manual_selections:
+                                    selected_value = st.session_state.manual_selections[selection_key]
                                 else:
-                                    selected_value = current_value
+                                    # Выбираем город с МАКСИМАЛЬНЫМ процентом
+                                    # Берем из options (уже отсортированного списка) первый элемент после "❌ Нет совпадения"
+                                    if len(options) > 1:
+                                        selected_value = option_cities[options[1]]
+                                    else:
+                                        selected_value = current_value
 
-                            # Быстрый поиск индекса O(1)
-                            if selected_value == "❌ Нет совпадения":
-                                default_idx = 0
-                            else:
-                                default_idx = candidates_dict.get(selected_value, 0)
+                                # Быстрый поиск индекса O(1)
+                                if selected_value == "❌ Нет совпадения":
+                                    default_idx = 0
+                                else:
+                                    default_idx = candidates_dict.get(selected_value, 0)
 
-                            col1, col2, col3 = st.columns([2, 3, 1])
+                                col1, col2, col3 = st.columns([2, 3, 1])
 
-                            with col1:
-                                st.text(city_name)
+                                with col1:
+                                    st.text(city_name)
 
-                            with col2:
-                                st.selectbox(
-                                    "Выберите город:",
-                                    options=options,
-                                    index=default_idx,
-                                    key=unique_key,
-                                    label_visibility="collapsed",
-                                    on_change=on_city_select_tab,
-                                    args=(selection_key, unique_key)
-                                )
+                                with col2:
+                                    st.selectbox(
+                                        "Выберите город:",
+                                        options=options,
+                                        index=default_idx,
+                                        key=unique_key,
+                                        label_visibility="collapsed"
+                                    )
+                                    form_widgets.append((selection_key, unique_key, options[default_idx], option_cities))
 
-                            with col3:
-                                st.text(f"{row['Совпадение %']:.1f}%")
+                                with col3:
+                                    st.text(f"{current_match:.1f}%")
 
-                            # VISUAL: Добавляем разделитель как в Сценарии 2
-                            st.markdown("<hr style='margin-top: 5px; margin-bottom: 5px;'>", unsafe_allow_html=True)
+                                # VISUAL: Добавляем разделитель как в Сценарии 2
+                                st.markdown("<hr style='margin-top: 5px; margin-bottom: 5px;'>", unsafe_allow_html=True)
+
+                            st.form_submit_button(
+                                "✅ Применить изменения",
+                                on_click=on_tab_form_submit,
+                                args=(form_widgets,),
+                                use_container_width=True,
+                                type="primary"
+                            )
 
                         # Close the scenario2 edit section wrapper
                         st.markdown("</div>", unsafe_allow_html=True)
@@ -2128,12 +2501,9 @@ if uploaded_files and hh_areas is not None:
                     # Селектор на половину ширины экрана
                     col_selector_tab = st.columns([1, 1])
                     with col_selector_tab[0]:
-                        # Используем кэшированную версию
-                        russia_cities = get_russian_cities_cached(hh_areas)
-
                         selected_city_tab = st.selectbox(
                             "Выберите город:",
-                            options=sorted(russia_cities),
+                            options=get_sorted_russian_cities_cached(hh_areas),
                             key=f"city_selector_{sheet_name}",
                             help="Выберите город из справочника HH.ru"
                         )
@@ -2185,25 +2555,25 @@ if uploaded_files and hh_areas is not None:
                         )
 
                     # Применяем ручные изменения через КЭШИРОВАННУЮ функцию
-                    # Фильтруем только изменения для текущей вкладки
-                    sheet_selections = {}
-                    for selection_key, new_value in st.session_state.manual_selections.items():
-                        if isinstance(selection_key, tuple):
-                            key_sheet_name, row_id = selection_key
-                            if key_sheet_name == sheet_name:
-                                sheet_selections[row_id] = new_value
-                        else:
-                            # Для обратной совместимости
-                            sheet_selections[selection_key] = new_value
+                    # Изменения раскладываются по вкладкам за один проход; ключи старого
+                    # формата (без вкладки) действуют для всех вкладок - для обратной совместимости
+                    selections_by_sheet, common_selections = group_manual_selections(
+                        st.session_state.manual_selections
+                    )
+                    sheet_selections = {**common_selections, **selections_by_sheet.get(sheet_name, {})}
 
                     # Используем кэшированную функцию вместо цикла
                     # FIX: Передаем sheet_name в cache_key для уникальности кэша каждой вкладки
-                    result_df_sheet_final = apply_manual_selections_cached(
-                        result_df_sheet,
-                        sheet_selections,
-                        hh_areas,
-                        cache_key=f"tab_{sheet_name}"
-                    )
+                    # Без изменений кэш не нужен: cache_data вернул бы pickle-копию всей вкладки
+                    if sheet_selections:
+                        result_df_sheet_final = apply_manual_selections_cached(
+                            result_df_sheet,
+                            sheet_selections,
+                            hh_areas,
+                            cache_key=f"tab_{sheet_name}"
+                        )
+                    else:
+                        result_df_sheet_final = result_df_sheet
                     
                     # FIX: Используем кэшированную функцию подготовки данных
                     # Это предотвращает повторные вычисления (merge, filter) при каждом клике
@@ -2254,9 +2624,10 @@ if uploaded_files and hh_areas is not None:
                             key=f"download_sheet_{sheet_name}_{tab_idx}"
                         )
                         
-                        # Сохраняем в session_state для архива (обновляется при каждом изменении селектора)
+                        # Сохраняем в session_state для архива (обновляется при каждом изменении селектора).
+                        # Храним DataFrame, а не байты Excel: книги собираются только при формировании архива
                         st.session_state.vacancy_files[sheet_name] = {
-                            'data': excel_bytes,
+                            'df': final_output,
                             'name': f"{safe_sheet_name}.xlsx",
                             'count': len(final_output)
                         }
@@ -2274,16 +2645,14 @@ if uploaded_files and hh_areas is not None:
                         total_cities = sum(f['count'] for f in st.session_state.vacancy_files.values())
                         
                         if st.button("📦 Сформировать архив", use_container_width=True, type="primary", key="create_sheets_archive"):
-                            zip_buffer = io.BytesIO()
-                            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                for sheet_name, file_info in st.session_state.vacancy_files.items():
-                                    zip_file.writestr(file_info['name'], file_info['data'])
-                            
-                            zip_buffer.seek(0)
-                            
+                            # Книги пишутся сразу в архив (ZIP_STORED: xlsx уже сжат)
+                            zip_bytes = create_excel_archive_cached(
+                                {file_info['name']: file_info['df'] for file_info in st.session_state.vacancy_files.values()}
+                            )
+
                             st.download_button(
                                 label=f"📥 Скачать архив ({len(st.session_state.vacancy_files)} вкладок, {total_cities} городов)",
-                                data=zip_buffer,
+                                data=zip_bytes,
                                 file_name=f"all_sheets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
                                 mime="application/zip",
                                 use_container_width=True,
@@ -2300,43 +2669,13 @@ if uploaded_files and hh_areas is not None:
                 # Получаем названия столбцов
                 original_cols = st.session_state.original_df.columns.tolist()
                 
-                # Находим столбец "Вакансия"
-                vacancy_col = None
-                for col in original_cols:
-                    if 'вакансия' in str(col).lower():
-                        vacancy_col = col
-                        break
+                # Столбец "Вакансия" (определен при загрузке файла)
+                vacancy_col = st.session_state.get('vacancy_col')
                 
                 if vacancy_col:
                     # FIX: Формируем данные для экспорта (исключаем не найденные с эмодзи)
-                    export_df = result_df[
-                        (result_df['Итоговое гео'].notna()) &
-                        (~result_df['Статус'].str.contains('❌ Не найдено', na=False)) &
-                        (~result_df['Статус'].str.contains('Пустое значение', na=False))
-                    ].copy()
-
                     # КРИТИЧНО: Также исключаем ВСЕ дубликаты городов с "❌ Не найдено"
-                    excluded_cities = result_df[
-                        result_df['Статус'].str.contains('❌ Не найдено', na=False)
-                    ]['Исходное название'].unique()
-
-                    if len(excluded_cities) > 0:
-                        excluded_normalized = set()
-                        for city in excluded_cities:
-                            if pd.notna(city):
-                                normalized = str(city).replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                                normalized = ' '.join(normalized.split())
-                                excluded_normalized.add(normalized)
-
-                        export_df['_temp_normalized'] = (
-                            export_df['Исходное название']
-                            .fillna('').astype(str)
-                            .str.replace('ё', 'е').str.replace('Ё', 'Е')
-                            .str.lower().str.strip()
-                            .str.replace(r'\s+', ' ', regex=True)
-                        )
-                        export_df = export_df[~export_df['_temp_normalized'].isin(excluded_normalized)].copy()
-                        export_df = export_df.drop(columns=['_temp_normalized'])
+                    export_df = select_export_rows(result_df)
 
                     # Получаем уникальные вакансии
                     if vacancy_col in export_df.columns:
@@ -2369,158 +2708,81 @@ if uploaded_files and hh_areas is not None:
                         tab_idx = unique_vacancies.index(vacancy)
 
                         # Фильтруем данные по вакансии
-                        vacancy_df = export_df[export_df[vacancy_col] == vacancy].copy()
+                        vacancy_df = export_df[export_df[vacancy_col] == vacancy]
 
                         # Показываем таблицу с возможностью редактирования
                         st.markdown("#### Города для редактирования (совпадение ≤ 95%)")
 
-                        # FIX: Force black border for Scenario 3 (columns/vacancy) editing selectboxes
-                        st.markdown("""
-                            <style>
-                                .scenario3-edit-section div[data-baseweb="select"] > div,
-                                .scenario3-edit-section .stSelectbox > div > div {
-                                    border: 2px solid #1a1a1a !important;
-                                    border-color: #1a1a1a !important;
-                                    outline: none !important;
-                                    box-shadow: none !important;
-                                }
-                                .scenario3-edit-section div[data-baseweb="select"] > div:hover,
-                                .scenario3-edit-section .stSelectbox:hover > div > div {
-                                    border-color: #1a1a1a !important;
-                                    box-shadow: 0 4px 16px rgba(0, 0, 0, 0.15) !important;
-                                }
-                                .scenario3-edit-section div[data-baseweb="select"] > div:focus-within,
-                                .scenario3-edit-section .stSelectbox > div > div:focus-within {
-                                    border-color: #1a1a1a !important;
-                                    box-shadow: 0 0 0 3px rgba(0, 0, 0, 0.1) !important;
-                                }
-                            </style>
-                            <div class="scenario3-edit-section">
-                        """, unsafe_allow_html=True)
+                        # FIX: Force black border for Scenario 3 (columns/vacancy) editing selectboxes (CSS в static/styles.css)
+                        st.markdown('<div class="scenario3-edit-section">', unsafe_allow_html=True)
 
-                        editable_vacancy_rows = vacancy_df[vacancy_df['Совпадение %'] <= 95].copy()
+                        editable_vacancy_rows = vacancy_df[vacancy_df['Совпадение %'] <= 95]
                         
                         # Убираем дубликаты по исходному названию для редактирования
                         if len(editable_vacancy_rows) > 0:
-                            # VECTORIZED: normalize city name
-                            editable_vacancy_rows['_normalized_original'] = (
-                                editable_vacancy_rows['Исходное название']
-                                .fillna('').astype(str)
-                                .str.replace('ё', 'е').str.replace('Ё', 'Е')
-                                .str.lower().str.strip()
-                                .str.replace(r'\s+', ' ', regex=True)
-                            )
-                            editable_vacancy_rows = editable_vacancy_rows.drop_duplicates(subset=['_normalized_original'], keep='first')
-
                             # Сортируем: сначала "Нет совпадения", затем по возрастанию процента
-                            # VECTORIZED: sort priority (0 for not found, 1 for others)
-                            editable_vacancy_rows['_sort_priority'] = (~editable_vacancy_rows['Статус'].str.contains('❌ Не найдено', na=False)).astype(int)
-                            editable_vacancy_rows = editable_vacancy_rows.sort_values(
-                                ['_sort_priority', 'Совпадение %'],
-                                ascending=[True, True]
-                            )
-                            editable_vacancy_rows = editable_vacancy_rows.drop(columns=['_sort_priority'])
+                            editable_vacancy_rows = prepare_editable_rows(editable_vacancy_rows)
 
                         if len(editable_vacancy_rows) > 0:
 
-                            # Callback для сохранения выбора ТОЛЬКО при изменении
-                            def on_city_select_vacancy(selection_key, widget_key):
-                                """Callback для режима split vacancy - вызывается только при изменении"""
-                                selected = st.session_state.get(widget_key)
-                                if selected == "❌ Нет совпадения":
-                                    st.session_state.manual_selections[selection_key] = "❌ Нет совпадения"
-                                elif selected:
-                                    # Извлекаем название без процента
-                                    if "(" in selected and not selected.startswith("❌"):
-                                        city_match = selected.rsplit(' (', 1)[0]
-                                        st.session_state.manual_selections[selection_key] = city_match
-                                    else:
-                                        st.session_state.manual_selections[selection_key] = selected
-
-                            # Получаем список всех городов России для выбора
-                            russia_cities_for_select = []
-                            for city_name, city_info in hh_areas.items():
-                                if city_info.get('root_parent_id') == '113':
-                                    russia_cities_for_select.append(city_name)
-                            russia_cities_for_select = sorted(russia_cities_for_select)
+                            # result_df - первая вкладка; кандидаты в кэше хранятся по ключу (вкладка, row_id)
+                            result_sheet_name = next(iter(st.session_state.sheets_results))
 
-                            for idx, row in editable_vacancy_rows.iterrows():
+                            for row_id, city_name, current_value, current_match in zip(
+                                editable_vacancy_rows['row_id'].tolist(),
+                                editable_vacancy_rows['Исходное название'].tolist(),
+                                editable_vacancy_rows['Итоговое гео'].tolist(),
+                                editable_vacancy_rows['Совпадение %'].tolist()
+                            ):
                                 col1, col2, col3 = st.columns([2, 3, 1])
                                 
                                 with col1:
-                                    st.markdown(f"**{row['Исходное название']}**")
+                                    st.markdown(f"**{city_name}**")
                                 
                                 with col2:
-                                    row_id = row['row_id']
-                                    city_name = row['Исходное название']
-                                    current_value = row['Итоговое гео']
-                                    current_match = row['Совпадение %']
 
                                     # Используем кэш кандидатов из smart_match_city
-                                    candidates = st.session_state.candidates_cache.get(row_id, [])
+                                    candidates = st.session_state.candidates_cache.get((result_sheet_name, row_id), [])
 
                                     # Если кэша нет, ищем заново (для обратной совместимости)
                                     if not candidates:
                                         # Используем только российские города
                                         # OPTIMIZED: use cached version
-                                        candidates = get_candidates_by_word(city_name, get_russian_cities_cached(hh_areas), limit=20)
-                                    
-                                    # Если есть текущее значение из сопоставления - добавляем его в список
-                                    if current_value and current_value != city_name:
-                                        # Проверяем, есть ли уже это значение в кандидатах
-                                        candidate_names = [c[0] for c in candidates]
-                                        if current_value not in candidate_names:
-                                            # Добавляем текущее значение в список
-                                            candidates.append((current_value, current_match))
-
-                                    # Сортируем кандидатов по убыванию процента совпадения
-                                    candidates.sort(key=lambda x: x[1], reverse=True)
-
-                                    # Формируем опции - всегда показываем топ кандидатов
-                                    if candidates:
-                                        options = ["❌ Нет совпадения"] + [f"{c[0]} ({c[1]:.1f}%)" for c in candidates[:20]]
-                                    else:
-                                        # Если совсем нет кандидатов - показываем хотя бы "Нет совпадения"
-                                        options = ["❌ Нет совпадения"]
-                                    
+                                        candidates = get_candidates_cached(normalize_city_name(city_name), hh_areas, limit=20)
+
+                                    # Те же options, что и в остальных блоках редактирования:
+                                    # текущее значение добавлено, кандидаты отсортированы по проценту
+                                    options, candidates_dict, option_cities = prepare_city_options(
+                                        tuple(candidates),
+                                        current_value,
+                                        current_match,
+                                        city_name
+                                    )
+
                                     # Уникальный ключ для каждой вакансии
                                     unique_key = f"select_{vacancy}_{row_id}_{tab_idx}"
                                     selection_key = (vacancy, row_id)
 
+                                    # Индекс по названию города - O(1) вместо перебора options по подстроке
                                     if selection_key in st.session_state.manual_selections:
                                         selected_value = st.session_state.manual_selections[selection_key]
-                                        if selected_value == "❌ Нет совпадения":
-                                            default_idx = 0
-                                        else:
-                                            # Ищем в options, может быть как с процентом, так и без
-                                            default_idx = 0
-                                            for i, opt in enumerate(options):
-                                                if selected_value in opt or opt.startswith(selected_value):
-                                                    default_idx = i
-                                                    break
                                     else:
                                         # Если manual_selections нет, используем current_value из результата сопоставления
-                                        default_idx = 0
-                                        if current_value:
-                                            # Ищем current_value в options (может быть с процентом)
-                                            for i, opt in enumerate(options):
-                                                # opt вида "Город (Область) (90.0%)", current_value вида "Город (Область)"
-                                                if opt.startswith(current_value) or current_value in opt:
-                                                    default_idx = i
-                                                    break
-                                    
+                                        selected_value = current_value
+                                    default_idx = candidates_dict.get(selected_value, 0)
+
                                     st.selectbox(
                                         "Выберите город:",
                                         options=options,
                                         index=default_idx,
                                         key=unique_key,
                                         label_visibility="collapsed",
-                                        on_change=on_city_select_vacancy,
-                                        args=(selection_key, unique_key)
+                                        on_change=on_city_select,
+                                        args=(selection_key, unique_key, option_cities)
                                     )
                                 
                                 with col3:
-                                    st.text(f"{row['Совпадение %']}%")
+                                    st.text(f"{current_match}%")
                                 
                                 st.markdown("<hr style='margin-top: 5px; margin-bottom: 5px;'>", unsafe_allow_html=True)
 
@@ -2544,15 +2806,9 @@ if uploaded_files and hh_areas is not None:
                         # Селектор на половину ширины экрана
                         col_add_selector = st.columns([1, 1])
                         with col_add_selector[0]:
-                            # Получаем только города России
-                            russia_cities = []
-                            for city_name, city_info in hh_areas.items():
-                                if city_info.get('root_parent_id') == '113':
-                                    russia_cities.append(city_name)
-
                             selected_add_city = st.selectbox(
                                 "Выберите город:",
-                                options=sorted(russia_cities),
+                                options=get_sorted_russian_cities_cached(hh_areas),
                                 key=f"city_selector_{vacancy}_{tab_idx}",
                                 help="Выберите город из справочника HH.ru"
                             )
@@ -2592,133 +2848,38 @@ if uploaded_files and hh_areas is not None:
                         st.markdown("---")
                         
                         # Применяем ручные изменения через КЭШИРОВАННУЮ функцию
-                        # Фильтруем только изменения для текущей вакансии
-                        vacancy_selections = {}
-                        for selection_key, new_value in st.session_state.manual_selections.items():
-                            if isinstance(selection_key, tuple):
-                                key_vacancy, row_id = selection_key
-                                if key_vacancy == vacancy:
-                                    vacancy_selections[row_id] = new_value
-                            else:
-                                # Для обратной совместимости
-                                vacancy_selections[selection_key] = new_value
-
-                        # Используем кэшированную функцию вместо цикла
-                        # FIX: Передаем vacancy в cache_key для уникальности кэша каждой вакансии
-                        vacancy_final_df = apply_manual_selections_cached(
-                            vacancy_df,
-                            vacancy_selections,
-                            hh_areas,
-                            cache_key=f"vacancy_{vacancy}"
+                        # Изменения раскладываются по вакансиям за один проход; ключи старого
+                        # формата (просто row_id) относятся ко всем вакансиям - для обратной совместимости
+                        selections_by_vacancy, common_selections = group_manual_selections(
+                            st.session_state.manual_selections
                         )
-
-                        # КРИТИЧНЫЙ FIX: Применяем изменения ко ВСЕМ дубликатам
-                        # Проблема: если в файле 2 строки "Москва", показывается только 1 в редактировании
-                        # При изменении на "Питер", только 1 строка меняется, вторая остается "Москва"
-                        # Решение: найти все строки с таким же исходным названием и применить то же изменение
-                        for row_id_changed, new_value in vacancy_selections.items():
-                            # Находим измененную строку
-                            changed_row = vacancy_final_df[vacancy_final_df['row_id'] == row_id_changed]
-                            if len(changed_row) == 0:
-                                continue
-
-                            # Получаем исходное название этой строки
-                            original_city = changed_row['Исходное название'].values[0]
-
-                            # Нормализуем для поиска дубликатов
-                            original_normalized = str(original_city).replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                            original_normalized = ' '.join(original_normalized.split())
-
-                            # Находим ВСЕ строки с таким же исходным названием
-                            vacancy_final_df['_temp_norm'] = (
-                                vacancy_final_df['Исходное название']
-                                .fillna('').astype(str)
-                                .str.replace('ё', 'е').str.replace('Ё', 'Е')
-                                .str.lower().str.strip()
-                                .str.replace(r'\s+', ' ', regex=True)
-                            )
-                            duplicate_mask = (vacancy_final_df['_temp_norm'] == original_normalized)
-                            vacancy_final_df = vacancy_final_df.drop(columns=['_temp_norm'])
-
-                            # Применяем то же изменение ко ВСЕМ дубликатам
-                            if new_value == "❌ Нет совпадения":
-                                vacancy_final_df.loc[duplicate_mask, 'Итоговое гео'] = None
-                                vacancy_final_df.loc[duplicate_mask, 'ID HH'] = None
-                                vacancy_final_df.loc[duplicate_mask, 'Регион'] = None
-                                vacancy_final_df.loc[duplicate_mask, 'Совпадение %'] = 0
-                                vacancy_final_df.loc[duplicate_mask, 'Изменение'] = 'Нет'
-                                vacancy_final_df.loc[duplicate_mask, 'Статус'] = '❌ Не найдено'
-                            else:
-                                vacancy_final_df.loc[duplicate_mask, 'Итоговое гео'] = new_value
-                                if new_value in hh_areas:
-                                    vacancy_final_df.loc[duplicate_mask, 'ID HH'] = hh_areas[new_value]['id']
-                                    vacancy_final_df.loc[duplicate_mask, 'Регион'] = hh_areas[new_value]['parent']
-                                vacancy_final_df.loc[duplicate_mask, 'Изменение'] = 'Да'
-
-                        # FIX: Исключаем не найденные (❌ Не найдено) для публикатора
-                        temp_vacancy_df = vacancy_final_df[
-                            (vacancy_final_df['Итоговое гео'].notna()) &
-                            (~vacancy_final_df['Статус'].str.contains('❌ Не найдено', na=False))
-                        ].copy()
-
-                        # КРИТИЧНО: Также исключаем ВСЕ дубликаты городов с "❌ Не найдено"
-                        excluded_cities = vacancy_final_df[
-                            vacancy_final_df['Статус'].str.contains('❌ Не найдено', na=False)
-                        ]['Исходное название'].unique()
-
-                        if len(excluded_cities) > 0:
-                            excluded_normalized = set()
-                            for city in excluded_cities:
-                                if pd.notna(city):
-                                    normalized = str(city).replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                                    normalized = ' '.join(normalized.split())
-                                    excluded_normalized.add(normalized)
-
-                            temp_vacancy_df['_temp_normalized'] = (
-                                temp_vacancy_df['Исходное название']
-                                .fillna('').astype(str)
-                                .str.replace('ё', 'е').str.replace('Ё', 'Е')
-                                .str.lower().str.strip()
-                                .str.replace(r'\s+', ' ', regex=True)
-                            )
-                            temp_vacancy_df = temp_vacancy_df[~temp_vacancy_df['_temp_normalized'].isin(excluded_normalized)].copy()
-                            temp_vacancy_df = temp_vacancy_df.drop(columns=['_temp_normalized'])
-
-                        vacancy_final_df = temp_vacancy_df
-
-                        # Формируем DataFrame для выгрузки
-                        output_vacancy_df = pd.DataFrame()
-                        output_vacancy_df[original_cols[0]] = vacancy_final_df['Итоговое гео']
-                        
-                        for col in original_cols[1:]:
-                            if col != vacancy_col and col in vacancy_final_df.columns:
-                                output_vacancy_df[col] = vacancy_final_df[col].values
-                        
-                        # Добавляем дополнительные города для этой вакансии
-                        vacancy_key = f"added_cities_{vacancy}"
-                        if vacancy_key in st.session_state and st.session_state[vacancy_key]:
-                            # Получаем последнюю строку для значений других столбцов
-                            if len(output_vacancy_df) > 0:
-                                last_row_values = output_vacancy_df.iloc[-1].tolist()
-                                
-                                for add_city in st.session_state[vacancy_key]:
-                                    new_row = [add_city] + last_row_values[1:]
-                                    output_vacancy_df.loc[len(output_vacancy_df)] = new_row
-                        
-                        # Удаляем дубликаты по городу
-                        # VECTORIZED: normalize city name
-                        output_vacancy_df['_normalized'] = (
-                            output_vacancy_df[original_cols[0]]
-                            .fillna('').astype(str)
-                            .str.replace('ё', 'е').str.replace('Ё', 'Е')
-                            .str.lower().str.strip()
-                            .str.replace(r'\s+', ' ', regex=True)
+                        vacancy_selections = {**common_selections, **selections_by_vacancy.get(vacancy, {})}
+
+                        # OPTIMIZED: итоговый файл вакансии (DataFrame + xlsx) пересобирается
+                        # только при изменении правок или добавленных городов этой вакансии
+                        vacancy_added_cities = tuple(st.session_state[vacancy_key])
+                        vacancy_signature = (
+                            st.session_state.results_key,
+                            frozenset(vacancy_selections.items()),
+                            vacancy_added_cities
                         )
-                        output_vacancy_df = output_vacancy_df.drop_duplicates(subset=['_normalized'], keep='first')
-                        output_vacancy_df = output_vacancy_df.drop(columns=['_normalized'])
 
-                        # Удаляем первую строку, если она является заголовком
-                        output_vacancy_df = remove_header_row_if_needed(output_vacancy_df, original_cols[0])
+                        # Если вакансия не изменилась с прошлого rerun - берем готовый файл из
+                        # session_state (без хэширования аргументов и распаковки копии из кэша)
+                        saved_file = st.session_state.get('vacancy_files', {}).get(vacancy)
+                        if saved_file is not None and saved_file.get('signature') == vacancy_signature:
+                            output_vacancy_df, excel_bytes = saved_file['df'], saved_file['data']
+                        else:
+                            output_vacancy_df, excel_bytes = build_vacancy_output_cached(
+                                st.session_state.results_key,
+                                vacancy,
+                                vacancy_selections,
+                                vacancy_added_cities,
+                                tuple(original_cols),
+                                vacancy_col,
+                                vacancy_df,
+                                hh_areas
+                            )
 
                         # Проверяем что есть данные для выгрузки
                         if len(output_vacancy_df) > 0:
@@ -2730,12 +2891,6 @@ if uploaded_files and hh_areas is not None:
                             st.markdown("---")
                             safe_vacancy_name = str(vacancy).replace('/', '_').replace('\\', '_')[:50]
 
-                            # Санитизация данных перед экспортом (защита от CSV Injection)
-                            output_vacancy_df = sanitize_csv_content(output_vacancy_df)
-
-                            # OPTIMIZED: Используем кэшированную генерацию файла
-                            excel_bytes = create_excel_bytes_cached(output_vacancy_df, 'Результат')
-                            
                             st.download_button(
                                 label=f"📥 Скачать файл ({len(output_vacancy_df)} уникальных городов)",
                                 data=excel_bytes,
@@ -2746,11 +2901,14 @@ if uploaded_files and hh_areas is not None:
                                 key=f"download_{vacancy}_{tab_idx}"
                             )
 
-                            # Сохраняем файл в session_state для архива (обновляется при каждом изменении селектора)
+                            # Сохраняем файл в session_state для архива (обновляется при каждом изменении селектора).
+                            # DataFrame (без санитизации) нужен только для превью на rerun без изменений вакансии
                             if 'vacancy_files' not in st.session_state:
                                 st.session_state.vacancy_files = {}
                             st.session_state.vacancy_files[vacancy] = {
                                 'data': excel_bytes,
+                                'df': output_vacancy_df,
+                                'signature': vacancy_signature,
                                 'name': f"{safe_vacancy_name}.xlsx",
                                 'count': len(output_vacancy_df)
                             }
@@ -2769,14 +2927,16 @@ if uploaded_files and hh_areas is not None:
                             total_cities = sum(f['count'] for f in st.session_state.vacancy_files.values())
                             
                             if st.button("📦 Сформировать архив", use_container_width=True, type="primary"):
-                                # Создаем ZIP-архив из сохраненных файлов
-                                zip_buffer = io.BytesIO()
-                                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                    for vacancy_name, file_info in st.session_state.vacancy_files.items():
-                                        zip_file.writestr(file_info['name'], file_info['data'])
-                                
-                                zip_buffer.seek(0)
-                                
+                                # Создаем ZIP-архив из сохраненных файлов.
+                                # ZIP_STORED: xlsx уже сжат, повторное сжатие только тратит CPU.
+                                # Сокращенные имена разных вакансий могут совпасть - делаем их уникальными
+                                saved_files = list(st.session_state.vacancy_files.values())
+                                archive_names = make_unique_filenames([f['name'] for f in saved_files])
+                                zip_buffer = create_zip_archive(
+                                    dict(zip(archive_names, (f['data'] for f in saved_files))),
+                                    compression=zipfile.ZIP_STORED
+                                )
+
                                 st.download_button(
                                     label=f"📥 Скачать архив ({len(st.session_state.vacancy_files)} вакансий, {total_cities} городов)",
                                     data=zip_buffer,
@@ -2800,45 +2960,14 @@ if uploaded_files and hh_areas is not None:
                     # Формируем файл для публикатора с исходными столбцами
                     # FIX: Исключаем только не найденные (❌ Не найдено)
                     # Дубликаты НЕ исключаем - они нужны для агрегации MIN/MAX зарплат
-                    export_df = final_result_df[
-                        (final_result_df['Итоговое гео'].notna()) &
-                        (~final_result_df['Статус'].str.contains('❌ Не найдено', na=False))
-                    ].copy()
-
                     # КРИТИЧНО: Также исключаем ВСЕ дубликаты городов с "❌ Не найдено"
-                    excluded_cities = final_result_df[
-                        final_result_df['Статус'].str.contains('❌ Не найдено', na=False)
-                    ]['Исходное название'].unique()
-
-                    if len(excluded_cities) > 0:
-                        excluded_normalized = set()
-                        for city in excluded_cities:
-                            if pd.notna(city):
-                                normalized = str(city).replace('ё', 'е').replace('Ё', 'Е').lower().strip()
-                                normalized = ' '.join(normalized.split())
-                                excluded_normalized.add(normalized)
-
-                        export_df['_temp_normalized'] = (
-                            export_df['Исходное название']
-                            .fillna('').astype(str)
-                            .str.replace('ё', 'е').str.replace('Ё', 'Е')
-                            .str.lower().str.strip()
-                            .str.replace(r'\s+', ' ', regex=True)
-                        )
-                        export_df = export_df[~export_df['_temp_normalized'].isin(excluded_normalized)].copy()
-                        export_df = export_df.drop(columns=['_temp_normalized'])
+                    export_df = select_export_rows(final_result_df, exclude_empty=False)
 
                     # Получаем названия столбцов из исходного файла
                     original_cols = st.session_state.original_df.columns.tolist()
                     
                     # Формируем итоговый DataFrame: первый столбец - итоговое гео, остальные - из исходного файла
-                    publisher_df = pd.DataFrame()
-                    publisher_df[original_cols[0]] = export_df['Итоговое гео']
-                    
-                    # Добавляем остальные столбцы из исходного файла
-                    for col in original_cols[1:]:
-                        if col in export_df.columns:
-                            publisher_df[col] = export_df[col].values
+                    publisher_df = build_export_frame(export_df, original_cols)
 
                     # Удаляем первую строку, если она является заголовком (применяется до добавления городов)
                     publisher_df = remove_header_row_if_needed(publisher_df, original_cols[0])
@@ -2848,22 +2977,17 @@ if uploaded_files and hh_areas is not None:
                         # Получаем последнюю строку из исходного файла
                         last_row_values = st.session_state.original_df.iloc[-1].tolist()
 
-                        for city in st.session_state.added_cities:
-                            new_row = [city] + last_row_values[1:]  # Город + остальные значения из последней строки
-                            publisher_df.loc[len(publisher_df)] = new_row
+                        # Город + остальные значения из последней строки; все строки добавляются одним concat
+                        added_rows = [[city] + last_row_values[1:] for city in st.session_state.added_cities]
+                        added_df = pd.DataFrame(added_rows, columns=publisher_df.columns)
+                        publisher_df = pd.concat([publisher_df, added_df], ignore_index=True)
 
                     # ============================================
                     # АГРЕГАЦИЯ ЗАРПЛАТ ДЛЯ ДУБЛЕЙ ПО ИТОГОВОМУ ГЕО
                     # ============================================
                     # Нормализуем город для корректной агрегации дублей
                     city_col = original_cols[0]
-                    publisher_df['_normalized'] = (
-                        publisher_df[city_col]
-                        .fillna('').astype(str)
-                        .str.replace('ё', 'е').str.replace('Ё', 'Е')
-                        .str.lower().str.strip()
-                        .str.replace(r'\s+', ' ', regex=True)
-                    )
+                    publisher_df['_normalized'] = normalize_city_names(publisher_df[city_col])
 
                     # Находим столбцы с "Зарплата", "ОТ"/"от" или "ДО"/"до" в названии
                     salary_cols = []
@@ -2932,16 +3056,18 @@ if uploaded_files and hh_areas is not None:
                             # ФОРМИРУЕМ ФАЙЛ ДЛЯ ПУБЛИКАТОРА С НУЖНЫМИ СТОЛБЦАМИ
                             # ============================================
                             # Создаем новый DataFrame только с нужными колонками
-                            publisher_export = pd.DataFrame()
-                            publisher_export['Город'] = publisher_df[city_col]
-                            publisher_export['Зарплата от'] = publisher_df[salary_from_col]
-                            publisher_export['Зарплата до'] = publisher_df[salary_to_col]
-                            publisher_export['На руки? (да/нет)'] = 'Нет'
+                            publisher_export = pd.DataFrame({
+                                'Город': publisher_df[city_col],
+                                'Зарплата от': publisher_df[salary_from_col],
+                                'Зарплата до': publisher_df[salary_to_col],
+                                'На руки? (да/нет)': 'Нет'
+                            })
 
                             publisher_df = publisher_export
                     else:
-                        # Если нет зарплат, просто удаляем дубликаты
-                        publisher_df = publisher_df.drop_duplicates(subset=['_normalized'], keep='first')
+                        # Если нет зарплат, просто удаляем дубликаты (сравнение 64-битных хэшей ключей)
+                        normalized_hashes = pd.util.hash_pandas_object(publisher_df['_normalized'], index=False)
+                        publisher_df = publisher_df[~normalized_hashes.duplicated(keep='first').to_numpy()]
                         publisher_df = publisher_df.drop(columns=['_normalized'])
 
                     # Санитизация данных перед экспортом (защита от CSV Injection)
@@ -2950,10 +3076,9 @@ if uploaded_files and hh_areas is not None:
                     # Проверяем, есть ли данные для экспорта
                     if len(publisher_df) > 0:
                         output_publisher = io.BytesIO()
-                        with pd.ExcelWriter(output_publisher, engine='openpyxl') as writer:
-                            # Экспортируем с заголовками только если есть зарплатные столбцы
-                            # Для простого сценария (только города) - БЕЗ заголовков
-                            publisher_df.to_excel(writer, index=False, header=has_salary_columns, sheet_name='Результат')
+                        # Экспортируем с заголовками только если есть зарплатные столбцы
+                        # Для простого сценария (только города) - БЕЗ заголовков
+                        write_excel_rows(output_publisher, publisher_df, 'Результат', include_header=has_salary_columns)
                         output_publisher.seek(0)
 
                         publisher_count = len(publisher_df)
@@ -2977,9 +3102,8 @@ if uploaded_files and hh_areas is not None:
                     export_full_df = sanitize_csv_content(export_full_df)
 
                     output = io.BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        export_full_df.to_excel(writer, index=False, sheet_name='Результат')  
-                    output.seek(0)  
+                    write_excel_rows(output, export_full_df, 'Результат')
+                    output.seek(0)
                       
                     st.download_button(
                         label="📥 Полный отчет с анализом",
@@ -3009,6 +3133,12 @@ else:
             del st.session_state.vacancy_files
         if 'sheets_results' in st.session_state:
             del st.session_state.sheets_results
+        if 'result_df_sorted_cache' in st.session_state:
+            del st.session_state.result_df_sorted_cache
+        if 'results_key' in st.session_state:
+            del st.session_state.results_key
+        if 'vacancy_col' in st.session_state:
+            del st.session_state.vacancy_col
         # Очищаем кэши пагинации
         keys_to_delete = [k for k in st.session_state.keys() if k.startswith('edit_page')]
         for key in keys_to_delete:
@@ -3019,41 +3149,30 @@ else:
 # ============================================
 st.markdown('<div id="выбор-регионов-и-городов"></div>', unsafe_allow_html=True)
 
-# CSS для ЧЕРНОЙ окантовки multiselect (базовый цвет как у selectbox)
-st.markdown("""
-<style>
-/* Черная окантовка для multiselect */
-[data-testid="stMultiSelect"] div[data-baseweb="select"] > div {
-    border-color: #1a1a1a !important;
-}
-[data-testid="stMultiSelect"] div[data-baseweb="select"] > div:hover {
-    border-color: #1a1a1a !important;
-}
-[data-testid="stMultiSelect"] div[data-baseweb="select"] > div:focus-within {
-    border-color: #1a1a1a !important;
-    box-shadow: 0 0 0 0.2rem rgba(26, 26, 26, 0.25) !important;
-}
-</style>
-""", unsafe_allow_html=True)
-
 st.header("🗺️ Выбор регионов и городов")
 
-if hh_areas is not None:
+
+@st.fragment
+def render_regions_block(hh_areas: Dict) -> None:
+    """
+    Блок выбора регионов и городов: фильтры, кнопки выборки, превью и выгрузки.
+
+    ОПТИМИЗАЦИЯ: st.fragment - изменение фильтра или нажатие кнопки перезапускает
+    только этот блок, а не весь скрипт (стили, справочник, остальные инструменты).
+
+    Args:
+        hh_areas: Справочник регионов HH.ru
+    """
     # Получаем полный список городов для фильтров
-    all_cities_full = get_all_cities(hh_areas)
+    all_cities_full = get_all_cities_cached(hh_areas)
 
     # ФИЛЬТРЫ В ОДНОМ БЛОКЕ
     st.markdown("### 🔍 Фильтры")
     col_filter1, col_filter2, col_filter3, col_filter4 = st.columns(4)
 
     with col_filter1:
-        # Форматируем федеральные округа с количеством регионов
-        districts_formatted = []
-        districts_mapping = {}
-        for district, regions in FEDERAL_DISTRICTS.items():
-            formatted = f"{district} ({len(regions)} рег.)"
-            districts_formatted.append(formatted)
-            districts_mapping[formatted] = district
+        # Подписи округов с количеством регионов (кэшируются на процесс)
+        districts_formatted, districts_mapping = get_district_options_cached()
 
         selected_districts_formatted = st.multiselect(
             "Федеральные округа:",
@@ -3065,30 +3184,9 @@ if hh_areas is not None:
         # Получаем оригинальные названия округов
         selected_districts = [districts_mapping[d] for d in selected_districts_formatted]
 
-    # Формируем список доступных регионов на основе выбранных округов
-    available_regions = []
-    if selected_districts:
-        for district in selected_districts:
-            available_regions.extend(FEDERAL_DISTRICTS[district])
-    else:
-        for regions in FEDERAL_DISTRICTS.values():
-            available_regions.extend(regions)
-
     with col_filter2:
-        # Форматируем регионы с указанием федерального округа
-        regions_formatted = []
-        regions_mapping = {}
-        for region in sorted(available_regions):
-            # Находим федеральный округ для региона
-            fed_district = get_federal_district_by_region(region)
-            if fed_district != "Не определен":
-                # Сокращаем название округа для компактности
-                district_short = fed_district.replace("Федеральный округ", "ФО").replace("федеральный округ", "ФО")
-                formatted = f"{region} ({district_short})"
-            else:
-                formatted = region
-            regions_formatted.append(formatted)
-            regions_mapping[formatted] = region
+        # Регионы выбранных округов с указанием федерального округа (кэшируются по набору округов)
+        regions_formatted, regions_mapping = get_region_options_cached(tuple(sorted(selected_districts)))
 
         selected_regions_formatted = st.multiselect(
             "Области/Регионы:",
@@ -3103,34 +3201,10 @@ if hh_areas is not None:
     with col_filter3:
         # Фильтр по часовому поясу (мультиселект)
         if not all_cities_full.empty:
-            unique_timezones = sorted([tz for tz in all_cities_full['UTC'].unique() if tz and str(tz) != 'nan'])
-
-            # Создаем форматированные опции с разницей от МСК
-            timezone_options_formatted = []
-            timezone_mapping = {}  # Маппинг отформатированных значений на оригинальные UTC
-
-            for tz in unique_timezones:
-                try:
-                    # Парсим UTC offset для вычисления разницы с Москвой
-                    sign = 1 if tz[0] == '+' else -1
-                    hours = int(tz[1:3])
-                    tz_hours = sign * hours
-                    diff_msk = tz_hours - 3  # Москва = UTC+3
-
-                    if diff_msk == 0:
-                        formatted = f"{tz} (МСК)"
-                    elif diff_msk > 0:
-                        formatted = f"{tz} (+{diff_msk}ч от МСК)"
-                    else:
-                        formatted = f"{tz} ({diff_msk}ч от МСК)"
-
-                    timezone_options_formatted.append(formatted)
-                    timezone_mapping[formatted] = tz
-                except (ValueError, IndexError, TypeError) as e:
-                    # Если не удалось распарсить, добавляем как есть
-                    logger.warning(f"Не удалось распарсить timezone '{tz}': {e}")
-                    timezone_options_formatted.append(tz)
-                    timezone_mapping[tz] = tz
+            # Подписи с разницей от МСК (категории UTC - все значения столбца без пустых)
+            timezone_options_formatted, timezone_mapping = get_timezone_options_cached(
+                tuple(all_cities_full['UTC'].cat.categories)
+            )
 
             selected_timezones_formatted = st.multiselect(
                 "Часовой пояс (UTC):",
@@ -3147,7 +3221,7 @@ if hh_areas is not None:
     with col_filter4:
         # Выбор городов (множественный выбор)
         if not all_cities_full.empty:
-            city_options = sorted(all_cities_full['Город'].unique())
+            city_options = get_city_options_cached(hh_areas)
             selected_cities = st.multiselect(
                 "Выбрать город:",
                 options=city_options,
@@ -3188,27 +3262,57 @@ if hh_areas is not None:
     if selected_regions:
         regions_to_search = selected_regions
     elif selected_districts:
-        for district in selected_districts:
-            regions_to_search.extend(FEDERAL_DISTRICTS[district])
+        regions_to_search = list(chain.from_iterable(FEDERAL_DISTRICTS[district] for district in selected_districts))
 
     # Очищаем превью если все фильтры сняты
     if not regions_to_search and not selected_cities and not selected_timezones and not selected_population_ranges:
-        if 'regions_cities_df' in st.session_state:
-            del st.session_state.regions_cities_df
+        st.session_state.pop('regions_cities_df', None)
+        st.session_state.pop('regions_cities_preview_df', None)
+
+    def reset_previous_results():
+        """Удаляет результаты прежних выборок перед новой выборкой по кнопке"""
+        for key in ('city_df', 'timezones_df'):
+            st.session_state.pop(key, None)
+
+    def save_regions_result(df):
+        """
+        Сохраняет результат выборки и таблицу превью (по убыванию населения)
+
+        ОПТИМИЗАЦИЯ: превью сортируется один раз при нажатии кнопки,
+        а не копируется и сортируется заново при каждом rerun.
+        """
+        st.session_state.regions_cities_df = df
+        preview_df = df
+        if 'Население' in preview_df.columns:
+            preview_df = preview_df.sort_values('Население', ascending=False)
+        st.session_state.regions_cities_preview_df = preview_df.reset_index(drop=True)
+
+    # Маска и фильтр по населению
+    def population_mask(df, selected_ranges, ranges_dict):
+        """Маска строк DataFrame, попадающих в выбранные диапазоны населения (все строки без фильтра)"""
+        if not selected_ranges or df.empty or 'Население' not in df.columns:
+            return np.ones(len(df), dtype=bool)
+
+        # ОПТИМИЗАЦИЯ: диапазоны идут подряд без пропусков, поэтому номер диапазона
+        # для всех строк находится одним np.searchsorted по границам,
+        # а не отдельной маской на каждый выбранный диапазон
+        range_names = list(ranges_dict)
+        bin_edges = np.array(
+            [ranges_dict[name][0] for name in range_names] + [ranges_dict[range_names[-1]][1]],
+            dtype=float
+        )
+        # Население ниже первой границы (-1), не меньше последней или NaN (len(range_names))
+        # не попадает ни в один диапазон
+        bin_idx = np.searchsorted(bin_edges, df['Население'].to_numpy(dtype=float), side='right') - 1
+        selected_idx = [range_names.index(range_name) for range_name in selected_ranges]
+
+        return np.isin(bin_idx, selected_idx)
 
-    # Функция для фильтрации по населению
     def filter_by_population(df, selected_ranges, ranges_dict):
         """Фильтрует DataFrame по выбранным диапазонам населения"""
         if not selected_ranges or df.empty or 'Население' not in df.columns:
             return df
-
-        # Создаем маску для фильтрации
-        mask = pd.Series([False] * len(df), index=df.index)
-        for range_name in selected_ranges:
-            min_pop, max_pop = ranges_dict[range_name]
-            mask |= (df['Население'] >= min_pop) & (df['Население'] < max_pop)
-
-        return df[mask]
+        return df[population_mask(df, selected_ranges, ranges_dict)]
 
     # КНОПКИ ДЕЙСТВИЙ
     col_btn1, col_btn2, col_btn3 = st.columns(3)
@@ -3225,16 +3329,13 @@ if hh_areas is not None:
             if st.button("🔍 Получить список городов по регионам", type="primary", use_container_width=True):
                 with st.spinner("Формирую список городов..."):
                     # Очищаем старые результаты
-                    if 'city_df' in st.session_state:
-                        del st.session_state.city_df
-                    if 'timezones_df' in st.session_state:
-                        del st.session_state.timezones_df
+                    reset_previous_results()
                     # Получаем список городов по регионам
                     result_df = get_cities_by_regions(hh_areas, regions_to_search)
                     # Применяем фильтр по населению
                     result_df = filter_by_population(result_df, selected_population_ranges, population_ranges)
                     # Сохраняем новый результат
-                    st.session_state.regions_cities_df = result_df
+                    save_regions_result(result_df)
 
     with col_btn2:
         # Кнопка для выбранных городов
@@ -3248,17 +3349,15 @@ if hh_areas is not None:
             if st.button(f"🔍 Получить информацию о {'городе' if len(selected_cities) == 1 else 'городах'}", type="primary", use_container_width=True):
                 with st.spinner(f"Получаю информацию о {len(selected_cities)} {'городе' if len(selected_cities) == 1 else 'городах'}..."):
                     # Очищаем старые результаты
-                    if 'city_df' in st.session_state:
-                        del st.session_state.city_df
-                    if 'timezones_df' in st.session_state:
-                        del st.session_state.timezones_df
-                    # Фильтруем данные по выбранным городам
-                    city_df = all_cities_full[all_cities_full['Город'].isin(selected_cities)].copy()
-                    # Применяем фильтр по населению
-                    city_df = filter_by_population(city_df, selected_population_ranges, population_ranges)
+                    reset_previous_results()
+                    # Выбранные города с учетом фильтра по населению - одной маской по таблице городов
+                    city_df = all_cities_full[
+                        category_isin(all_cities_full['Город'], selected_cities) &
+                        population_mask(all_cities_full, selected_population_ranges, population_ranges)
+                    ]
                     # Сохраняем в общий результат
                     if not city_df.empty:
-                        st.session_state.regions_cities_df = city_df
+                        save_regions_result(city_df)
         # Кнопка для фильтра по населению (если выбрано только население)
         elif selected_population_ranges and not regions_to_search and not selected_timezones:
             # Информация о выборе
@@ -3270,16 +3369,13 @@ if hh_areas is not None:
             if st.button("🔍 Получить список городов по населению", type="primary", use_container_width=True):
                 with st.spinner("Фильтрую по населению..."):
                     # Очищаем старые результаты
-                    if 'city_df' in st.session_state:
-                        del st.session_state.city_df
-                    if 'timezones_df' in st.session_state:
-                        del st.session_state.timezones_df
-                    # Берем все города и фильтруем по населению
-                    result_df = all_cities_full.copy()
-                    result_df = filter_by_population(result_df, selected_population_ranges, population_ranges)
+                    reset_previous_results()
+                    # Берем все города и фильтруем по населению (без копии: фильтр создает новый DataFrame,
+                    # а таблица get_all_cities_cached только читается)
+                    result_df = filter_by_population(all_cities_full, selected_population_ranges, population_ranges)
                     # Сохраняем результат
                     if not result_df.empty:
-                        st.session_state.regions_cities_df = result_df
+                        save_regions_result(result_df)
 
     with col_btn3:
         # Кнопка для выгрузки по часовым поясам
@@ -3299,17 +3395,15 @@ if hh_areas is not None:
             if st.button(button_text, type="primary", use_container_width=True):
                 with st.spinner(f"Фильтрую по выбранным часовым поясам..."):
                     # Очищаем старые результаты
-                    if 'city_df' in st.session_state:
-                        del st.session_state.city_df
-                    if 'timezones_df' in st.session_state:
-                        del st.session_state.timezones_df
-                    # Фильтруем города по выбранным часовым поясам
-                    filtered_df = all_cities_full[all_cities_full['UTC'].isin(selected_timezones)].copy()
-                    # Применяем фильтр по населению
-                    filtered_df = filter_by_population(filtered_df, selected_population_ranges, population_ranges)
+                    reset_previous_results()
+                    # Города выбранных часовых поясов с учетом фильтра по населению - одной маской
+                    filtered_df = all_cities_full[
+                        category_isin(all_cities_full['UTC'], selected_timezones) &
+                        population_mask(all_cities_full, selected_population_ranges, population_ranges)
+                    ]
                     # Сохраняем в общий результат
                     if not filtered_df.empty:
-                        st.session_state.regions_cities_df = filtered_df
+                        save_regions_result(filtered_df)
 
     # ОТОБРАЖЕНИЕ РЕЗУЛЬТАТОВ (ТАБЛИЦА ПРЕВЬЮ НА ПОЛНУЮ ШИРИНУ)
     # Единый блок для отображения результатов всех фильтров
@@ -3326,30 +3420,22 @@ if hh_areas is not None:
             st.success(f"✅ Найдено **{city_count}** городов")
 
         # Показываем таблицу на полную ширину
-        # Сортируем по населению по убыванию
-        display_cities_df = cities_df.copy()
-        if 'Население' in display_cities_df.columns:
-            display_cities_df = display_cities_df.sort_values('Население', ascending=False)
-        display_cities_df = display_cities_df.reset_index(drop=True)
+        # Отсортирована по населению по убыванию при сохранении результата (save_regions_result)
+        display_cities_df = st.session_state.regions_cities_preview_df
 
-        st.dataframe(display_cities_df, use_container_width=True, height=400, hide_index=True)
+        st.dataframe(display_cities_df.head(CITY_PREVIEW_ROWS), use_container_width=True, height=400, hide_index=True)
+        if city_count > CITY_PREVIEW_ROWS:
+            st.caption(f"Показаны первые {CITY_PREVIEW_ROWS} из {city_count} городов (по убыванию населения), полный список - в файлах выгрузки")
 
         # Кнопки для скачивания
         col1, col2 = st.columns(2)
+        publisher_bytes, full_bytes = create_city_reports_cached(cities_df)
 
         with col1:
             # Полный отчет
-            # Санитизация данных перед экспортом (защита от CSV Injection)
-            sanitized_cities_df = sanitize_csv_content(cities_df)
-
-            output_full = io.BytesIO()
-            with pd.ExcelWriter(output_full, engine='openpyxl') as writer:
-                sanitized_cities_df.to_excel(writer, index=False, sheet_name='Города')
-            output_full.seek(0)
-
             st.download_button(
                 label=f"📥 Скачать полный отчет ({city_count} городов)" if city_count > 1 else f"📥 Скачать полный отчет ({city_count} город)",
-                data=output_full,
+                data=full_bytes,
                 file_name="cities_full_report.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True,
@@ -3358,25 +3444,19 @@ if hh_areas is not None:
 
         with col2:
             # Только названия городов для публикатора
-            publisher_df = pd.DataFrame({'Город': cities_df['Город']})
-
-            # Санитизация данных перед экспортом (защита от CSV Injection)
-            publisher_df = sanitize_csv_content(publisher_df)
-
-            output_publisher = io.BytesIO()
-            with pd.ExcelWriter(output_publisher, engine='openpyxl') as writer:
-                publisher_df.to_excel(writer, index=False, header=False, sheet_name='Гео')
-            output_publisher.seek(0)
-
             st.download_button(
                 label=f"📤 Для публикатора ({city_count} городов)" if city_count > 1 else f"📤 Для публикатора ({city_count} город)",
-                data=output_publisher,
+                data=publisher_bytes,
                 file_name="cities_for_publisher.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True,
                 key="download_regions_publisher"
             )
 
+
+if hh_areas is not None:
+    render_regions_block(hh_areas)
+
 # ============================================
 # БЛОК: ОБЪЕДИНИТЕЛЬ ФАЙЛОВ
 # ============================================
@@ -3427,7 +3507,7 @@ if merger_uploaded_files:
                 if uploaded_file.name.endswith('.csv'):
                     df = pd.read_csv(uploaded_file)
                 else:
-                    df = pd.read_excel(uploaded_file)
+                    df = pd.read_excel(uploaded_file, engine=EXCEL_READ_ENGINE)
                 all_dataframes.append(df)
                 st.success(f"✅ Загружен: {uploaded_file.name} ({len(df)} строк)")
 
@@ -3506,23 +3586,6 @@ st.markdown("---")
 # =====================================================
 st.markdown('<div id="сверки-с-клиентами"></div>', unsafe_allow_html=True)
 
-# CSS для селекторов в разделе Сверки с клиентами
-st.markdown("""
-<style>
-/* Красная окантовка для selectbox и multiselect ТОЛЬКО в разделе Сверки */
-.matrix-code-section [data-testid="stSelectbox"] div[data-baseweb="select"] > div {
-    border-color: #e14531 !important;
-}
-.matrix-code-section [data-testid="stSelectbox"] div[data-baseweb="select"] > div:hover {
-    border-color: #e14531 !important;
-}
-.matrix-code-section [data-testid="stSelectbox"] div[data-baseweb="select"] > div:focus-within {
-    border-color: #e14531 !important;
-    box-shadow: 0 0 0 0.2rem rgba(225, 69, 49, 0.25) !important;
-}
-</style>
-""", unsafe_allow_html=True)
-
 st.header("🔄 Сверки с клиентами")
 
 st.markdown("""
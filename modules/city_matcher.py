@@ -10,25 +10,44 @@
 from typing import Dict, List, Tuple, Optional
 import pandas as pd
 import streamlit as st
-from rapidfuzz import fuzz, process
+from rapidfuzz import fuzz
 
 # Импорты из других модулей
 from modules.matching import (
     normalize_city_name,
     extract_city_and_region,
     get_candidates_by_word,
+    build_name_ngram_index,
     PREFERRED_MATCHES,
     EXCLUDED_EXACT_MATCHES
 )
-from modules.data_processing import normalize_region_name
-from modules.utils import get_russian_cities, check_if_changed
+from modules.utils import get_russian_cities, get_russian_city_index, check_if_changed
+
+
+# Все значения столбца "Статус" (категории для pd.Categorical в результате match_cities).
+# Ручное редактирование записывает только эти значения, поэтому набор категорий фиксирован
+MATCH_STATUSES = [
+    '✅ Точное',
+    '⚠️ Похожее',
+    '❌ Не найдено',
+    '❌ Пустое значение',
+    '🔄 Дубликат (исходное название)',
+    '🔄 Дубликат (результат HH)',
+    '✅ Добавлено',
+]
+
+# Значения столбца "Изменение" (категории для pd.Categorical в результате match_cities)
+CHANGE_VALUES = ['Да', 'Нет']
 
 
 def smart_match_city(
     client_city: str,
     hh_city_names: List[str],
     hh_areas: Dict,
-    threshold: int = 85
+    threshold: int = 85,
+    hh_norm_to_name: Optional[Dict[str, str]] = None,
+    hh_city_names_norm: Optional[List[str]] = None,
+    hh_name_ngrams: Optional[Dict[str, List[int]]] = None
 ) -> Tuple[Optional[Tuple[str, float, int]], List[Tuple[str, int]]]:
     """
     Умное сопоставление города с сохранением кандидатов и учетом предпочтительных совпадений
@@ -36,21 +55,24 @@ def smart_match_city(
     Функция выполняет многоступенчатое сопоставление:
     1. Проверяет исключения (EXCLUDED_EXACT_MATCHES)
     2. Проверяет предпочтительные совпадения (PREFERRED_MATCHES)
-    3. Использует сопоставление по начальному слову (get_candidates_by_word)
-    4. Выполняет точное сопоставление с учетом региона
-    5. Использует fuzzy matching с RapidFuzz
-    6. Применяет adjustments к score на основе различных критериев
+    3. Ищет точное совпадение нормализованного названия (если передан hh_norm_to_name)
+    4. Использует сопоставление по начальному слову (get_candidates_by_word):
+       лучший кандидат принимается, если его score не ниже threshold, иначе совпадения нет
 
     Args:
         client_city: Название города клиента для сопоставления
         hh_city_names: Список названий городов из справочника HH.ru
         hh_areas: Справочник регионов HH.ru
         threshold: Порог совпадения (0-100), по умолчанию 85
+        hh_norm_to_name: Словарь {нормализованное название: название HH}, опционально
+        hh_city_names_norm: Нормализованные hh_city_names (в том же порядке), опционально
+        hh_name_ngrams: Индекс триграмм hh_city_names_norm (build_name_ngram_index), опционально
 
     Returns:
         Tuple[Optional[Tuple[str, float, int]], List[Tuple[str, int]]]:
             - Лучшее совпадение: (название, score, index) или None
             - Список кандидатов: [(название, score), ...]
+              (пустой для PREFERRED_MATCHES и точных совпадений — кандидаты считаются по требованию)
 
     Examples:
         >>> areas = get_hh_areas()
@@ -68,129 +90,49 @@ def smart_match_city(
 
     # Проверяем исключения - города, которые НЕ должны совпадать
     if city_part_lower in EXCLUDED_EXACT_MATCHES:
-        word_candidates = get_candidates_by_word(city_part, hh_city_names)
+        word_candidates = get_candidates_by_word(
+            city_part, hh_city_names, hh_city_names_norm=hh_city_names_norm,
+            hh_name_ngrams=hh_name_ngrams
+        )
         return None, word_candidates
 
     # Проверяем предпочтительные совпадения
-    if city_part_lower in PREFERRED_MATCHES:
-        preferred_match = PREFERRED_MATCHES[city_part_lower]
-        if preferred_match in hh_city_names:
-            score = fuzz.WRatio(city_part_lower, normalize_city_name(preferred_match))
-            word_candidates = get_candidates_by_word(city_part, hh_city_names)
-            return (preferred_match, score, 0), word_candidates
-
-    word_candidates = get_candidates_by_word(city_part, hh_city_names)
+    # Кандидатов по слову не считаем: при ручном выборе UI получает их по требованию
+    preferred_match = PREFERRED_MATCHES.get(city_part_lower)
+    if preferred_match is not None and preferred_match in hh_city_names:
+        score = fuzz.WRatio(city_part_lower, normalize_city_name(preferred_match))
+        return (preferred_match, score, 0), []
+
+    # Точное совпадение нормализованного названия: score 100 без fuzzy-поиска
+    if hh_norm_to_name is not None:
+        exact_name = hh_norm_to_name.get(city_part_lower)
+        if exact_name is not None:
+            return (exact_name, 100.0, 0), []
+
+    # threshold НЕ передается в RapidFuzz как score_cutoff: кандидаты ниже порога
+    # нужны для ручного выбора в UI. Порог применяется только к лучшему кандидату ниже
+    word_candidates = get_candidates_by_word(
+        city_part, hh_city_names, hh_city_names_norm=hh_city_names_norm,
+        hh_name_ngrams=hh_name_ngrams
+    )
 
     if word_candidates and len(word_candidates) > 0 and word_candidates[0][1] >= threshold:
         best_candidate = word_candidates[0]
         return (best_candidate[0], best_candidate[1], 0), word_candidates
 
-    if not word_candidates or (word_candidates and word_candidates[0][1] < threshold):
-        return None, word_candidates
-
-    exact_matches = []
-    exact_matches_with_region = []
-
-    for hh_city_name in hh_city_names:
-        hh_city_base = normalize_city_name(hh_city_name.split('(')[0].strip())
-
-        if city_part_lower == hh_city_base:
-            if region_part:
-                region_normalized = normalize_region_name(region_part)
-                hh_normalized = normalize_region_name(hh_city_name)
-
-                if region_normalized in hh_normalized:
-                    exact_matches_with_region.append(hh_city_name)
-                else:
-                    exact_matches.append(hh_city_name)
-            else:
-                exact_matches.append(hh_city_name)
-
-    if exact_matches_with_region:
-        best_match = exact_matches_with_region[0]
-        score = fuzz.WRatio(city_part_lower, normalize_city_name(best_match))
-        return (best_match, score, 0), word_candidates
-    elif exact_matches:
-        best_match = exact_matches[0]
-        score = fuzz.WRatio(city_part_lower, normalize_city_name(best_match))
-        return (best_match, score, 0), word_candidates
-
-    candidates = process.extract(
-        city_part,
-        hh_city_names,
-        scorer=fuzz.WRatio,
-        limit=10
-    )
-
-    if not candidates:
-        return None, word_candidates
-
-    candidates = [c for c in candidates if c[1] >= threshold]
-
-    if not candidates:
-        return None, word_candidates
-
-    if len(candidates) == 1:
-        return candidates[0], word_candidates
-
-    best_match = None
-    best_score = 0
-
-    for candidate_name, score, _ in candidates:
-        candidate_lower = normalize_city_name(candidate_name)
-        adjusted_score = score
-
-        candidate_city = normalize_city_name(candidate_name.split('(')[0].strip())
-
-        if city_part_lower == candidate_city:
-            adjusted_score += 50
-        elif city_part_lower in candidate_city:
-            adjusted_score += 30
-        elif candidate_city in city_part_lower:
-            adjusted_score += 20
-        else:
-            adjusted_score -= 30
-
-        if region_part:
-            region_normalized = normalize_region_name(region_part)
-            candidate_normalized = normalize_region_name(candidate_name)
-
-            if region_normalized in candidate_normalized:
-                adjusted_score += 40
-            elif '(' in candidate_name:
-                adjusted_score -= 25
-
-        len_diff = abs(len(candidate_city) - len(city_part_lower))
-        if len_diff > 3:
-            adjusted_score -= 20
-
-        if len(candidate_city) > len(city_part_lower) + 4:
-            adjusted_score -= 25
-
-        if len(candidate_name) > 15 and len(city_part) > 15:
-            adjusted_score += 5
-
-        region_keywords = ['oblast', 'край', 'республик', 'округ']
-        client_has_region = any(keyword in city_part_lower for keyword in region_keywords)
-        candidate_has_region = any(keyword in candidate_lower for keyword in region_keywords)
-
-        if client_has_region and candidate_has_region:
-            adjusted_score += 15
-        elif client_has_region and not candidate_has_region:
-            adjusted_score -= 15
-
-        if adjusted_score > best_score:
-            best_score = adjusted_score
-            best_match = (candidate_name, score, _)
-
-    return (best_match if best_match else candidates[0]), word_candidates
+    return None, word_candidates
 
 
 def match_cities(
     original_df: pd.DataFrame,
     hh_areas: Dict,
     threshold: int = 85,
-    sheet_name: Optional[str] = None
+    sheet_name: Optional[str] = None,
+    match_cache: Optional[Dict] = None,
+    city_index: Optional[Tuple[List[str], List[str]]] = None,
+    name_ngrams: Optional[Dict[str, List[int]]] = None,
+    candidates_cache: Optional[Dict] = None,
+    show_progress: bool = True
 ) -> Tuple[pd.DataFrame, int, int, int]:
     """
     Сопоставляет города с сохранением кандидатов и всех столбцов
@@ -204,6 +146,18 @@ def match_cities(
         hh_areas: Справочник регионов HH.ru
         threshold: Порог совпадения (0-100), по умолчанию 85
         sheet_name: Название листа (для кэширования кандидатов), опционально
+        match_cache: Общий кэш {нормализованное название: результат smart_match_city}
+                     для нескольких вызовов (например, для всех вкладок файла), опционально.
+                     Должен использоваться с одинаковыми hh_areas и threshold
+        city_index: Готовый результат get_russian_city_index(hh_areas), опционально.
+                    Если не передан - строится заново
+        name_ngrams: Индекс триграмм для city_index (build_name_ngram_index), опционально.
+                     Если не передан - строится заново
+        candidates_cache: Словарь, в который записываются кандидаты по ключу
+                          (sheet_name, row_id) или row_id, опционально.
+                          Если не передан - st.session_state.candidates_cache
+        show_progress: Показывать ли прогресс-бар (False - для вызова из st.cache_data,
+                       где элементы интерфейса воспроизводились бы при каждом попадании в кэш)
 
     Returns:
         Tuple[pd.DataFrame, int, int, int]:
@@ -229,12 +183,12 @@ def match_cities(
         >>> result_df, dup_orig, dup_hh, total_dup = match_cities(df, areas)
         >>> print(f"Обработано {len(result_df)} городов, дубликатов: {total_dup}")
     """
-    results = []
-    # Используем только российские города
-    hh_city_names = get_russian_cities(hh_areas)
+    # Используем только российские города (и их нормализованные названия)
+    if city_index is None:
+        city_index = get_russian_city_index(hh_areas)
+    hh_city_names, hh_city_names_norm = city_index
 
     # Определяем названия столбцов
-    first_col_name = original_df.columns[0]
     other_cols = original_df.columns[1:].tolist() if len(original_df.columns) > 1 else []
 
     seen_original_cities = {}
@@ -244,132 +198,171 @@ def match_cities(
     duplicate_hh_count = 0
 
     # Не перезаписываем кэш, чтобы сохранить данные для всех вкладок
+    if candidates_cache is None:
+        candidates_cache = st.session_state.candidates_cache
+
+    if show_progress:
+        # Красный прогресс-бар через CSS
+        st.markdown("""
+            <style>
+            .stProgress > div > div > div > div {
+                background-color: #ff4b4b;
+            }
+            </style>
+        """, unsafe_allow_html=True)
+
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+
+    # Сопоставляем каждое уникальное (нормализованное) название только один раз.
+    # Для сопоставления берется первое встреченное написание города.
+    # Локальные ссылки для горячих циклов ниже: LOAD_FAST вместо LOAD_GLOBAL/LOAD_ATTR
+    isna = pd.isna
+    normalize = normalize_city_name
+
+    unique_originals = {}
+    remember_original = unique_originals.setdefault
+    for client_city in original_df.iloc[:, 0]:
+        if isna(client_city) or str(client_city).strip() == "":
+            continue
+        client_city_original = str(client_city).strip()
+        remember_original(normalize(client_city_original), client_city_original)
+
+    # Индекс {нормализованное название: название HH} для точных совпадений.
+    # При совпадении нормализованных названий берется первое (как при сортировке кандидатов)
+    hh_norm_to_name = {}
+    remember_hh_name = hh_norm_to_name.setdefault
+    for hh_city_name, hh_city_norm in zip(hh_city_names, hh_city_names_norm):
+        remember_hh_name(hh_city_norm, hh_city_name)
+
+    # Индекс триграмм: поиск кандидатов по слову без перебора всего справочника
+    if name_ngrams is None:
+        name_ngrams = build_name_ngram_index(hh_city_names_norm)
+
+    if match_cache is None:
+        match_cache = {}
+    total_unique = len(unique_originals)
+    # Обновляем прогресс не чаще ~200 раз: каждый вызов - сообщение по websocket
+    progress_step = max(1, total_unique // 200)
+    for unique_idx, (client_city_normalized, client_city_original) in enumerate(unique_originals.items()):
+        if show_progress and (unique_idx % progress_step == 0 or unique_idx == total_unique - 1):
+            progress_bar.progress((unique_idx + 1) / total_unique)
+            status_text.text(f"Обработано {unique_idx + 1} из {total_unique} уникальных городов...")
+
+        # Город уже сопоставлен в другой вкладке
+        if client_city_normalized in match_cache:
+            continue
 
-    # Красный прогресс-бар через CSS
-    st.markdown("""
-        <style>
-        .stProgress > div > div > div > div {
-            background-color: #ff4b4b;
-        }
-        </style>
-    """, unsafe_allow_html=True)
-
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    for idx, row in original_df.iterrows():
-        progress = (idx + 1) / len(original_df)
-        progress_bar.progress(progress)
-        status_text.text(f"Обработано {idx + 1} из {len(original_df)} городов...")
-
-        client_city = row[first_col_name]
-
-        # Сохраняем значения остальных столбцов
-        other_values = {col: row[col] for col in other_cols}
-
-        if pd.isna(client_city) or str(client_city).strip() == "":
-            results.append({
-                'Исходное название': client_city,
-                'Итоговое гео': None,
-                'ID HH': None,
-                'Регион': None,
-                'Совпадение %': 0,
-                'Изменение': 'Нет',
-                'Статус': '❌ Пустое значение',
-                'row_id': idx,
-                **other_values  # Добавляем остальные столбцы
-            })
+        match_cache[client_city_normalized] = smart_match_city(
+            client_city_original, hh_city_names, hh_areas, threshold,
+            hh_norm_to_name, hh_city_names_norm, name_ngrams
+        )
+
+    # Результаты накапливаются по столбцам (а не по строкам-словарям):
+    # DataFrame собирается один раз в конце без разбора N словарей
+    out_orig = []
+    out_geo = []
+    out_id = []
+    out_region = []
+    out_score = []
+    out_change = []
+    out_status = []
+    out_rowid = []
+
+    for idx, client_city in zip(original_df.index, original_df.iloc[:, 0]):
+        out_rowid.append(idx)
+
+        if isna(client_city) or str(client_city).strip() == "":
+            out_orig.append(client_city)
+            out_geo.append(None)
+            out_id.append(None)
+            out_region.append(None)
+            out_score.append(0)
+            out_change.append('Нет')
+            out_status.append('❌ Пустое значение')
             continue
 
         client_city_original = str(client_city).strip()
-        client_city_normalized = normalize_city_name(client_city_original)
+        client_city_normalized = normalize(client_city_original)
+        out_orig.append(client_city_original)
 
         if client_city_normalized in seen_original_cities:
             duplicate_original_count += 1
-            original_result = seen_original_cities[client_city_normalized]
-            results.append({
-                'Исходное название': client_city_original,
-                'Итоговое гео': original_result['Итоговое гео'],
-                'ID HH': original_result['ID HH'],
-                'Регион': original_result['Регион'],
-                'Совпадение %': original_result['Совпадение %'],
-                'Изменение': original_result['Изменение'],
-                'Статус': '🔄 Дубликат (исходное название)',
-                'row_id': idx,
-                **other_values
-            })
+            geo, hh_id, region, score_value, change_status = seen_original_cities[client_city_normalized]
+            out_geo.append(geo)
+            out_id.append(hh_id)
+            out_region.append(region)
+            out_score.append(score_value)
+            out_change.append(change_status)
+            out_status.append('🔄 Дубликат (исходное название)')
             continue
 
-        match_result, candidates = smart_match_city(client_city_original, hh_city_names, hh_areas, threshold)
+        match_result, candidates = match_cache[client_city_normalized]
 
         # Используем составной ключ для вкладок, простой для базового режима
         cache_key = (sheet_name, idx) if sheet_name else idx
-        st.session_state.candidates_cache[cache_key] = candidates
+        # tuple: редакторы передают кандидатов в prepare_city_options без копирования
+        candidates_cache[cache_key] = tuple(candidates)
 
         if match_result:
             matched_name = match_result[0]
             score = match_result[1]
             hh_info = hh_areas[matched_name]
-            hh_city_normalized = normalize_city_name(hh_info['name'])
+            hh_city_normalized = normalize(hh_info['name'])
 
             is_changed = check_if_changed(client_city_original, hh_info['name'])
             change_status = 'Да' if is_changed else 'Нет'
 
             if hh_city_normalized in seen_hh_cities:
                 duplicate_hh_count += 1
-                city_result = {
-                    'Исходное название': client_city_original,
-                    'Итоговое гео': hh_info['name'],
-                    'ID HH': hh_info['id'],
-                    'Регион': hh_info['parent'],
-                    'Совпадение %': round(score, 1),
-                    'Изменение': change_status,
-                    'Статус': '🔄 Дубликат (результат HH)',
-                    'row_id': idx,
-                    **other_values
-                }
-                results.append(city_result)
-                seen_original_cities[client_city_normalized] = city_result
+                status = '🔄 Дубликат (результат HH)'
             else:
                 status = '✅ Точное' if score >= 95 else '⚠️ Похожее'
-
-                city_result = {
-                    'Исходное название': client_city_original,
-                    'Итоговое гео': hh_info['name'],
-                    'ID HH': hh_info['id'],
-                    'Регион': hh_info['parent'],
-                    'Совпадение %': round(score, 1),
-                    'Изменение': change_status,
-                    'Статус': status,
-                    'row_id': idx,
-                    **other_values
-                }
-
-                results.append(city_result)
-                seen_original_cities[client_city_normalized] = city_result
                 seen_hh_cities[hh_city_normalized] = True
-        else:
-            city_result = {
-                'Исходное название': client_city_original,
-                'Итоговое гео': None,
-                'ID HH': None,
-                'Регион': None,
-                'Совпадение %': 0,
-                'Изменение': 'Нет',
-                'Статус': '❌ Не найдено',
-                'row_id': idx,
-                **other_values
-            }
-
-            results.append(city_result)
-            seen_original_cities[client_city_normalized] = city_result
 
-    progress_bar.empty()
-    status_text.empty()
+            city_result = (hh_info['name'], hh_info['id'], hh_info['parent'], round(score, 1), change_status)
+        else:
+            status = '❌ Не найдено'
+            city_result = (None, None, None, 0, 'Нет')
+
+        geo, hh_id, region, score_value, change_status = city_result
+        out_geo.append(geo)
+        out_id.append(hh_id)
+        out_region.append(region)
+        out_score.append(score_value)
+        out_change.append(change_status)
+        out_status.append(status)
+        seen_original_cities[client_city_normalized] = city_result
+
+    if show_progress:
+        progress_bar.empty()
+        status_text.empty()
 
     total_duplicates = duplicate_original_count + duplicate_hh_count
 
-    return pd.DataFrame(results), duplicate_original_count, duplicate_hh_count, total_duplicates
+    # Остальные столбцы переносятся целиком: строки результата идут 1:1 с исходными
+    other_col_lists = {
+        col: original_df.iloc[:, col_idx].tolist()
+        for col_idx, col in enumerate(other_cols, start=1)
+    }
+
+    result_df = pd.DataFrame({
+        'Исходное название': out_orig,
+        'Итоговое гео': out_geo,
+        'ID HH': out_id,
+        'Регион': out_region,
+        'Совпадение %': out_score,
+        # Категории: 1 байт кода на строку вместо ссылки на str,
+        # сравнения и фильтры по изменению/статусу идут по массиву кодов.
+        # "Итоговое гео" и "Регион" остаются строками: при редактировании туда
+        # записываются произвольные названия из справочника HH
+        'Изменение': pd.Categorical(out_change, categories=CHANGE_VALUES),
+        'Статус': pd.Categorical(out_status, categories=MATCH_STATUSES),
+        'row_id': out_rowid,
+        **other_col_lists
+    })
+
+    return result_df, duplicate_original_count, duplicate_hh_count, total_duplicates
 
 
 def merge_cities_files(
@@ -451,10 +444,12 @@ def merge_cities_files(
     # Обрабатываем первый файл
     st.info("📄 Обработка первого файла...")
     progress_bar = st.progress(0)
+    total_rows = len(df1)
+    progress_step = max(1, total_rows // 200)
 
     for idx, row in df1.iterrows():
-        progress = (idx + 1) / len(df1)
-        progress_bar.progress(progress)
+        if idx % progress_step == 0 or idx == total_rows - 1:
+            progress_bar.progress((idx + 1) / total_rows)
 
         client_city = row[first_col_name_df1]
 
@@ -520,10 +515,12 @@ def merge_cities_files(
     # Обрабатываем второй файл
     st.info("📄 Обработка второго файла...")
     progress_bar = st.progress(0)
+    total_rows = len(df2)
+    progress_step = max(1, total_rows // 200)
 
     for idx, row in df2.iterrows():
-        progress = (idx + 1) / len(df2)
-        progress_bar.progress(progress)
+        if idx % progress_step == 0 or idx == total_rows - 1:
+            progress_bar.progress((idx + 1) / total_rows)
 
         client_city = row[first_col_name_df2]
 
@@ -8,6 +8,8 @@
 - Определения федеральных округов
 """
 
+import re
+from functools import lru_cache
 from typing import Dict, Optional, List
 import pandas as pd
 import requests
@@ -28,6 +30,13 @@ from modules.matching import normalize_city_name
 # Requests exceptions
 from requests.exceptions import RequestException, Timeout, HTTPError
 
+# pyarrow приходит зависимостью streamlit, но чтение CSV не должно от него зависеть
+try:
+    import pyarrow  # noqa: F401
+    _CSV_ARROW_KWARGS = {'engine': 'pyarrow', 'dtype_backend': 'pyarrow'}
+except ImportError:
+    _CSV_ARROW_KWARGS = {}
+
 
 # ============================================
 # КОНСТАНТЫ
@@ -84,6 +93,31 @@ FEDERAL_DISTRICTS = {
     ]
 }
 
+# Обратный индекс: нормализованный регион -> федеральный округ (O(1) поиск)
+_REGION_TO_DISTRICT = {
+    normalize_city_name(region): district
+    for district, regions in FEDERAL_DISTRICTS.items()
+    for region in regions
+}
+
+
+# Исключения - что не выгружать (нормализованные названия)
+_EXCLUDED_NAMES_NORMALIZED = frozenset(map(normalize_city_name, [
+    'Россия',
+    'Другие регионы',
+    'Другие страны',
+    'Чукотский АО',
+    'Ямало-Ненецкий АО',
+    'Ненецкий АО',
+    'Ханты-Мансийский АО - Югра',
+    'Еврейская АО',
+    'Беловское',
+    'Горькая Балка'
+]))
+
+# Ключевые слова, которые указывают на регион, а не город (одна регулярка вместо any(...))
+_REGION_KEYWORDS_RE = re.compile('|'.join(['область', 'край', 'республика', 'округ', 'автономн']))
+
 
 # ============================================
 # ФУНКЦИИ ЗАГРУЗКИ ДАННЫХ
@@ -176,39 +210,41 @@ def get_hh_areas() -> Optional[Dict]:
 
     areas_dict = {}
 
-    def parse_areas(areas, parent_name="", parent_id="", root_parent_id=""):
-        """
-        Рекурсивно парсит иерархическую структуру регионов
-
-        Args:
-            areas: Список регионов для парсинга
-            parent_name: Название родительского региона
-            parent_id: ID родительского региона
-            root_parent_id: ID корневого региона (страны)
-        """
-        for area in areas:
-            area_id = area['id']
-            area_name = area['name']
-
-            # Определяем корневой parent_id (страну)
-            current_root_id = root_parent_id if root_parent_id else parent_id if parent_id else area_id
-
-            # Получаем информацию о часовом поясе напрямую из объекта
-            utc_offset = area.get('utc_offset', '')
-
-            areas_dict[area_name] = {
-                'id': area_id,
-                'name': area_name,
-                'parent': parent_name,
-                'parent_id': parent_id,
-                'root_parent_id': current_root_id,  # ID страны верхнего уровня
-                'utc_offset': utc_offset  # Смещение UTC (например, "+03:00")
-            }
+    # Обход иерархии регионов в глубину с явным стеком вместо рекурсии.
+    # В стеке лежат итераторы по дочерним спискам, поэтому порядок обхода
+    # (и порядок ключей в areas_dict) совпадает с рекурсивным pre-order.
+    # Элемент стека: (итератор, parent_name, parent_id, root_parent_id)
+    stack = [(iter(data), "", "", "")]
+
+    while stack:
+        areas_iter, parent_name, parent_id, root_parent_id = stack[-1]
+        area = next(areas_iter, None)
+
+        if area is None:
+            stack.pop()
+            continue
+
+        area_id = area['id']
+        area_name = area['name']
+
+        # Определяем корневой parent_id (страну)
+        current_root_id = root_parent_id if root_parent_id else parent_id if parent_id else area_id
 
-            if area.get('areas'):
-                parse_areas(area['areas'], area_name, area_id, current_root_id)
+        # Получаем информацию о часовом поясе напрямую из объекта
+        utc_offset = area.get('utc_offset', '')
+
+        areas_dict[area_name] = {
+            'id': area_id,
+            'name': area_name,
+            'parent': parent_name,
+            'parent_id': parent_id,
+            'root_parent_id': current_root_id,  # ID страны верхнего уровня
+            'utc_offset': utc_offset  # Смещение UTC (например, "+03:00")
+        }
+
+        if area.get('areas'):
+            stack.append((iter(area['areas']), area_name, area_id, current_root_id))
 
-    parse_areas(data)
     return areas_dict
 
 
@@ -231,20 +267,28 @@ def load_population_data() -> Dict[str, int]:
     """
     try:
         # Безопасное чтение CSV с защитой от Path Traversal
-        df = safe_read_csv('population.csv', sep=';', encoding='utf-8')
+        # Читаем только нужные столбцы; при наличии pyarrow - его движком
+        df = safe_read_csv(
+            'population.csv',
+            sep=';',
+            encoding='utf-8',
+            usecols=['ГОРОДА', 'Население'],
+            **_CSV_ARROW_KWARGS
+        )
+
+        if df is None and _CSV_ARROW_KWARGS:
+            # Откат на стандартный движок pandas
+            df = safe_read_csv('population.csv', sep=';', encoding='utf-8', usecols=['ГОРОДА', 'Население'])
 
         if df is None:
             logger.error("Не удалось загрузить файл population.csv")
             return {}
 
         # Создаем словарь {город: население}
-        population_dict = {}
-        for _, row in df.iterrows():
-            city_name = row['ГОРОДА']
-            population = int(row['Население'])
-            population_dict[city_name] = population
-
-        return population_dict
+        return dict(zip(
+            df['ГОРОДА'].tolist(),
+            df['Население'].astype('int64').tolist()
+        ))
     except FileNotFoundError:
         st.warning("⚠️ Файл population.csv не найден. Фильтр по населению будет недоступен.")
         return {}
@@ -257,10 +301,41 @@ def load_population_data() -> Dict[str, int]:
 # ФУНКЦИИ ОБРАБОТКИ РЕГИОНОВ И ГОРОДОВ
 # ============================================
 
+@lru_cache(maxsize=None)
+def parse_utc_offset_hours(utc_offset: str) -> int:
+    """
+    Парсит смещение UTC вида "+03:00" или "-05:00" в целое число часов
+
+    Различных значений смещения в справочнике всего несколько десятков,
+    поэтому результат мемоизируется и try/except выполняется один раз на значение.
+
+    Args:
+        utc_offset: Смещение UTC (например, "+03:00")
+
+    Returns:
+        int: Смещение в часах или 0, если строку не удалось распарсить
+
+    Examples:
+        >>> parse_utc_offset_hours("+03:00")
+        3
+        >>> parse_utc_offset_hours("-05:00")
+        -5
+    """
+    try:
+        sign = 1 if utc_offset[0] == '+' else -1
+        return sign * int(utc_offset[1:3])
+    except (ValueError, IndexError, TypeError) as e:
+        logger.warning(f"Не удалось распарсить UTC offset '{utc_offset}': {e}")
+        return 0
+
+
 def get_federal_district_by_region(region_name: str) -> str:
     """
     Определяет федеральный округ по названию региона
 
+    Поиск идет по обратному индексу _REGION_TO_DISTRICT, ключи которого
+    нормализованы (ё->е, регистр, пробелы).
+
     Args:
         region_name: Название региона (например, "Московская область")
 
@@ -273,10 +348,7 @@ def get_federal_district_by_region(region_name: str) -> str:
         >>> get_federal_district_by_region("Неизвестный регион")
         'Не определен'
     """
-    for district, regions in FEDERAL_DISTRICTS.items():
-        if region_name in regions:
-            return district
-    return "Не определен"
+    return _REGION_TO_DISTRICT.get(normalize_city_name(region_name), "Не определен")
 
 
 def normalize_region_name(text: str) -> str:
@@ -323,198 +395,36 @@ def normalize_region_name(text: str) -> str:
     return text.strip()
 
 
-def get_cities_by_regions(hh_areas: Dict, selected_regions: List[str]) -> pd.DataFrame:
-    """
-    Получает все города из выбранных регионов (только Россия, только города)
-
-    Функция фильтрует справочник HH.ru по следующим критериям:
-    - Только территория России (root_parent_id == '113')
-    - Исключает области, края, республики, автономные округа
-    - Исключает специальные названия (из excluded_names_normalized)
-    - Фильтрует по выбранным регионам
-    - Добавляет информацию о населении, часовых поясах, федеральных округах
-    - Удаляет дубликаты по нормализованному названию
-
-    Args:
-        hh_areas: Справочник регионов HH.ru (из get_hh_areas)
-        selected_regions: Список выбранных регионов для фильтрации
-
-    Returns:
-        pd.DataFrame: DataFrame с колонками:
-                     - Город: название города
-                     - ID HH: идентификатор в HH.ru
-                     - Регион: название региона
-                     - Федеральный округ: название ФО
-                     - UTC: часовой пояс
-                     - Разница с МСК: разница в часах с Москвой
-                     - Население: количество населения
-
-    Examples:
-        >>> areas = get_hh_areas()
-        >>> df = get_cities_by_regions(areas, ["Московская область"])
-        >>> print(df[['Город', 'Регион']].head())
-    """
-    cities = []
-
-    # Загружаем данные о населении
-    population_dict = load_population_data()
-
-    # Список исключений - что не выгружать (нормализованные названия)
-    excluded_names_normalized = [
-        normalize_city_name('Россия'),
-        normalize_city_name('Другие регионы'),
-        normalize_city_name('Другие страны'),
-        normalize_city_name('Чукотский АО'),
-        normalize_city_name('Ямало-Ненецкий АО'),
-        normalize_city_name('Ненецкий АО'),
-        normalize_city_name('Ханты-Мансийский АО - Югра'),
-        normalize_city_name('Еврейская АО'),
-        normalize_city_name('Беловское'),
-        normalize_city_name('Горькая Балка')
-    ]
-
-    # Ключевые слова, которые указывают на регион, а не город
-    region_keywords = ['область', 'край', 'республика', 'округ', 'автономн']
-
-    # ID России
-    russia_id = '113'
-
-    for city_name, city_info in hh_areas.items():
-        parent = city_info['parent']
-        root_parent_id = city_info.get('root_parent_id', '')
-
-        # Пропускаем всё, что не относится к России
-        if root_parent_id != russia_id:
-            continue
-
-        # Нормализуем название для проверки исключений
-        city_name_normalized = normalize_city_name(city_name)
-
-        # Пропускаем исключенные названия (нормализованное сравнение)
-        if city_name_normalized in excluded_names_normalized:
-            continue
-
-        # Пропускаем области, края, республики
-        if not parent or parent == 'Россия':
-            # Проверяем, не является ли это областью/краем/республикой по названию
-            is_region = any(keyword in city_name_normalized for keyword in region_keywords)
-            if is_region:
-                continue
-
-            # Дополнительная проверка: если название заканчивается на "АО" и это не город
-            if city_name.endswith(' АО') or city_name.endswith('АО'):
-                continue
-
-        # Проверяем, входит ли город в выбранные регионы
-        for region in selected_regions:
-            # Нормализуем названия для сравнения
-            region_normalized = normalize_city_name(region)
-            parent_normalized = normalize_city_name(parent) if parent else ""
-            city_name_normalized = normalize_city_name(city_name)
-
-            # Используем ТОЧНОЕ совпадение, а не substring matching
-            # Это предотвращает ложные срабатывания (например: "Москва" in "Московская область")
-            if (region_normalized == parent_normalized or
-                region_normalized == city_name_normalized):
-                # Получаем часовой пояс
-                utc_offset = city_info.get('utc_offset', '')
-
-                # Вычисляем разницу с Москвой (UTC+3)
-                moscow_offset = 3
-                city_offset_hours = 0
-                if utc_offset:
-                    try:
-                        # Парсим смещение вида "+03:00" или "-05:00"
-                        sign = 1 if utc_offset[0] == '+' else -1
-                        hours = int(utc_offset[1:3])
-                        city_offset_hours = sign * hours
-                    except (ValueError, IndexError, TypeError) as e:
-                        logger.warning(f"Не удалось распарсить UTC offset '{utc_offset}': {e}")
-                        city_offset_hours = 0
-
-                diff_with_moscow = city_offset_hours - moscow_offset
-
-                # Определяем федеральный округ
-                region = parent if parent else 'Россия'
-                federal_district = get_federal_district_by_region(region)
-
-                # Получаем население из словаря (0 если данных нет)
-                population = population_dict.get(city_name, 0)
-
-                cities.append({
-                    'Город': city_name,
-                    'ID HH': city_info['id'],
-                    'Регион': region,
-                    'Федеральный округ': federal_district,
-                    'UTC': utc_offset,
-                    'Разница с МСК': f"{diff_with_moscow:+d}ч" if diff_with_moscow != 0 else "0ч",
-                    'Население': population
-                })
-                break
-
-    # Создаем DataFrame
-    df = pd.DataFrame(cities)
-
-    # Удаляем дубликаты по нормализованному названию города
-    if not df.empty:
-        df['_город_normalized'] = df['Город'].apply(normalize_city_name)
-        df = df.drop_duplicates(subset=['_город_normalized'], keep='first')
-        df = df.drop(columns=['_город_normalized'])
-
-    return df
+_CITY_COLUMNS = ['Город', 'ID HH', 'Регион', 'Федеральный округ', 'UTC', 'Разница с МСК', 'Население']
 
 
-def get_all_cities(hh_areas: Dict) -> pd.DataFrame:
+@st.cache_data(ttl=3600, show_spinner=False)
+def _build_russia_cities_df(_hh_areas: Dict, areas_key: tuple) -> pd.DataFrame:
     """
-    Получает все города из справочника HH (только Россия, только города)
+    Собирает общую таблицу городов России для get_all_cities и get_cities_by_regions
 
-    Аналогична get_cities_by_regions, но возвращает ВСЕ города России
-    без фильтрации по регионам.
+    Исключает всё, что не относится к России, области/края/республики и
+    названия из _EXCLUDED_NAMES_NORMALIZED; добавляет население, часовой пояс
+    и федеральный округ. Дубликаты НЕ удаляются - это делают вызывающие
+    функции после своей фильтрации.
 
     Args:
-        hh_areas: Справочник регионов HH.ru (из get_hh_areas)
+        _hh_areas: Справочник регионов HH.ru (префикс _ для bypass hashing)
+        areas_key: Ключ кэша - кортеж названий из справочника
 
     Returns:
-        pd.DataFrame: DataFrame со всеми городами России и следующими колонками:
-                     - Город: название города
-                     - ID HH: идентификатор в HH.ru
-                     - Регион: название региона
-                     - Федеральный округ: название ФО
-                     - UTC: часовой пояс
-                     - Разница с МСК: разница в часах с Москвой
-                     - Население: количество населения
-
-    Examples:
-        >>> areas = get_hh_areas()
-        >>> all_cities_df = get_all_cities(areas)
-        >>> print(f"Всего городов: {len(all_cities_df)}")
+        pd.DataFrame: Столбцы _CITY_COLUMNS и служебные '_город_normalized',
+                     '_parent_normalized'
     """
     cities = []
 
     # Загружаем данные о населении
     population_dict = load_population_data()
 
-    # Список исключений - что не выгружать (нормализованные названия)
-    excluded_names_normalized = [
-        normalize_city_name('Россия'),
-        normalize_city_name('Другие регионы'),
-        normalize_city_name('Другие страны'),
-        normalize_city_name('Чукотский АО'),
-        normalize_city_name('Ямало-Ненецкий АО'),
-        normalize_city_name('Ненецкий АО'),
-        normalize_city_name('Ханты-Мансийский АО - Yugра'),
-        normalize_city_name('Еврейская АО'),
-        normalize_city_name('Беловское'),
-        normalize_city_name('Горькая Балка')
-    ]
-
-    # Ключевые слова, которые указывают на регион, а не город
-    region_keywords = ['область', 'край', 'республика', 'округ', 'автономн']
-
     # ID России
     russia_id = '113'
 
-    for city_name, city_info in hh_areas.items():
+    for city_name, city_info in _hh_areas.items():
         parent = city_info['parent']
         root_parent_id = city_info.get('root_parent_id', '')
 
@@ -526,13 +436,13 @@ def get_all_cities(hh_areas: Dict) -> pd.DataFrame:
         city_name_normalized = normalize_city_name(city_name)
 
         # Пропускаем исключенные названия (нормализованное сравнение)
-        if city_name_normalized in excluded_names_normalized:
+        if city_name_normalized in _EXCLUDED_NAMES_NORMALIZED:
             continue
 
         # Пропускаем области, края, республики
         if not parent or parent == 'Россия':
             # Проверяем, не является ли это областью/краем/республикой по названию
-            is_region = any(keyword in city_name_normalized for keyword in region_keywords)
+            is_region = _REGION_KEYWORDS_RE.search(city_name_normalized) is not None
             if is_region:
                 continue
 
@@ -545,16 +455,7 @@ def get_all_cities(hh_areas: Dict) -> pd.DataFrame:
 
         # Вычисляем разницу с Москвой (UTC+3)
         moscow_offset = 3
-        city_offset_hours = 0
-        if utc_offset:
-            try:
-                # Парсим смещение вида "+03:00" или "-05:00"
-                sign = 1 if utc_offset[0] == '+' else -1
-                hours = int(utc_offset[1:3])
-                city_offset_hours = sign * hours
-            except (ValueError, IndexError, TypeError) as e:
-                logger.warning(f"Не удалось распарсить UTC offset '{utc_offset}': {e}")
-                city_offset_hours = 0
+        city_offset_hours = parse_utc_offset_hours(utc_offset) if utc_offset else 0
 
         diff_with_moscow = city_offset_hours - moscow_offset
 
@@ -572,16 +473,96 @@ def get_all_cities(hh_areas: Dict) -> pd.DataFrame:
             'Федеральный округ': federal_district,
             'UTC': utc_offset,
             'Разница с МСК': f"{diff_with_moscow:+d}ч" if diff_with_moscow != 0 else "0ч",
-            'Население': population
+            'Население': population,
+            '_город_normalized': city_name_normalized,
+            '_parent_normalized': normalize_city_name(parent) if parent else ""
         })
 
-    # Создаем DataFrame
-    df = pd.DataFrame(cities)
+    return pd.DataFrame(cities, columns=_CITY_COLUMNS + ['_город_normalized', '_parent_normalized'])
+
+
+def _drop_city_duplicates(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Удаляет дубликаты по нормализованному названию и служебные столбцы
+
+    Args:
+        df: DataFrame из _build_russia_cities_df (или его срез)
+
+    Returns:
+        pd.DataFrame: DataFrame со столбцами _CITY_COLUMNS
+    """
+    # Нормализованное название уже посчитано при сборке записей
+    df = df.drop_duplicates(subset=['_город_normalized'], keep='first')
+    return df[_CITY_COLUMNS]
 
-    # Удаляем дубликаты по нормализованному названию города
-    if not df.empty:
-        df['_город_normalized'] = df['Город'].apply(normalize_city_name)
-        df = df.drop_duplicates(subset=['_город_normalized'], keep='first')
-        df = df.drop(columns=['_город_normalized'])
 
-    return df
+def get_cities_by_regions(hh_areas: Dict, selected_regions: List[str]) -> pd.DataFrame:
+    """
+    Получает все города из выбранных регионов (только Россия, только города)
+
+    Функция фильтрует справочник HH.ru по следующим критериям:
+    - Только территория России (root_parent_id == '113')
+    - Исключает области, края, республики, автономные округа
+    - Исключает специальные названия (из _EXCLUDED_NAMES_NORMALIZED)
+    - Фильтрует по выбранным регионам
+    - Добавляет информацию о населении, часовых поясах, федеральных округах
+    - Удаляет дубликаты по нормализованному названию
+
+    Args:
+        hh_areas: Справочник регионов HH.ru (из get_hh_areas)
+        selected_regions: Список выбранных регионов для фильтрации
+
+    Returns:
+        pd.DataFrame: DataFrame с колонками:
+                     - Город: название города
+                     - ID HH: идентификатор в HH.ru
+                     - Регион: название региона
+                     - Федеральный округ: название ФО
+                     - UTC: часовой пояс
+                     - Разница с МСК: разница в часах с Москвой
+                     - Население: количество населения
+
+    Examples:
+        >>> areas = get_hh_areas()
+        >>> df = get_cities_by_regions(areas, ["Московская область"])
+        >>> print(df[['Город', 'Регион']].head())
+    """
+    df = _build_russia_cities_df(hh_areas, tuple(hh_areas))
+
+    # Используем ТОЧНОЕ совпадение, а не substring matching
+    # Это предотвращает ложные срабатывания (например: "Москва" in "Московская область")
+    regions_normalized = {normalize_city_name(region) for region in selected_regions}
+    in_regions = (
+        df['_parent_normalized'].isin(regions_normalized) |
+        df['_город_normalized'].isin(regions_normalized)
+    )
+
+    return _drop_city_duplicates(df[in_regions].reset_index(drop=True))
+
+
+def get_all_cities(hh_areas: Dict) -> pd.DataFrame:
+    """
+    Получает все города из справочника HH (только Россия, только города)
+
+    Аналогична get_cities_by_regions, но возвращает ВСЕ города России
+    без фильтрации по регионам.
+
+    Args:
+        hh_areas: Справочник регионов HH.ru (из get_hh_areas)
+
+    Returns:
+        pd.DataFrame: DataFrame со всеми городами России и следующими колонками:
+                     - Город: название города
+                     - ID HH: идентификатор в HH.ru
+                     - Регион: название региона
+                     - Федеральный округ: название ФО
+                     - UTC: часовой пояс
+                     - Разница с МСК: разница в часах с Москвой
+                     - Население: количество населения
+
+    Examples:
+        >>> areas = get_hh_areas()
+        >>> all_cities_df = get_all_cities(areas)
+        >>> print(f"Всего городов: {len(all_cities_df)}")
+    """
+    return _drop_city_duplicates(_build_russia_cities_df(hh_areas, tuple(hh_areas)))
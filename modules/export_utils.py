@@ -11,6 +11,20 @@ from typing import Dict, Optional, List
 import pandas as pd
 import io
 import zipfile
+import datetime
+import openpyxl
+from openpyxl.writer.excel import ExcelWriter as OpenpyxlArchiveWriter
+
+# Потоковая запись xlsx: xlsxwriter (constant_memory) быстрее openpyxl;
+# если он не установлен, используется openpyxl в режиме write_only
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# Уровень deflate для xml внутри xlsx: файлы одноразовые (скачивание),
+# уровень 1 в несколько раз быстрее уровня по умолчанию (6) при размере больше на ~15%
+XLSX_COMPRESSLEVEL = 1
 
 
 def create_excel_buffer(
@@ -101,12 +115,17 @@ def create_full_report_excel(df: pd.DataFrame, sheet_name: str = 'Города')
     )
 
 
-def create_zip_archive(files_dict: Dict[str, bytes]) -> io.BytesIO:
+def create_zip_archive(
+    files_dict: Dict[str, bytes],
+    compression: int = zipfile.ZIP_DEFLATED
+) -> io.BytesIO:
     """
     Создает ZIP архив из словаря файлов
 
     Args:
         files_dict: Словарь {имя_файла: содержимое_файла_в_байтах}
+        compression: Метод сжатия элементов архива (для готовых xlsx - zipfile.ZIP_STORED:
+                     xlsx уже является сжатым ZIP, повторное сжатие почти не уменьшает размер)
 
     Returns:
         io.BytesIO: Буфер с ZIP архивом
@@ -120,13 +139,192 @@ def create_zip_archive(files_dict: Dict[str, bytes]) -> io.BytesIO:
         >>> # zip_buffer готов для скачивания
     """
     zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    with zipfile.ZipFile(zip_buffer, 'w', compression) as zip_file:
         for filename, content in files_dict.items():
             zip_file.writestr(filename, content)
     zip_buffer.seek(0)
     return zip_buffer
 
 
+def write_excel_rows(
+    target,
+    df: pd.DataFrame,
+    sheet_name: str = 'Sheet1',
+    include_header: bool = True
+) -> None:
+    """
+    Записывает DataFrame в Excel файл потоково (xlsxwriter или openpyxl write_only)
+
+    В отличие от pd.ExcelWriter книга не строит в памяти дерево всех ячеек:
+    строки добавляются на лист по одной. Если установлен xlsxwriter, используется
+    режим constant_memory (строка сбрасывается на диск сразу после записи),
+    иначе - openpyxl в режиме write_only.
+    Пустые значения (NaN/None/NaT) записываются пустыми ячейками, как в to_excel.
+    Заголовок пишется без оформления pandas (жирный шрифт, рамки).
+
+    Args:
+        target: Путь, BytesIO или открытый на запись поток (например, элемент ZIP архива)
+        df: DataFrame для экспорта
+        sheet_name: Название листа Excel
+        include_header: Включать ли заголовки столбцов
+
+    Examples:
+        >>> buffer = io.BytesIO()
+        >>> write_excel_rows(buffer, pd.DataFrame({'A': [1, None]}), 'Data')
+    """
+    values = df.astype(object).where(df.notna(), None)
+
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(target, {
+            'constant_memory': True,
+            # Без поиска URL в каждой строке (регулярное выражение на каждую ячейку)
+            'strings_to_urls': False,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        })
+        worksheet = workbook.add_worksheet(sheet_name)
+
+        row_idx = 0
+        if include_header:
+            worksheet.write_row(row_idx, 0, [str(col) for col in df.columns])
+            row_idx += 1
+
+        for row in values.itertuples(index=False, name=None):
+            worksheet.write_row(row_idx, 0, row)
+            row_idx += 1
+
+        workbook.close()
+        return
+
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+
+    if include_header:
+        worksheet.append([str(col) for col in df.columns])
+
+    for row in values.itertuples(index=False, name=None):
+        worksheet.append(row)
+
+    _save_workbook(workbook, target)
+
+
+def _save_workbook(workbook: openpyxl.Workbook, target) -> None:
+    """
+    Сохраняет книгу openpyxl с уровнем сжатия XLSX_COMPRESSLEVEL
+
+    То же, что workbook.save(target), но архив xlsx открывается самостоятельно:
+    openpyxl всегда сжимает с уровнем deflate по умолчанию.
+
+    Args:
+        workbook: Книга openpyxl
+        target: Путь, BytesIO или открытый на запись поток
+    """
+    archive = zipfile.ZipFile(
+        target, 'w', zipfile.ZIP_DEFLATED,
+        allowZip64=True, compresslevel=XLSX_COMPRESSLEVEL
+    )
+    workbook.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+    OpenpyxlArchiveWriter(workbook, archive).save()
+
+
+def write_excel_to_zip(
+    zip_file: zipfile.ZipFile,
+    filename: str,
+    df: pd.DataFrame,
+    sheet_name: str = 'Sheet1',
+    include_header: bool = True
+) -> None:
+    """
+    Записывает DataFrame как Excel файл прямо в элемент ZIP архива
+
+    Книга сохраняется сразу в поток элемента архива (write_excel_rows), без
+    промежуточного BytesIO и копии его содержимого (getvalue()).
+
+    Args:
+        zip_file: Открытый на запись ZIP архив
+        filename: Имя файла в архиве
+        df: DataFrame для экспорта
+        sheet_name: Название листа Excel
+        include_header: Включать ли заголовки
+
+    Examples:
+        >>> with zipfile.ZipFile(buffer, 'w') as zip_file:
+        ...     write_excel_to_zip(zip_file, 'data.xlsx', df, 'Data')
+    """
+    with zip_file.open(filename, 'w') as entry:
+        write_excel_rows(entry, df, sheet_name, include_header)
+
+
+def make_unique_filenames(filenames: List[str]) -> List[str]:
+    """
+    Делает имена файлов архива уникальными, добавляя числовой суффикс к повторам
+
+    Имена файлов вакансий сокращаются ('/' и '\\' заменяются на '_', обрезка до 50 символов),
+    поэтому разные вакансии могут получить одно имя - без суффикса один из файлов
+    молча затерся бы в словаре архива.
+
+    Args:
+        filenames: Имена файлов в исходном порядке (могут повторяться)
+
+    Returns:
+        List[str]: Уникальные имена в том же порядке; первое вхождение не меняется
+
+    Examples:
+        >>> make_unique_filenames(['a.xlsx', 'a.xlsx', 'b.xlsx'])
+        ['a.xlsx', 'a (2).xlsx', 'b.xlsx']
+    """
+    used = set(filenames)
+    seen = set()
+    unique_names = []
+    for filename in filenames:
+        if filename in seen:
+            stem, dot, ext = filename.rpartition('.')
+            if not dot:
+                stem, ext = filename, ''
+            suffix = 2
+            while True:
+                candidate = f"{stem} ({suffix}){dot}{ext}"
+                if candidate not in used:
+                    break
+                suffix += 1
+            used.add(candidate)
+            filename = candidate
+        seen.add(filename)
+        unique_names.append(filename)
+    return unique_names
+
+
+def create_excel_zip_archive(
+    dataframes_dict: Dict[str, pd.DataFrame],
+    sheet_name: str = 'Sheet1',
+    include_header: bool = True
+) -> io.BytesIO:
+    """
+    Создает ZIP архив с отдельным Excel файлом для каждого DataFrame
+
+    В отличие от create_zip_archive принимает DataFrame, а не готовые байты:
+    каждый файл формируется сразу внутри архива (write_excel_to_zip).
+
+    Args:
+        dataframes_dict: Словарь {имя_файла: DataFrame}
+        sheet_name: Название листа в каждом файле
+        include_header: Включать ли заголовки
+
+    Returns:
+        io.BytesIO: Буфер с ZIP архивом
+
+    Examples:
+        >>> frames = {'a.xlsx': pd.DataFrame({'A': [1]}), 'b.xlsx': pd.DataFrame({'B': [2]})}
+        >>> zip_buffer = create_excel_zip_archive(frames, sheet_name='Результат')
+    """
+    zip_buffer = io.BytesIO()
+    # Файлы xlsx уже сжаты внутри, поэтому элементы архива не сжимаются повторно
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+        for filename, df in dataframes_dict.items():
+            write_excel_to_zip(zip_file, filename, df, sheet_name, include_header)
+    zip_buffer.seek(0)
+    return zip_buffer
+
+
 def create_result_excel(
     df: pd.DataFrame,
     sheet_name: str = 'Результат'
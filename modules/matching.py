@@ -4,9 +4,11 @@ City Matching Module
 """
 
 import re
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from rapidfuzz import fuzz
-from typing import List, Tuple, Optional
+from rapidfuzz import fuzz, process
+from typing import Dict, List, Tuple, Optional
 
 
 # ============================================================================
@@ -45,6 +47,19 @@ EXCLUDED_EXACT_MATCHES = {
     'ленинградская',  # Точное совпадение с "Ленинградская" = Нет совпадения
 }
 
+# Префиксы населенных пунктов в начале строки ("г. Москва", "г.Москва", "село Ивановка")
+_CITY_PREFIX_RE = re.compile(
+    r'^(?:г\.|п\.|д\.|с\.|пос\.|дер\.|село|город|поселок|деревня)',
+    re.IGNORECASE
+)
+
+# Ключевые слова, с которых начинается часть строки с регионом
+_REGION_KEYWORD_RE = re.compile(
+    r'област|край|республик|округ|ленинград|москов|курск|кемеров|'
+    r'свердлов|нижегород|новосибирск|тамбов|красноярск',
+    re.IGNORECASE
+)
+
 
 # ============================================================================
 # ФУНКЦИИ НОРМАЛИЗАЦИИ
@@ -54,6 +69,9 @@ def normalize_city_name(text: str) -> str:
     """
     Нормализует название города: ё->е, нижний регистр, убирает лишние пробелы
 
+    Одни и те же названия встречаются во всех вакансиях и при каждом
+    перезапуске скрипта, поэтому результат для строк мемоизируется.
+
     Args:
         text: Название города
 
@@ -66,11 +84,15 @@ def normalize_city_name(text: str) -> str:
         >>> normalize_city_name("Королёв")
         'королев'
     """
-    # Проверяем, что text это строка, иначе возвращаем пустую строку
-    if pd.isna(text) or not isinstance(text, str):
-        return ""
-    if not text:
+    # Проверяем, что text это непустая строка, иначе возвращаем пустую строку
+    if not isinstance(text, str) or not text:
         return ""
+    return _normalize_city_name_cached(text)
+
+
+@lru_cache(maxsize=200_000)
+def _normalize_city_name_cached(text: str) -> str:
+    """Нормализация непустой строки (мемоизируется в normalize_city_name)"""
     # Заменяем ё на е
     text = text.replace('ё', 'е').replace('Ё', 'Е')
     # Приводим к нижнему регистру и убираем лишние пробелы
@@ -110,33 +132,15 @@ def extract_city_and_region(text: str) -> Tuple[str, Optional[str]]:
     if not text or text == 'nan':
         return ('', None)
 
-    text_lower = text.lower()
-
-    # Префиксы населенных пунктов
-    city_prefixes = ['г.', 'п.', 'д.', 'с.', 'пос.', 'дер.', 'село', 'город', 'поселок', 'деревня']
-
     # Убираем всё после запятой (дополнительная информация типа "Истра, деревня Покровское")
     if ',' in text:
         text = text.split(',')[0].strip()
 
-    region_keywords = [
-        'област', 'край', 'республик', 'округ',
-        'ленинград', 'москов', 'курск', 'кемеров',
-        'свердлов', 'нижегород', 'новосибирск', 'тамбов',
-        'красноярск'
-    ]
-
-    # Удаляем префиксы в начале строки (с пробелом и без)
+    # Удаляем префикс в начале строки (с пробелом и без): "г. Москва", "г.Москва"
     text_cleaned = text.strip()
-    for prefix in city_prefixes:
-        # Проверяем с пробелом: "г. Москва"
-        if text_cleaned.lower().startswith(prefix + ' '):
-            text_cleaned = text_cleaned[len(prefix) + 1:].strip()  # +1 для пробела
-            break
-        # Проверяем без пробела: "г.Москва"
-        elif text_cleaned.lower().startswith(prefix):
-            text_cleaned = text_cleaned[len(prefix):].strip()
-            break
+    prefix_match = _CITY_PREFIX_RE.match(text_cleaned)
+    if prefix_match:
+        text_cleaned = text_cleaned[prefix_match.end():].strip()
 
     words = text_cleaned.split()
 
@@ -148,8 +152,7 @@ def extract_city_and_region(text: str) -> Tuple[str, Optional[str]]:
     region_found = False
 
     for word in words:
-        word_lower = word.lower()
-        if not region_found and any(keyword in word_lower for keyword in region_keywords):
+        if not region_found and _REGION_KEYWORD_RE.search(word):
             region_found = True
             region_words.append(word)
         elif region_found:
@@ -167,10 +170,66 @@ def extract_city_and_region(text: str) -> Tuple[str, Optional[str]]:
 # ФУНКЦИИ ПОИСКА КАНДИДАТОВ
 # ============================================================================
 
+# Длина n-граммы в индексе названий городов
+NAME_NGRAM_SIZE = 3
+
+
+def build_name_ngram_index(hh_city_names_norm: List[str]) -> Dict[str, List[int]]:
+    """
+    Строит индекс триграмм нормализованных названий: триграмма -> позиции названий
+
+    Подстрока из 3+ символов может входить только в те названия, которые содержат
+    все ее триграммы. Индекс сужает поиск по подстроке в get_candidates_by_word
+    до пересечения нескольких коротких списков вместо перебора всего справочника.
+
+    Args:
+        hh_city_names_norm: Нормализованные названия городов (порядок = позиции в индексе)
+
+    Returns:
+        Dict[str, List[int]]: {триграмма: возрастающий список позиций названий}
+
+    Examples:
+        >>> index = build_name_ngram_index(['москва', 'тверь', 'подмосковье'])
+        >>> index['мос']
+        [0, 2]
+    """
+    index: Dict[str, List[int]] = {}
+    for position, name in enumerate(hh_city_names_norm):
+        for ngram in {name[i:i + NAME_NGRAM_SIZE] for i in range(len(name) - NAME_NGRAM_SIZE + 1)}:
+            index.setdefault(ngram, []).append(position)
+    return index
+
+
+def _positions_containing(word: str, ngram_index: Dict[str, List[int]]) -> List[int]:
+    """
+    Возвращает позиции названий, содержащих все триграммы слова (по возрастанию)
+
+    Это необходимое условие вхождения подстроки: точная проверка `word in name`
+    выполняется вызывающим кодом только для этих позиций.
+    """
+    postings = []
+    for ngram in {word[i:i + NAME_NGRAM_SIZE] for i in range(len(word) - NAME_NGRAM_SIZE + 1)}:
+        positions = ngram_index.get(ngram)
+        if positions is None:
+            return []
+        postings.append(positions)
+
+    # Пересечение начинаем с самого короткого списка
+    postings.sort(key=len)
+    common = set(postings[0])
+    for positions in postings[1:]:
+        common.intersection_update(positions)
+        if not common:
+            return []
+    return sorted(common)
+
+
 def get_candidates_by_word(
     client_city: str,
     hh_city_names: List[str],
-    limit: int = 20
+    limit: int = 20,
+    hh_city_names_norm: Optional[List[str]] = None,
+    hh_name_ngrams: Optional[Dict[str, List[int]]] = None
 ) -> List[Tuple[str, int]]:
     """
     Получает кандидатов по совпадению начального слова с применением PREFERRED_MATCHES
@@ -179,6 +238,12 @@ def get_candidates_by_word(
         client_city: Название города от клиента
         hh_city_names: Список городов из справочника HH
         limit: Максимальное количество кандидатов
+        hh_city_names_norm: Нормализованные названия hh_city_names (в том же порядке).
+                            Передается при пакетной обработке, чтобы не нормализовать
+                            справочник заново для каждого города
+        hh_name_ngrams: Индекс триграмм hh_city_names_norm (build_name_ngram_index).
+                        Если передан, подстрока ищется только среди названий,
+                        содержащих все триграммы начального слова
 
     Returns:
         List[Tuple[str, int]]: Список кандидатов (название, score) отсортированный по убыванию score
@@ -206,12 +271,11 @@ def get_candidates_by_word(
         return []
 
     # Проверяем предпочтительные совпадения
-    if client_city_normalized in PREFERRED_MATCHES:
-        preferred_match = PREFERRED_MATCHES[client_city_normalized]
-        if preferred_match in hh_city_names:
-            score = fuzz.WRatio(client_city_normalized, normalize_city_name(preferred_match))
-            # Возвращаем предпочтительное совпадение с наивысшим приоритетом
-            return [(preferred_match, score)]
+    preferred_match = PREFERRED_MATCHES.get(client_city_normalized)
+    if preferred_match is not None and preferred_match in hh_city_names:
+        score = fuzz.WRatio(client_city_normalized, normalize_city_name(preferred_match))
+        # Возвращаем предпочтительное совпадение с наивысшим приоритетом
+        return [(preferred_match, score)]
 
     words = client_city.split()
     if not words:
@@ -219,13 +283,40 @@ def get_candidates_by_word(
 
     first_word = normalize_city_name(words[0])
 
-    candidates = []
-    for city_name in hh_city_names:
-        city_lower = normalize_city_name(city_name)
+    if hh_city_names_norm is None:
+        hh_city_names_norm = [normalize_city_name(city_name) for city_name in hh_city_names]
+
+    matched_names = []
+    matched_normalized = []
+    # Локальные ссылки в горячем цикле: LOAD_FAST вместо LOAD_GLOBAL/LOAD_ATTR
+    append_name = matched_names.append
+    append_normalized = matched_normalized.append
+    if hh_name_ngrams is not None and len(first_word) >= NAME_NGRAM_SIZE:
+        # Проверяем подстроку только у названий, прошедших фильтр по триграммам
+        scan = (
+            (hh_city_names[position], hh_city_names_norm[position])
+            for position in _positions_containing(first_word, hh_name_ngrams)
+        )
+    else:
+        scan = zip(hh_city_names, hh_city_names_norm)
+
+    for city_name, city_lower in scan:
         if first_word in city_lower:
-            score = fuzz.WRatio(client_city_normalized, city_lower)
-            candidates.append((city_name, score))
+            append_name(city_name)
+            append_normalized(city_lower)
+
+    if not matched_names:
+        return []
+
+    # Считаем WRatio для всех кандидатов одним вызовом (матрица 1×N в C)
+    scores = process.cdist(
+        [client_city_normalized],
+        matched_normalized,
+        scorer=fuzz.WRatio,
+        dtype=np.float64
+    )[0]
 
+    candidates = list(zip(matched_names, scores.tolist()))
     candidates.sort(key=lambda x: x[1], reverse=True)
 
     return candidates[:limit]
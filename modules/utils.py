@@ -3,13 +3,22 @@
 
 Этот модуль содержит общие вспомогательные функции:
 - Фильтрация городов по странам
+- Индекс нормализованных названий городов для сопоставления
+- Маски статусов результата сопоставления
+- Подготовка строк для блока ручного редактирования
+- Группировка ручных изменений по вкладкам/вакансиям
+- Отбор строк и формирование DataFrame выгрузки, удаление повторов городов
+- Применение изменений единой сверки
 - Обработка заголовков DataFrame
 - Проверка изменений в данных
 """
 
-from typing import Dict, List
+from typing import Any, Dict, List, Tuple
+import numpy as np
 import pandas as pd
 
+from modules.matching import normalize_city_name
+
 
 def get_russian_cities(hh_areas: Dict) -> List[str]:
     """
@@ -36,6 +45,390 @@ def get_russian_cities(hh_areas: Dict) -> List[str]:
     ]
 
 
+def get_russian_city_index(hh_areas: Dict) -> Tuple[List[str], List[str]]:
+    """
+    Возвращает российские города из справочника HH и их нормализованные названия
+
+    Нормализация справочника выполняется один раз, после чего списки
+    передаются в match_cities / get_candidates_by_word вместо повторной
+    нормализации каждого названия для каждого города клиента.
+
+    Args:
+        hh_areas: Справочник регионов HH.ru (из get_hh_areas)
+
+    Returns:
+        Tuple[List[str], List[str]]: (названия городов, нормализованные названия)
+                                     в одинаковом порядке
+
+    Examples:
+        >>> areas = get_hh_areas()
+        >>> names, names_norm = get_russian_city_index(areas)
+        >>> print(names_norm[names.index("Королёв")])  # 'королев'
+    """
+    hh_city_names = get_russian_cities(hh_areas)
+    return hh_city_names, [normalize_city_name(name) for name in hh_city_names]
+
+
+def get_hh_lookup(hh_areas: Dict) -> pd.DataFrame:
+    """
+    Возвращает таблицу справочника HH: название -> ID HH и Регион (parent)
+
+    Индекс таблицы (хэш-таблица названий) строится один раз и переиспользуется
+    при каждом map, поэтому ID и регион для новых значений подставляются
+    векторно, без обращения к словарю для каждого значения.
+
+    Args:
+        hh_areas: Справочник регионов HH.ru (из get_hh_areas)
+
+    Returns:
+        pd.DataFrame: Столбцы 'ID HH' и 'Регион', индекс - названия из справочника
+
+    Examples:
+        >>> lookup = get_hh_lookup({'Москва': {'id': '1', 'parent': '113'}})
+        >>> lookup.loc['Москва', 'ID HH']
+        '1'
+    """
+    return pd.DataFrame(
+        {
+            'ID HH': [area.get('id') for area in hh_areas.values()],
+            'Регион': [area.get('parent') for area in hh_areas.values()],
+        },
+        index=pd.Index(list(hh_areas), dtype=object),
+    )
+
+
+# Подстроки статусов, по которым фильтруются результаты сопоставления
+STATUS_MASK_PATTERNS = {
+    'not_found': '❌ Не найдено',
+    'empty': 'Пустое значение',
+    'duplicate': 'Дубликат',
+}
+
+
+def get_status_masks(status: pd.Series) -> Dict[str, np.ndarray]:
+    """
+    Возвращает маски статусов "❌ Не найдено", "Пустое значение" и "Дубликат"
+
+    Подстроки проверяются только у уникальных значений (категории для категориального
+    столбца - результата match_cities, иначе pd.factorize за один проход по строкам),
+    а маски строк получаются индексированием по кодам - без отдельного
+    str.contains по всему столбцу на каждую подстроку.
+
+    Args:
+        status: Столбец "Статус"
+
+    Returns:
+        Dict[str, np.ndarray]: {'not_found' | 'empty' | 'duplicate': bool-маска строк}
+
+    Examples:
+        >>> masks = get_status_masks(pd.Series(['❌ Не найдено', '✅ Точное', None]))
+        >>> masks['not_found'].tolist()
+        [True, False, False]
+    """
+    if isinstance(status.dtype, pd.CategoricalDtype):
+        codes = status.cat.codes.to_numpy()
+        values = status.cat.categories
+    else:
+        codes, values = pd.factorize(status)
+
+    masks = {}
+    for key, pattern in STATUS_MASK_PATTERNS.items():
+        # Последний элемент (False) - для кода -1 (пустое значение)
+        flags = np.array(
+            [isinstance(value, str) and pattern in value for value in values] + [False],
+            dtype=bool
+        )
+        masks[key] = flags[codes]
+    return masks
+
+
+def category_isin(values: pd.Series, selected: List) -> np.ndarray:
+    """
+    Маска строк, значение которых входит в selected (аналог Series.isin)
+
+    Для категориального столбца выбранные значения переводятся в коды по
+    индексу категорий, и сравниваются целые коды, а не строки всего столбца.
+    Для остальных столбцов используется обычный isin.
+
+    Args:
+        values: Столбец (желательно категориальный)
+        selected: Выбранные значения
+
+    Returns:
+        np.ndarray: bool-маска строк
+
+    Examples:
+        >>> category_isin(pd.Series(['Москва', 'Клин', None], dtype='category'), ['Клин']).tolist()
+        [False, True, False]
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.isin(selected).to_numpy()
+
+    selected_codes = values.cat.categories.get_indexer(pd.Index(selected, dtype=object).unique())
+    # -1: значения нет среди категорий (и не должно совпасть с кодом пустого значения)
+    return np.isin(values.cat.codes.to_numpy(), selected_codes[selected_codes >= 0])
+
+
+def prepare_editable_rows(editable_rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    Оставляет по одной строке на исходное название и сортирует строки для редактирования
+
+    Повторы определяются по нормализованному исходному названию (остается первая строка).
+    Порядок: сначала "❌ Не найдено", затем по возрастанию процента совпадения.
+    Маска повторов и порядок строк считаются по массивам, без служебных столбцов
+    и лишних копий DataFrame.
+
+    Args:
+        editable_rows: Строки результата сопоставления (столбцы "Исходное название",
+                       "Статус", "Совпадение %")
+
+    Returns:
+        pd.DataFrame: Уникальные по исходному названию строки в порядке редактирования
+
+    Examples:
+        >>> df = pd.DataFrame({
+        ...     'Исходное название': ['Москва', 'москва ', 'Питер'],
+        ...     'Статус': ['⚠️ Похожее', '⚠️ Похожее', '❌ Не найдено'],
+        ...     'Совпадение %': [90.0, 90.0, 0]
+        ... })
+        >>> prepare_editable_rows(df)['Исходное название'].tolist()
+        ['Питер', 'Москва']
+    """
+    normalized = editable_rows['Исходное название'].map(normalize_city_name)
+    editable_rows = editable_rows[~normalized.duplicated().to_numpy()]
+
+    # 0 - "Не найдено", 1 - остальные; np.lexsort стабилен, как sort_values по двум столбцам
+    sort_priority = ~get_status_masks(editable_rows['Статус'])['not_found']
+    order = np.lexsort((editable_rows['Совпадение %'].to_numpy(), sort_priority))
+    return editable_rows.iloc[order]
+
+
+def group_manual_selections(manual_selections: Dict) -> Tuple[Dict[Any, Dict], Dict]:
+    """
+    Раскладывает ручные изменения по группам (вкладка или вакансия) за один проход
+
+    Ключи вида (группа, row_id) попадают в словарь своей группы, остальные ключи
+    (старый формат - просто row_id) возвращаются отдельно: они относятся ко всем группам.
+
+    Args:
+        manual_selections: st.session_state.manual_selections
+
+    Returns:
+        Tuple[Dict[Any, Dict], Dict]: ({группа: {row_id: значение}}, {row_id: значение})
+
+    Examples:
+        >>> by_group, common = group_manual_selections({('Лист1', 0): 'Москва', 5: 'Клин'})
+        >>> by_group
+        {'Лист1': {0: 'Москва'}}
+        >>> common
+        {5: 'Клин'}
+    """
+    by_group: Dict[Any, Dict] = {}
+    common = {}
+    for selection_key, new_value in manual_selections.items():
+        if isinstance(selection_key, tuple):
+            group, row_id = selection_key
+            by_group.setdefault(group, {})[row_id] = new_value
+        else:
+            common[selection_key] = new_value
+    return by_group, common
+
+
+def normalize_city_names(values: pd.Series) -> pd.Series:
+    """
+    Векторная нормализация столбца названий: ё->е, нижний регистр, лишние пробелы
+
+    Строковый аналог normalize_city_name для целого столбца; пустые значения
+    превращаются в пустую строку. Каждое уникальное значение нормализуется один раз.
+
+    Args:
+        values: Столбец с названиями городов
+
+    Returns:
+        pd.Series: Нормализованные названия (индекс как у values)
+
+    Examples:
+        >>> normalize_city_names(pd.Series(['  Королёв ', 'Нижний   Новгород'])).tolist()
+        ['королев', 'нижний новгород']
+    """
+    # Строковые операции выполняются только над уникальными значениями (pd.factorize),
+    # результат раскладывается по строкам индексированием по кодам
+    codes, uniques = pd.factorize(values)
+    normalized_uniques = (
+        pd.Series(uniques, dtype=object)
+        .astype(str)
+        .str.lower()
+        .str.replace('ё', 'е', regex=False)
+        .str.strip()
+        .str.replace(r'\s+', ' ', regex=True)
+        .to_numpy(dtype=object)
+    )
+    # Код -1 (пустое значение) указывает на добавленную в конец пустую строку
+    normalized = np.append(normalized_uniques, '')[codes]
+    return pd.Series(normalized, index=values.index, dtype=object)
+
+
+def select_export_rows(result_df: pd.DataFrame, exclude_empty: bool = True) -> pd.DataFrame:
+    """
+    Отбирает строки результата сопоставления для выгрузки
+
+    Исключаются строки без итогового гео, со статусом "❌ Не найдено" (и "Пустое значение",
+    если exclude_empty), а также ВСЕ повторы городов, у которых хотя бы одна строка
+    не найдена. Все условия объединяются в одну маску - одна выборка строк вместо
+    фильтра и последующего повторного фильтра по исключенным городам.
+
+    Args:
+        result_df: Результат сопоставления
+        exclude_empty: Исключать ли строки со статусом "Пустое значение"
+
+    Returns:
+        pd.DataFrame: Строки для выгрузки (индекс как у result_df, без копирования для чтения)
+
+    Examples:
+        >>> df = pd.DataFrame({
+        ...     'Исходное название': ['Лондон', 'лондон', 'Клин'],
+        ...     'Итоговое гео': [None, 'Лонгйир', 'Клин'],
+        ...     'Статус': ['❌ Не найдено', '⚠️ Похожее', '✅ Точное']
+        ... })
+        >>> select_export_rows(df)['Итоговое гео'].tolist()
+        ['Клин']
+    """
+    status_masks = get_status_masks(result_df['Статус'])
+    not_found = status_masks['not_found']
+
+    keep = result_df['Итоговое гео'].notna().to_numpy() & ~not_found
+    if exclude_empty:
+        keep &= ~status_masks['empty']
+
+    # Повторы не найденных городов (по нормализованному названию)
+    if not_found.any():
+        normalized = normalize_city_names(result_df['Исходное название'])
+        excluded = set(normalized[not_found & result_df['Исходное название'].notna().to_numpy()])
+        keep &= ~normalized.isin(excluded).to_numpy()
+
+    return result_df[keep]
+
+
+def build_export_frame(result_df: pd.DataFrame, original_cols: List, skip_cols=()) -> pd.DataFrame:
+    """
+    Формирует DataFrame выгрузки: первый столбец - итоговое гео, остальные - из исходного файла
+
+    DataFrame создается один раз из словаря {столбец: массив}, а не пустым
+    DataFrame с добавлением столбцов по одному.
+
+    Args:
+        result_df: Результат сопоставления с добавленными столбцами исходного файла
+        original_cols: Столбцы исходного файла (первый - столбец с городом)
+        skip_cols: Столбцы исходного файла, которые не попадают в выгрузку
+
+    Returns:
+        pd.DataFrame: Столбцы original_cols, присутствующие в result_df (индекс как у result_df)
+
+    Examples:
+        >>> df = pd.DataFrame({'Итоговое гео': ['Москва'], 'Город': ['Мск'], 'Вакансия': ['A']})
+        >>> build_export_frame(df, ['Город', 'Вакансия'], skip_cols=('Вакансия',)).to_dict('list')
+        {'Город': ['Москва']}
+    """
+    data = {original_cols[0]: result_df['Итоговое гео'].values}
+    for col in original_cols[1:]:
+        if col not in skip_cols and col in result_df.columns:
+            data[col] = result_df[col].values
+    return pd.DataFrame(data, index=result_df.index)
+
+
+def drop_duplicate_cities(df: pd.DataFrame, city_col) -> pd.DataFrame:
+    """
+    Оставляет первую строку для каждого города (сравнение по нормализованному названию)
+
+    Повторы находятся по 64-битным хэшам нормализованных значений
+    (pd.util.hash_pandas_object) - сравниваются целые числа, а не строки,
+    и без временного служебного столбца в df и последующего drop.
+
+    Args:
+        df: DataFrame выгрузки
+        city_col: Столбец с городом
+
+    Returns:
+        pd.DataFrame: Строки df без повторов города (индекс сохраняется)
+
+    Examples:
+        >>> df = pd.DataFrame({'Город': ['Москва', 'москва ', 'Клин']})
+        >>> drop_duplicate_cities(df, 'Город')['Город'].tolist()
+        ['Москва', 'Клин']
+    """
+    keys = pd.util.hash_pandas_object(normalize_city_names(df[city_col]), index=False)
+    return df[~keys.duplicated(keep='first').to_numpy()]
+
+
+def apply_unified_mapping(
+    df: pd.DataFrame,
+    unified_mapping: Dict[str, str],
+    hh_areas: Dict,
+    update_status: bool = True,
+    hh_lookup: pd.DataFrame = None
+) -> None:
+    """
+    Применяет изменения единой сверки {нормализованное название: новое значение} к df на месте
+
+    Ключ строки - нормализованное str(исходное название). Новые значения находятся
+    одним map по словарю, затем каждый столбец обновляется одним присваиванием
+    для всех затронутых строк - без iterrows и .at по каждой строке.
+
+    Args:
+        df: Результат сопоставления (изменяется на месте)
+        unified_mapping: Изменения {нормализованное название: новое значение}
+        hh_areas: Справочник регионов HH.ru
+        update_status: Пересчитывать ли "Статус" у сопоставленных строк по "Совпадение %"
+        hh_lookup: Готовая таблица get_hh_lookup(hh_areas) (по умолчанию строится из hh_areas)
+
+    Examples:
+        >>> apply_unified_mapping(result_df, {'питер': 'Санкт-Петербург'}, hh_areas)
+        >>> result_df.loc[result_df['Исходное название'] == 'Питер', 'Итоговое гео'].iloc[0]
+        'Санкт-Петербург'
+    """
+    if not unified_mapping or len(df) == 0:
+        return
+
+    originals = df['Исходное название'].astype(str)
+    new_values = normalize_city_names(originals).map(unified_mapping)
+    new_values = new_values[new_values.notna().to_numpy()]
+    if len(new_values) == 0:
+        return
+
+    is_no_match = (new_values == "❌ Нет совпадения").to_numpy()
+
+    no_match_idx = new_values.index[is_no_match]
+    if len(no_match_idx) > 0:
+        df.loc[no_match_idx, ['Итоговое гео', 'ID HH', 'Регион', 'Совпадение %', 'Изменение', 'Статус']] = [
+            None, None, None, 0, 'Нет', '❌ Не найдено'
+        ]
+
+    matched_values = new_values[~is_no_match]
+    if len(matched_values) == 0:
+        return
+
+    df.loc[matched_values.index, 'Итоговое гео'] = matched_values
+
+    # ID и регион - только для городов из справочника
+    if hh_lookup is None:
+        hh_lookup = get_hh_lookup(hh_areas)
+    positions = hh_lookup.index.get_indexer(matched_values)
+    in_hh = positions >= 0
+    if in_hh.any():
+        df.loc[matched_values.index[in_hh], ['ID HH', 'Регион']] = hh_lookup.to_numpy()[positions[in_hh]]
+
+    # То же, что check_if_changed: сравнение без крайних пробелов
+    changed = (
+        originals[matched_values.index].str.strip().to_numpy()
+        != matched_values.astype(str).str.strip().to_numpy()
+    )
+    df.loc[matched_values.index, 'Изменение'] = np.where(changed, 'Да', 'Нет')
+
+    if update_status:
+        scores = df.loc[matched_values.index, 'Совпадение %'].to_numpy(dtype=float)
+        df.loc[matched_values.index, 'Статус'] = np.where(scores >= 95, '✅ Точное', '⚠️ Похожее')
+
+
 def remove_header_row_if_needed(df: pd.DataFrame, first_col_name: str) -> pd.DataFrame:
     """
     Удаляет первую строку, если она является заголовком (не реальными данными города)
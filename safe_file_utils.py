@@ -21,16 +21,20 @@ DATA_DIR.mkdir(exist_ok=True)
 STATIC_DIR.mkdir(exist_ok=True)
 
 
-def safe_open_image(filename: str, search_in_base: bool = True) -> Optional[Image.Image]:
+# Допустимые расширения файлов изображений
+ALLOWED_IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.eps', '.gif', '.bmp']
+
+
+def _resolve_image_path(filename: str, search_in_base: bool = True) -> Optional[Path]:
     """
-    Безопасное открытие изображения с защитой от Path Traversal
+    Находит файл изображения в assets/ (или в корне проекта) и проверяет путь
 
     Args:
         filename: Имя файла (без пути или относительный путь)
         search_in_base: Искать в корневой директории если не найдено в assets
 
     Returns:
-        PIL Image объект или None если файл не найден/ошибка
+        Path к существующему файлу изображения или None если файл не найден/небезопасен
     """
     # Сначала ищем в assets/
     file_path = ASSETS_DIR / filename
@@ -52,12 +56,29 @@ def safe_open_image(filename: str, search_in_base: bool = True) -> Optional[Imag
         return None
 
     # Проверка что это действительно изображение
-    allowed_extensions = ['.png', '.jpg', '.jpeg', '.eps', '.gif', '.bmp']
-    if file_path.suffix.lower() not in allowed_extensions:
+    if file_path.suffix.lower() not in ALLOWED_IMAGE_EXTENSIONS:
         logger.error(f"Недопустимое расширение изображения: {file_path.suffix}")
         log_security_event('invalid_image_extension', str(file_path), 'WARNING')
         return None
 
+    return file_path
+
+
+def safe_open_image(filename: str, search_in_base: bool = True) -> Optional[Image.Image]:
+    """
+    Безопасное открытие изображения с защитой от Path Traversal
+
+    Args:
+        filename: Имя файла (без пути или относительный путь)
+        search_in_base: Искать в корневой директории если не найдено в assets
+
+    Returns:
+        PIL Image объект или None если файл не найден/ошибка
+    """
+    file_path = _resolve_image_path(filename, search_in_base)
+    if file_path is None:
+        return None
+
     try:
         logger.debug(f"Открытие изображения: {file_path}")
         image = Image.open(file_path)
@@ -67,6 +88,32 @@ def safe_open_image(filename: str, search_in_base: bool = True) -> Optional[Imag
         return None
 
 
+def safe_read_image_bytes(filename: str, search_in_base: bool = True) -> Optional[bytes]:
+    """
+    Безопасное чтение файла изображения как есть (без декодирования через PIL)
+
+    Используется, когда нужны исходные байты файла (например, для base64 в HTML):
+    не требует декодирования и повторного кодирования изображения.
+
+    Args:
+        filename: Имя файла (без пути или относительный путь)
+        search_in_base: Искать в корневой директории если не найдено в assets
+
+    Returns:
+        Содержимое файла или None если файл не найден/ошибка
+    """
+    file_path = _resolve_image_path(filename, search_in_base)
+    if file_path is None:
+        return None
+
+    try:
+        logger.debug(f"Чтение изображения: {file_path}")
+        return file_path.read_bytes()
+    except Exception as e:
+        logger.error(f"Ошибка чтения изображения {file_path}: {e}")
+        return None
+
+
 def safe_read_csv(
     filename: str,
     sep: str = ',',
@@ -306,7 +306,7 @@ def sanitize_csv_content(df) -> Any:
     import pandas as pd
 
     for col in df.columns:
-        if df[col].dtype == 'object':
+        if df[col].dtype == 'object' or isinstance(df[col].dtype, pd.CategoricalDtype):
             # Удаляем формулы Excel (=, +, -, @)
             df[col] = df[col].astype(str).str.replace(
                 r'^[=+\-@]', '', regex=True
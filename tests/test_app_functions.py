@@ -57,6 +57,23 @@ class TestCachedFunctions:
         assert len(result) == 3  # Только российские
         assert 'Город3' not in result
 
+    def test_get_russian_city_index_cached_normalizes_names(self):
+        """Проверка что индекс содержит нормализованные названия в том же порядке"""
+        from app import get_russian_city_index_cached
+
+        get_russian_city_index_cached.clear()
+
+        mock_hh_areas = {
+            'Королёв': {'root_parent_id': '113'},
+            'London': {'root_parent_id': '5'},
+            'Нижний  Новгород': {'root_parent_id': '113'}
+        }
+
+        names, names_norm = get_russian_city_index_cached(mock_hh_areas)
+
+        assert names == ['Королёв', 'Нижний  Новгород']
+        assert names_norm == ['королев', 'нижний новгород']
+
     def test_prepare_city_options_returns_tuple(self):
         """Проверка что prepare_city_options возвращает кортеж"""
         from app import prepare_city_options
@@ -66,12 +83,13 @@ class TestCachedFunctions:
         current_match = 95.5
         city_name = 'Москва'
 
-        options, candidates_dict = prepare_city_options(
+        options, candidates_dict, option_cities = prepare_city_options(
             candidates, current_value, current_match, city_name
         )
 
         assert isinstance(options, tuple)
         assert isinstance(candidates_dict, dict)
+        assert isinstance(option_cities, dict)
         assert len(options) > 0
         assert '❌ Нет совпадения' in options
 
@@ -80,7 +98,7 @@ class TestCachedFunctions:
         from app import prepare_city_options
 
         candidates = (('Москва', 95.5),)
-        options, _ = prepare_city_options(candidates, 'Москва', 95.5, 'Москва')
+        options, _, _ = prepare_city_options(candidates, 'Москва', 95.5, 'Москва')
 
         assert options[0] == '❌ Нет совпадения'
 
@@ -94,23 +112,87 @@ class TestCachedFunctions:
             ('Город3', 85.0)
         )
 
-        options, _ = prepare_city_options(candidates, '', 0, 'test')
+        options, _, _ = prepare_city_options(candidates, '', 0, 'test')
 
         # Пропускаем первый элемент (❌ Нет совпадения)
         # Второй должен быть с наивысшим процентом
         assert '95.0%' in options[1]
 
+    def test_prepare_city_options_reuses_options_object(self):
+        """Повторный вызов возвращает тот же объект options (стабильный для selectbox)"""
+        from app import prepare_city_options
+
+        candidates = (('Москва', 95.0), ('Московский', 85.0))
+        options_first, _, _ = prepare_city_options(candidates, '', 0, 'test')
+        options_second, _, _ = prepare_city_options(candidates, '', 0, 'test')
+
+        assert options_first is options_second
+
     def test_prepare_city_options_creates_correct_dict(self):
         """Проверка создания словаря для O(1) поиска"""
         from app import prepare_city_options
 
         candidates = (('Москва', 95.0), ('Московский', 85.0))
-        _, candidates_dict = prepare_city_options(candidates, '', 0, 'test')
+        _, candidates_dict, _ = prepare_city_options(candidates, '', 0, 'test')
 
         assert 'Москва' in candidates_dict
         assert 'Московский' in candidates_dict
         assert candidates_dict['Москва'] >= 0  # Индекс должен быть неотрицательным
 
+    def test_prepare_city_options_maps_options_to_cities(self):
+        """Каждой строке options соответствует название города без процента"""
+        from app import prepare_city_options
+
+        candidates = (('Иваново (Ивановская область)', 95.0), ('Москва', 85.0))
+        options, _, option_cities = prepare_city_options(candidates, '', 0, 'test')
+
+        assert set(option_cities) == set(options)
+        assert option_cities['Иваново (Ивановская область) (95.0%)'] == 'Иваново (Ивановская область)'
+        assert option_cities['❌ Нет совпадения'] == '❌ Нет совпадения'
+
+    def test_excel_exports_do_not_modify_input(self):
+        """Выгрузка вкладки и архив санитизируют копию - одинаковое содержимое при любом состоянии кэша"""
+        import io
+        import zipfile
+        from app import create_excel_bytes_cached, create_excel_archive_cached
+
+        df = pd.DataFrame({'Город': ['+-5', 'Тверь'], 'X': [None, '=1']})
+        original = df.copy()
+
+        single_bytes = create_excel_bytes_cached(df, 'Лист1')
+        pd.testing.assert_frame_equal(df, original)
+
+        archive_bytes = create_excel_archive_cached({'Лист1.xlsx': df})
+        pd.testing.assert_frame_equal(df, original)
+
+        with zipfile.ZipFile(io.BytesIO(archive_bytes)) as zip_file:
+            archived = pd.read_excel(io.BytesIO(zip_file.read('Лист1.xlsx')))
+        pd.testing.assert_frame_equal(archived, pd.read_excel(io.BytesIO(single_bytes)))
+
+    def test_vacancy_output_preview_is_not_sanitized(self):
+        """Превью вакансии показывает исходные значения, санитизация - только в xlsx"""
+        import io
+        from app import build_vacancy_output_cached
+
+        vacancy_df = pd.DataFrame({
+            'Исходное название': ['Тверь', 'Клин'],
+            'Итоговое гео': ['Тверь', 'Клин'],
+            'Совпадение %': [100.0, 100.0],
+            'Статус': ['✅ Точное', '✅ Точное'],
+            'Вакансия': ['Кассир', 'Кассир'],
+            'Комментарий': ['=1+1', None]
+        })
+
+        preview_df, excel_bytes = build_vacancy_output_cached(
+            'test_preview_not_sanitized', 'Кассир', {}, (),
+            ('Город', 'Вакансия', 'Комментарий'), 'Вакансия', vacancy_df, {}
+        )
+
+        assert preview_df['Комментарий'].iloc[0] == '=1+1'
+        assert pd.isna(preview_df['Комментарий'].iloc[1])
+        exported = pd.read_excel(io.BytesIO(excel_bytes))
+        assert exported['Комментарий'].iloc[0] == '1+1'
+
 
 class TestApplyManualSelections:
     """Тесты для функции apply_manual_selections_cached"""
@@ -252,6 +334,140 @@ class TestDataProcessing:
         pd.testing.assert_frame_equal(df, original_df)
 
 
+    def test_get_status_masks_categorical_matches_object(self):
+        """Маски статусов одинаковы для категориального и обычного столбца"""
+        from modules.utils import get_status_masks
+        from modules.city_matcher import MATCH_STATUSES
+
+        values = ['❌ Не найдено', '🔄 Дубликат (результат HH)', None, '❌ Пустое значение', '✅ Точное']
+        masks_categorical = get_status_masks(pd.Series(pd.Categorical(values, categories=MATCH_STATUSES)))
+        masks_object = get_status_masks(pd.Series(values, dtype=object))
+
+        assert masks_categorical['not_found'].tolist() == [True, False, False, False, False]
+        assert masks_categorical['duplicate'].tolist() == [False, True, False, False, False]
+        assert masks_categorical['empty'].tolist() == [False, False, False, True, False]
+        for key in masks_object:
+            assert masks_categorical[key].tolist() == masks_object[key].tolist()
+
+    def test_prepare_editable_rows_dedups_and_sorts(self):
+        """Проверка удаления повторов исходного названия и порядка строк для редактирования"""
+        from modules.utils import prepare_editable_rows
+
+        df = pd.DataFrame({
+            'Исходное название': ['Москва', 'москва ', 'Питер', 'Тверь'],
+            'Статус': ['⚠️ Похожее', '⚠️ Похожее', '❌ Не найдено', '⚠️ Похожее'],
+            'Совпадение %': [90.0, 90.0, 0, 70.0]
+        })
+
+        result = prepare_editable_rows(df)
+
+        assert result['Исходное название'].tolist() == ['Питер', 'Тверь', 'Москва']
+        # Индекс исходных строк сохраняется, служебные столбцы не добавляются
+        assert result.index.tolist() == [2, 3, 0]
+        assert list(result.columns) == list(df.columns)
+
+    def test_group_manual_selections_by_sheet(self):
+        """Изменения раскладываются по вкладкам, ключи без вкладки возвращаются отдельно"""
+        from modules.utils import group_manual_selections
+
+        selections = {('Лист1', 0): 'Москва', ('Лист2', 0): 'Клин', ('Лист1', 3): '❌ Нет совпадения', 7: 'Тверь'}
+
+        by_sheet, common = group_manual_selections(selections)
+
+        assert by_sheet == {'Лист1': {0: 'Москва', 3: '❌ Нет совпадения'}, 'Лист2': {0: 'Клин'}}
+        assert common == {7: 'Тверь'}
+
+    def test_drop_duplicate_cities_keeps_first_normalized(self):
+        """Повторы города определяются по нормализованному названию, служебный столбец не остается"""
+        from modules.utils import drop_duplicate_cities
+
+        df = pd.DataFrame({
+            'Город': ['Королёв', 'КОРОЛЕВ ', 'Нижний  Новгород', 'нижний новгород', None],
+            'Вакансия': ['A', 'B', 'C', 'D', 'E']
+        })
+
+        result = drop_duplicate_cities(df, 'Город')
+
+        assert result['Вакансия'].tolist() == ['A', 'C', 'E']
+        assert result.index.tolist() == [0, 2, 4]
+        assert list(result.columns) == ['Город', 'Вакансия']
+
+    def test_build_export_frame_puts_final_geo_first(self):
+        """Первый столбец выгрузки - итоговое гео, пропущенные и отсутствующие столбцы не попадают"""
+        from modules.utils import build_export_frame
+
+        df = pd.DataFrame({
+            'Итоговое гео': ['Москва', 'Клин'],
+            'Город': ['Мск', 'клин'],
+            'Вакансия': ['A', 'B'],
+            'Зарплата': [100, 200]
+        }, index=[3, 7])
+
+        result = build_export_frame(df, ['Город', 'Вакансия', 'Зарплата', 'Нет такого'], skip_cols=('Вакансия',))
+
+        assert list(result.columns) == ['Город', 'Зарплата']
+        assert result['Город'].tolist() == ['Москва', 'Клин']
+        assert result.index.tolist() == [3, 7]
+
+    def test_select_export_rows_excludes_not_found_repeats(self):
+        """Исключаются не найденные строки и все повторы не найденных городов"""
+        from modules.utils import select_export_rows
+
+        df = pd.DataFrame({
+            'Исходное название': ['Лондон', 'лондон ', 'Клин', '', None],
+            'Итоговое гео': [None, 'Лонгйир', 'Клин', 'Тверь', None],
+            'Статус': ['❌ Не найдено', '⚠️ Похожее', '✅ Точное', 'Пустое значение', '❌ Не найдено']
+        })
+
+        assert select_export_rows(df).index.tolist() == [2]
+        assert select_export_rows(df, exclude_empty=False).index.tolist() == [2, 3]
+
+    def test_get_hh_lookup_indexes_by_name(self):
+        """Таблица справочника HH: ID и регион по названию города"""
+        from modules.utils import get_hh_lookup
+
+        lookup = get_hh_lookup({
+            'Москва': {'id': '1', 'parent': '113'},
+            'Клин': {'id': '2000', 'parent': '2019'}
+        })
+
+        assert lookup.index.tolist() == ['Москва', 'Клин']
+        assert lookup.loc['Клин'].tolist() == ['2000', '2019']
+
+    def test_category_isin_matches_isin(self):
+        """Выбор по кодам категорий совпадает с isin по строкам"""
+        from modules.utils import category_isin
+
+        cities = pd.Series(['Москва', 'Клин', None, 'Тверь', 'Клин'])
+        categorical = cities.astype('category')
+
+        for selected in (['Клин'], ['Клин', 'Москва'], ['Нет такого'], []):
+            assert category_isin(categorical, selected).tolist() == cities.isin(selected).tolist()
+
+    def test_apply_unified_mapping_updates_all_duplicates(self):
+        """Изменение единой сверки применяется ко всем строкам с тем же нормализованным названием"""
+        from modules.utils import apply_unified_mapping
+
+        hh_areas = {'Санкт-Петербург': {'id': '2', 'parent': '145'}}
+        df = pd.DataFrame({
+            'Исходное название': ['Питер', 'питер ', 'Мск', 'Клин'],
+            'Итоговое гео': ['Пермь', 'Пермь', 'Москва', 'Клин'],
+            'ID HH': ['72', '72', '1', '2000'],
+            'Регион': ['1317', '1317', '1', '2019'],
+            'Совпадение %': [80.0, 80.0, 99.0, 100.0],
+            'Изменение': ['Да', 'Да', 'Да', 'Нет'],
+            'Статус': ['⚠️ Похожее', '⚠️ Похожее', '✅ Точное', '✅ Точное']
+        })
+
+        apply_unified_mapping(df, {'питер': 'Санкт-Петербург', 'мск': '❌ Нет совпадения'}, hh_areas)
+
+        assert df['Итоговое гео'].tolist()[:2] == ['Санкт-Петербург', 'Санкт-Петербург']
+        assert df['ID HH'].tolist()[:2] == ['2', '2']
+        assert df.loc[2, 'Статус'] == '❌ Не найдено'
+        assert pd.isna(df.loc[2, 'Итоговое гео'])
+        assert df.loc[3].tolist() == ['Клин', 'Клин', '2000', '2019', 100.0, 'Нет', '✅ Точное']
+
+
 class TestIntegration:
     """Интеграционные тесты"""
 
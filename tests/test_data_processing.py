@@ -0,0 +1,92 @@
+"""
+Unit тесты для функций обработки данных
+"""
+import pytest
+import sys
+import os
+
+# Добавляем родительскую директорию в путь для импорта modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.data_processing import (
+    parse_utc_offset_hours,
+    get_federal_district_by_region,
+    load_population_data,
+    get_cities_by_regions,
+    get_all_cities
+)
+
+
+class TestParseUtcOffsetHours:
+    """Тесты для функции parse_utc_offset_hours"""
+
+    def test_positive_offset(self):
+        """Проверка положительного смещения"""
+        assert parse_utc_offset_hours("+03:00") == 3
+        assert parse_utc_offset_hours("+12:00") == 12
+
+    def test_negative_offset(self):
+        """Проверка отрицательного смещения"""
+        assert parse_utc_offset_hours("-05:00") == -5
+
+    def test_invalid_offset(self):
+        """Проверка некорректного значения"""
+        assert parse_utc_offset_hours("abc") == 0
+
+
+class TestGetFederalDistrictByRegion:
+    """Тесты для функции get_federal_district_by_region"""
+
+    def test_known_region(self):
+        """Проверка известного региона"""
+        assert get_federal_district_by_region("Московская область") == "Центральный федеральный округ"
+
+    def test_normalized_lookup(self):
+        """Проверка поиска без учета регистра и ё/е"""
+        assert get_federal_district_by_region("  московская  область ") == "Центральный федеральный округ"
+        assert get_federal_district_by_region("Республика Северная Осетия — Алания") == "Северо-Кавказский федеральный округ"
+
+    def test_unknown_region(self):
+        """Проверка неизвестного региона"""
+        assert get_federal_district_by_region("Неизвестный регион") == "Не определен"
+
+
+class TestLoadPopulationData:
+    """Тесты для функции load_population_data"""
+
+    def test_population_values_are_int(self):
+        """Проверка словаря {город: население} с целыми значениями"""
+        population = load_population_data()
+        assert population.get('Москва', 0) > 0
+        assert all(isinstance(value, int) for value in population.values())
+
+
+class TestGetCitiesByRegions:
+    """Тесты для функций get_cities_by_regions и get_all_cities"""
+
+    AREAS = {
+        'Москва': {'id': '1', 'parent': None, 'root_parent_id': '113', 'utc_offset': '+03:00'},
+        'Московская область': {'id': '2019', 'parent': 'Россия', 'root_parent_id': '113', 'utc_offset': '+03:00'},
+        'Клин': {'id': '5', 'parent': 'Московская область', 'root_parent_id': '113', 'utc_offset': '+03:00'},
+        'Королёв': {'id': '6', 'parent': 'Московская область', 'root_parent_id': '113', 'utc_offset': '+03:00'},
+        'Королев': {'id': '7', 'parent': 'Московская область', 'root_parent_id': '113', 'utc_offset': '+03:00'},
+        'Киев': {'id': '9', 'parent': 'Украина', 'root_parent_id': '5', 'utc_offset': '+02:00'},
+    }
+
+    def test_all_cities_excludes_regions_and_duplicates(self):
+        """Проверка что области и дубликаты (ё/е) не попадают в список"""
+        df = get_all_cities(self.AREAS)
+        assert df['Город'].tolist() == ['Москва', 'Клин', 'Королёв']
+        assert '_город_normalized' not in df.columns
+
+    def test_exact_region_match(self):
+        """Проверка что "Москва" не совпадает с "Московская область" как подстрока"""
+        df = get_cities_by_regions(self.AREAS, ['Москва'])
+        assert df['Город'].tolist() == ['Москва']
+
+        df = get_cities_by_regions(self.AREAS, ['московская область'])
+        assert df['Город'].tolist() == ['Клин', 'Королёв']
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,100 @@
+"""
+Unit тесты для утилит экспорта
+"""
+import pytest
+import sys
+import os
+import io
+import zipfile
+import pandas as pd
+
+# Добавляем родительскую директорию в путь для импорта modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.export_utils import (
+    create_excel_zip_archive,
+    create_zip_archive,
+    make_unique_filenames,
+    write_excel_rows
+)
+
+
+class TestCreateExcelZipArchive:
+    """Тесты для функции create_excel_zip_archive"""
+
+    def test_one_excel_file_per_dataframe(self):
+        """Каждый DataFrame записывается в архив отдельным Excel файлом"""
+        frames = {
+            'Вакансия 1.xlsx': pd.DataFrame({'Город': ['Москва', 'Клин']}),
+            'Вакансия 2.xlsx': pd.DataFrame({'Город': ['Тверь']}),
+        }
+
+        zip_buffer = create_excel_zip_archive(frames, sheet_name='Результат')
+
+        with zipfile.ZipFile(zip_buffer) as zip_file:
+            assert zip_file.namelist() == list(frames)
+            for filename, df in frames.items():
+                restored = pd.read_excel(io.BytesIO(zip_file.read(filename)), sheet_name='Результат')
+                pd.testing.assert_frame_equal(restored, df)
+
+
+class TestMakeUniqueFilenames:
+    """Тесты для функции make_unique_filenames"""
+
+    def test_duplicates_get_numeric_suffix(self):
+        """Повторы получают суффикс, первое вхождение и порядок сохраняются"""
+        names = ['Продавец_кассир.xlsx', 'Тверь.xlsx', 'Продавец_кассир.xlsx', 'Продавец_кассир.xlsx']
+
+        assert make_unique_filenames(names) == [
+            'Продавец_кассир.xlsx', 'Тверь.xlsx', 'Продавец_кассир (2).xlsx', 'Продавец_кассир (3).xlsx'
+        ]
+
+    def test_suffix_skips_existing_names(self):
+        """Суффикс не совпадает с уже существующим именем"""
+        names = ['a.xlsx', 'a (2).xlsx', 'a.xlsx']
+
+        result = make_unique_filenames(names)
+        assert len(set(result)) == len(names)
+        assert result == ['a.xlsx', 'a (2).xlsx', 'a (3).xlsx']
+
+
+class TestCreateZipArchive:
+    """Тесты для функции create_zip_archive"""
+
+    def test_stored_entries_keep_content(self):
+        """Элементы архива без сжатия сохраняют содержимое как есть"""
+        files = {'a.xlsx': b'first', 'b.xlsx': b'second'}
+
+        zip_buffer = create_zip_archive(files, compression=zipfile.ZIP_STORED)
+
+        with zipfile.ZipFile(zip_buffer) as zip_file:
+            assert all(info.compress_type == zipfile.ZIP_STORED for info in zip_file.infolist())
+            assert {name: zip_file.read(name) for name in zip_file.namelist()} == files
+
+
+class TestWriteExcelRows:
+    """Тесты для функции write_excel_rows"""
+
+    def test_roundtrip_with_empty_values(self):
+        """Пустые значения записываются пустыми ячейками"""
+        df = pd.DataFrame({'Город': ['Москва', float('nan'), 'Клин'], 'ID': [1.0, float('nan'), 3.0]})
+        buffer = io.BytesIO()
+
+        write_excel_rows(buffer, df, 'Результат')
+
+        restored = pd.read_excel(io.BytesIO(buffer.getvalue()), sheet_name='Результат')
+        pd.testing.assert_frame_equal(restored, df)
+
+    def test_without_header(self):
+        """Без заголовка записываются только строки данных"""
+        df = pd.DataFrame({'Город': ['Москва', 'Клин']})
+        buffer = io.BytesIO()
+
+        write_excel_rows(buffer, df, 'Гео', include_header=False)
+
+        restored = pd.read_excel(io.BytesIO(buffer.getvalue()), sheet_name='Гео', header=None)
+        assert restored[0].tolist() == ['Москва', 'Клин']
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -4,11 +4,18 @@ Unit тесты для функций сопоставления городов
 import pytest
 import sys
 import os
+import pandas as pd
+from unittest.mock import patch
 
 # Добавляем родительскую директорию в путь для импорта modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from modules.matching import normalize_city_name, get_candidates_by_word, extract_city_and_region
+from modules.matching import (
+    normalize_city_name,
+    get_candidates_by_word,
+    extract_city_and_region,
+    build_name_ngram_index
+)
 
 
 class TestNormalizeCityName:
@@ -68,6 +75,35 @@ class TestGetCandidatesByWord:
         # Может быть 0 или низкие совпадения
         assert isinstance(candidates, list)
     
+    def test_scores_match_wratio(self):
+        """Проверка что пакетный подсчет score совпадает с fuzz.WRatio"""
+        from rapidfuzz import fuzz
+
+        cities = ["Москва", "Московский", "Новомосковск"]
+
+        candidates = get_candidates_by_word("Москва", cities, limit=5)
+        for city, score in candidates:
+            expected = fuzz.WRatio("москва", normalize_city_name(city))
+            assert score == pytest.approx(expected)
+
+    def test_precomputed_normalized_names(self):
+        """Проверка что заранее нормализованный справочник дает тот же результат"""
+        cities = ["Королёв", "Москва", "Московский", "Новомосковск"]
+        cities_norm = [normalize_city_name(city) for city in cities]
+
+        assert (get_candidates_by_word("Москва", cities, hh_city_names_norm=cities_norm) ==
+                get_candidates_by_word("Москва", cities))
+
+    def test_ngram_index_gives_same_candidates(self):
+        """Проверка что индекс триграмм не меняет список кандидатов"""
+        cities = ["Королёв", "Москва", "Московский", "Новомосковск", "Подмосковье", "Тверь", "Мо"]
+        cities_norm = [normalize_city_name(city) for city in cities]
+        ngrams = build_name_ngram_index(cities_norm)
+
+        for query in ["Москва", "Моск", "ковск", "Мо", "Королев", "Лондон"]:
+            assert (get_candidates_by_word(query, cities, hh_city_names_norm=cities_norm, hh_name_ngrams=ngrams) ==
+                    get_candidates_by_word(query, cities, hh_city_names_norm=cities_norm))
+
     def test_limit_parameter(self):
         """Проверка работы параметра limit"""
         cities = ["Москва", "Московский", "Москва-Сити", "Подмосковье", "Новомосковск"]
@@ -98,6 +134,66 @@ class TestExtractCityAndRegion:
         assert region == ""
 
 
+class TestSmartMatchCity:
+    """Тесты для функции smart_match_city"""
+
+    def test_preferred_match_skips_word_candidates(self):
+        """Проверка что для PREFERRED_MATCHES кандидаты не вычисляются"""
+        from modules.city_matcher import smart_match_city
+
+        cities = ["Иваново (Ивановская область)", "Иваново (Другая область)"]
+
+        match, candidates = smart_match_city("Иваново", cities, {})
+        assert match[0] == "Иваново (Ивановская область)"
+        assert candidates == []
+
+    def test_exact_normalized_match_fast_path(self):
+        """Проверка точного совпадения по индексу нормализованных названий"""
+        from modules.city_matcher import smart_match_city
+
+        cities = ["Королёв", "Королевский"]
+        norm_to_name = {"королев": "Королёв", "королевский": "Королевский"}
+
+        match, candidates = smart_match_city("г. Королев", cities, {}, hh_norm_to_name=norm_to_name)
+        assert match == ("Королёв", 100.0, 0)
+        assert candidates == []
+
+    def test_word_candidate_threshold_decides_match(self):
+        """Лучший кандидат по слову принимается только при score не ниже порога"""
+        from modules.city_matcher import smart_match_city
+
+        cities = ["Тверь", "Тверская Поляна"]
+
+        match, candidates = smart_match_city("Тверь", cities, {}, threshold=85)
+        assert match == ("Тверь", candidates[0][1], 0)
+
+        match, candidates = smart_match_city("Тверь", cities, {}, threshold=101)
+        assert match is None
+        assert candidates[0][0] == "Тверь"
+
+
+class TestMatchCities:
+    """Тесты для функции match_cities"""
+
+    def test_candidates_go_to_passed_dict_without_ui(self):
+        """Кандидаты пишутся в переданный словарь, прогресс-бар не рисуется"""
+        from modules.city_matcher import match_cities
+
+        hh_areas = {'Тверь': {'id': '4', 'name': 'Тверь', 'parent': 'Тверская область', 'root_parent_id': '113'}}
+        df = pd.DataFrame({'Город': ['Тверь', 'Твер']})
+        candidates_cache = {}
+
+        with patch('modules.city_matcher.st') as mock_st:
+            result_df, _, _, _ = match_cities(
+                df, hh_areas, sheet_name='Лист1',
+                candidates_cache=candidates_cache, show_progress=False
+            )
+
+        assert mock_st.method_calls == []
+        assert set(candidates_cache) == {('Лист1', 0), ('Лист1', 1)}
+        assert result_df['Итоговое гео'].tolist() == ['Тверь', 'Тверь']
+
+
 class TestIntegration:
     """Интеграционные тесты"""
     
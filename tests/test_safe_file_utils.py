@@ -15,6 +15,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from safe_file_utils import (
     safe_open_image,
+    safe_read_image_bytes,
     safe_read_csv,
     safe_read_file,
     get_asset_path,
@@ -68,6 +69,26 @@ class TestSafeOpenImage:
         assert result is None
 
 
+class TestSafeReadImageBytes:
+    """Тесты для функции safe_read_image_bytes"""
+
+    def test_path_traversal_protection(self):
+        """Проверка защиты от path traversal"""
+        result = safe_read_image_bytes("../../etc/passwd")
+        assert result is None
+
+    def test_nonexistent_file(self):
+        """Проверка обработки несуществующего файла"""
+        result = safe_read_image_bytes("nonexistent_image_12345.png")
+        assert result is None
+
+    def test_returns_file_bytes_unchanged(self):
+        """Байты файла возвращаются как есть, без перекодирования"""
+        result = safe_read_image_bytes("synchronize.png")
+        assert result is not None
+        assert result == (Path(__file__).parent.parent / "assets" / "synchronize.png").read_bytes()
+
+
 class TestSafeReadCsv:
     """Тесты для функции safe_read_csv"""
 